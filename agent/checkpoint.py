@@ -0,0 +1,204 @@
+import json, os, pickle, queue, struct, threading, time
+
+import numpy as np
+
+
+"""
+Columnar q-table checkpoint (.qtab), laid out so a loaded table can be memory-mapped in place:
+    magic (8 bytes) | header length (uint64) | JSON header | padding to 64 bytes
+    sorted state keys (int64, n) | q-values (float32, n x actions) | counts (uint32, n x actions)
+The header holds the agent's settings (actions, discount, alpha, init_q, policy, state function...)
+
+Training runs checkpoint incrementally into a directory (DeltaCheckpointer):
+    base.qtab - compacted table, header also holds the run's history
+    delta.log - pickled records appended since, each w/ only the rows changed since the previous record
+"""
+
+MAGIC = b"QTAB\x00\x00\x00\x01"
+_ALIGN = 64
+
+def is_qtab(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_qtab(path, header, keys, q, counts):
+    # Sorted keys let readers binary search the mapped file
+    order = np.argsort(keys, kind="stable")
+    keys = np.ascontiguousarray(keys[order], dtype=np.int64)
+    q = np.ascontiguousarray(q[order], dtype=np.float32)
+    counts = np.ascontiguousarray(counts[order], dtype=np.uint32)
+    header = dict(header, states=len(keys))
+    header_bytes = json.dumps(header, default=_json_default).encode()
+    data_offset = _aligned(len(MAGIC) + 8 + len(header_bytes))
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\x00" * (data_offset - f.tell()))
+        for array in (keys, q, counts):
+            f.write(array.tobytes())
+            f.write(b"\x00" * (_aligned(f.tell()) - f.tell()))
+
+# Returns (header, keys, q, counts), arrays are read-only maps of the file unless mmap is False
+def read_qtab(path, mmap=True):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a .qtab checkpoint")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    n, actions = header["states"], header["actions"]
+    offset = _aligned(len(MAGIC) + 8 + header_length)
+    arrays = []
+    for dtype, shape in ((np.int64, (n,)), (np.float32, (n, actions)), (np.uint32, (n, actions))):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if mmap and n:
+            array = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            array = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        arrays.append(array)
+        offset = _aligned(offset + nbytes)
+    return (header, *arrays)
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+# numpy scalars (e.g. rewards in history) -> python numbers
+def _json_default(value):
+    return value.item()
+
+BASE_FILE = "base.qtab"
+DELTA_FILE = "delta.log"
+
+# Writes delta records from a background thread every `every_episodes` episodes or `every_seconds` seconds,
+# compacting the log into the base every `compact_every` records
+class DeltaCheckpointer:
+    # start_episode: episodes already in the run's history (resumed runs), the first interval counts from there
+    def __init__(self, directory, state_function, every_episodes=5, every_seconds=600, compact_every=10, resume=False, start_episode=0):
+        os.makedirs(directory, exist_ok=True)
+        # A new run needs an empty directory, a resumed one keeps appending; an earlier run's checkpoint is
+        # never overwritten by accident
+        if not resume:
+            existing = [name for name in (BASE_FILE, DELTA_FILE) if os.path.exists(os.path.join(directory, name))]
+            if existing:
+                raise FileExistsError(
+                    f"{directory} holds a checkpoint ({', '.join(existing)}), resume it (--resume) or move it away first"
+                )
+        self.directory = directory
+        self.every_episodes = every_episodes
+        self.every_seconds = every_seconds
+        self.compact_every = compact_every
+        self._state_function_name = state_function.__name__
+        self._last_episode, self._last_time = start_episode, time.monotonic()
+        self._records = 0
+        self._error = None
+        self._jobs = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def maybe_checkpoint(self, agent, history):
+        episode = len(history["reward"])
+        if episode - self._last_episode >= self.every_episodes or time.monotonic() - self._last_time >= self.every_seconds:
+            self.checkpoint(agent, history)
+
+    # Snapshot is copied here, between episodes, so the writer thread never reads live tables
+    def checkpoint(self, agent, history):
+        if self._error is not None:
+            raise RuntimeError("checkpoint writer failed") from self._error
+        keys, q, counts = agent.table.take_dirty()
+        record = dict(
+            header=agent.header(self._state_function_name),
+            history={name: list(values) for name, values in history.items()},
+            keys=keys, q=q, counts=counts,
+        )
+        self._jobs.put(("delta", record))
+        self._records += 1
+        if self._records >= self.compact_every:
+            self._jobs.put(("compact", None))
+            self._records = 0
+        self._last_episode, self._last_time = len(history["reward"]), time.monotonic()
+
+    # Final checkpoint + compaction, waits for the writer to finish
+    def close(self, agent, history):
+        self.checkpoint(agent, history)
+        self._jobs.put(("compact", None))
+        self._jobs.put(None)
+        self._writer.join()
+        if self._error is not None:
+            raise RuntimeError("checkpoint writer failed") from self._error
+
+    def _write_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            kind, record = job
+            try:
+                if kind == "delta":
+                    with open(os.path.join(self.directory, DELTA_FILE), "ab") as f:
+                        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        f.flush()
+                        os.fsync(f.fileno())
+                else:
+                    compact_run(self.directory)
+            except Exception as e:
+                self._error = e
+
+# Base + every complete delta record, later records win; returns (header, history, keys, q, counts)
+def read_run(directory):
+    header, history, parts = None, {"reward": [], "steps": []}, []
+    base_path = os.path.join(directory, BASE_FILE)
+    if os.path.exists(base_path):
+        header, keys, q, counts = read_qtab(base_path, mmap=False)
+        history = header.pop("history", history)
+        parts.append((keys, q, counts))
+    delta_path = os.path.join(directory, DELTA_FILE)
+    if os.path.exists(delta_path):
+        with open(delta_path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                # A crash mid-write leaves a truncated last record, everything before it is intact
+                except (EOFError, ValueError, pickle.UnpicklingError):
+                    break
+                header, history = record["header"], record["history"]
+                parts.append((record["keys"], record["q"], record["counts"]))
+    if header is None:
+        raise FileNotFoundError(f"no checkpoint in {directory}")
+
+    keys = np.concatenate([part[0] for part in parts]).astype(np.int64)
+    q = np.concatenate([part[1].reshape(-1, header["actions"]) for part in parts])
+    counts = np.concatenate([part[2].reshape(-1, header["actions"]) for part in parts])
+    # Last occurrence of each key = its newest value
+    unique_keys, reversed_index = np.unique(keys[::-1], return_index=True)
+    latest = len(keys) - 1 - reversed_index
+    return header, history, unique_keys, q[latest], counts[latest]
+
+# Folds the delta log into a new base, replacing it atomically
+def compact_run(directory):
+    header, history, keys, q, counts = read_run(directory)
+    base_path = os.path.join(directory, BASE_FILE)
+    write_qtab(base_path + ".tmp", dict(header, history=history), keys, q, counts)
+    os.replace(base_path + ".tmp", base_path)
+    # Replaying a log already folded in is harmless, so a crash before this truncate loses nothing
+    open(os.path.join(directory, DELTA_FILE), "wb").close()
+
+# Resuming w/ other settings (state function, config) than the checkpointed run would silently mix 2 runs,
+# saved and expected are agent headers
+def check_resume(saved, expected):
+    ignored = ("total_steps", "states", "history")
+    differences = [
+        f"{name}: checkpoint {saved.get(name)!r}, now {expected.get(name)!r}"
+        for name in sorted(set(saved) | set(expected))
+        if name not in ignored and saved.get(name) != expected.get(name)
+    ]
+    if differences:
+        raise ValueError("can't resume, the settings differ from the checkpoint's:\n    " + "\n    ".join(differences))
+
+# Writable agent + history from a checkpoint directory, to resume training
+def restore(directory):
+    from agent.q_agent import QLearningAgent
+    header, history, keys, q, counts = read_run(directory)
+    header.pop("states", None)
+    agent = QLearningAgent.from_header(header)
+    agent.table = agent.table_from_arrays(keys, q, counts)
+    return agent, history
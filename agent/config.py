@@ -6,6 +6,27 @@ FRAME_SKIP = 1
 END_ON_LIFE_LOSS = False
 REWARD_CLIP = False
 MAX_STEPS = 1e5
+RESET_NOOP_MAX = 0 # random no-op frames after each snapshot reset, > 0 varies episode starts
+NUM_ENVS = 1 # > 1 runs that many emulators in parallel worker processes
+START_POOL_SIZE = 0 # mid-game snapshots kept to start episodes from, 0 always starts at the maze start
+START_POOL_PROB = 0.5 # share of resets that start from the pool once it has snapshots
+MACRO_ACTIONS = False # hold each action until a junction, a wall or a close ghost (MsPacmanALE.step_option), NUM_ENVS 1 only
+STATE_CACHE_SIZE = 0 # memoized state keys (LRU entries), 0 computes every state; hit rates are in --metrics
+CHECK_STATE_RANGES = False # raise on state values outside their fields' ranges every step, batches are always checked
+
+# Greedy evaluation (--mode eval), episodes played w/ seeds 1000, 1001...
+EVAL_EPISODES = 100
+
+# Play mode video (--record), keeps 1 of every RECORD_EVERY emulated frames (60 / RECORD_EVERY fps)
+RECORD_EVERY = 2
+
+# Background checkpoints (training only), written to <file>.ckpt/
+CHECKPOINT_EVERY_EPISODES = 5
+CHECKPOINT_EVERY_SECONDS = 600
+
+# Actor-learner (train_parallel) settings
+NUM_ACTORS = 0 # 0 = 1 actor per spare core
+SYNC_EVERY = 1e4 # learner updates between q-table copies sent to actors
 
 # Exploration settings
 INIT_Q = 5.0
@@ -16,4 +37,31 @@ EPS_DECAY_STEPS = 5e4
 DISCOUNT = 0.99
 ALPHA = 0.1
 # UCB settings
-UCB_STRENGTH = 1
\ No newline at end of file
+UCB_STRENGTH = 1
+
+# Watkins Q(lambda) settings (--learning q_lambda)
+TRACE_LAMBDA = 0.9
+TRACE_CUTOFF = 0.01 # traces below this are dropped, bounds the pairs updated per step
+
+# Q-table memory budget (training), past it rarely visited states are evicted; 0 = unbounded
+MAX_TABLE_MB = 0
+
+# Linear agent settings (--agent linear)
+LINEAR_FEATURE_BITS = 20 # 2^bits weight rows x 4 actions float32 = 16 MiB
+LINEAR_TILINGS = 4
+LINEAR_TILE_WIDTH = 4
+
+# Experience replay settings, buffer size 0 disables replay
+REPLAY_BUFFER_SIZE = 0
+REPLAY_RATIO = 1 # replayed updates per emulator step
+REPLAY_BATCH_SIZE = 32
+
+# Hyperparameter sweep (--mode sweep), values tried per setting; unlisted ones use the settings above
+SWEEP_SPACE = dict(
+    policy=["eps_greedy", "ucb"],
+    state_function=["coarse_manhattan_distance", "sector_distance_state"],
+    alpha=[0.05, 0.1, 0.2],
+    discount=[0.95, 0.99],
+)
+SWEEP_SEEDS = [0, 1, 2]
+SWEEP_SAMPLES = 0 # 0 = full grid, > 0 = that many random settings from the space
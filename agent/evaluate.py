@@ -0,0 +1,76 @@
+import json
+import multiprocessing as mp
+
+import numpy as np
+
+from emulator.game_env import MsPacmanALE
+from agent import runner, state_functions, nearest_state
+
+"""
+Greedy evaluation of a saved agent: the agent (+ nearest state index) is loaded once and forked into the
+worker processes, which share its arrays copy-on-write (or the mapped .qtab pages), then play episodes
+w/o rendering, each on an emulator w/ its own seed.
+Where fork isn't available (Windows) workers are spawned and get a pickled copy of the agent instead
+"""
+
+# Set in the parent right before forking (or by _init_worker in spawned workers), workers only read it
+_AGENT = None
+_STATE_FUNCTION = None
+
+def _init_worker(agent):
+    global _AGENT, _STATE_FUNCTION
+    _AGENT = agent
+    _STATE_FUNCTION = getattr(state_functions, agent.state_function_name)
+    if agent.nearest_index is None:
+        nearest_state.build_nearest_index(agent, _STATE_FUNCTION)
+
+def _episode(job):
+    seed, max_steps, frame_skip, end_when_life_lost, macro_actions = job
+    env = MsPacmanALE(seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost, macro_actions=macro_actions)
+    fallbacks = _AGENT.greedy_fallbacks
+    reward, steps = runner.run_episode_ale(
+        env, _AGENT, _STATE_FUNCTION, training=False, max_steps=max_steps, reward_clip=False,
+    )
+    return seed, float(reward), steps, _AGENT.greedy_fallbacks - fallbacks
+
+def evaluate(agent, episodes, max_steps, frame_skip, end_when_life_lost, workers=None, seed=1000, out=None, macro_actions=False):
+    _init_worker(agent)
+
+    jobs = [(seed + i, max_steps, frame_skip, end_when_life_lost, macro_actions) for i in range(episodes)]
+    workers = max(1, min(workers or mp.cpu_count(), episodes))
+    if "fork" in mp.get_all_start_methods():
+        pool = mp.get_context("fork").Pool(workers)
+    else:
+        pool = mp.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(agent,))
+    with pool:
+        results = sorted(pool.imap_unordered(_episode, jobs))
+
+    scores = np.array([reward for _, reward, _, _ in results])
+    lengths = np.array([steps for _, _, steps, _ in results])
+    fallbacks = sum(count for _, _, _, count in results)
+    percentiles = (5, 25, 50, 75, 95)
+    report = dict(
+        episodes=episodes,
+        score_mean=float(scores.mean()),
+        score_std=float(scores.std()),
+        score_min=float(scores.min()),
+        score_max=float(scores.max()),
+        score_percentiles=dict(zip(map(str, percentiles), np.percentile(scores, percentiles).tolist())),
+        steps_mean=float(lengths.mean()),
+        steps_percentiles=dict(zip(map(str, percentiles), np.percentile(lengths, percentiles).tolist())),
+        # Share of greedy steps taken from a state the table never saw
+        fallback_rate=fallbacks / max(1, int(lengths.sum())),
+        per_episode=[dict(seed=s, score=r, steps=n, fallbacks=f) for s, r, n, f in results],
+    )
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+def print_report(report):
+    score_p, steps_p = report["score_percentiles"], report["steps_percentiles"]
+    print(f"episodes: {report['episodes']}")
+    print(f"score: mean {report['score_mean']:.1f} +- {report['score_std']:.1f}, min {report['score_min']:.0f}, max {report['score_max']:.0f}")
+    print("score percentiles: " + ", ".join(f"p{p} {v:.0f}" for p, v in score_p.items()))
+    print(f"steps: mean {report['steps_mean']:.0f}, " + ", ".join(f"p{p} {v:.0f}" for p, v in steps_p.items()))
+    print(f"unseen state fallback rate: {100 * report['fallback_rate']:.2f}%")
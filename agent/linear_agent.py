@@ -0,0 +1,180 @@
+import pickle
+
+import numpy as np
+
+from agent.q_agent import QLearningAgent
+from agent.state_codec import codec_for
+
+"""
+Linear Q-learning over hashed tile-coded features of the state function's fields: Q(s, a) is the sum of
+weights[f, a] over the ~20 features f active in s, so memory is the fixed (2^feature_bits, actions) float32
+weight array however many states are visited, and unseen states get q-values w/o any nearest state search.
+init_q is spread over a state's features, so optimistic starts still work.
+Features per state (each hashed into the weight rows):
+    `tilings` offset tilings of (px, py), tiles `tile_width` cells wide
+    every other field on its own, and paired w/ a coarse (px, py) region
+    a bias feature
+"""
+
+_HASH_MULT = 0x9E3779B97F4A7C15
+_U64 = (1 << 64) - 1
+_REGION = 8 # cells per side of the coarse region other fields are paired with
+
+class LinearQAgent(QLearningAgent):
+    def __init__(
+        self,
+        actions,
+        state_function_name,
+        feature_bits=20, # 2^feature_bits weight rows
+        tilings=4,
+        tile_width=4,
+        feature_cache_size=65536, # state key -> active features, cleared when full
+        **agent_kwargs,
+    ):
+        if agent_kwargs.get("policy") == "ucb":
+            raise ValueError("ucb needs per state visit counts, use eps_greedy w/ the linear agent")
+        if agent_kwargs.get("replay_buffer_size") or agent_kwargs.get("trace_lambda"):
+            raise ValueError("replay and Q(lambda) are only implemented for the tabular agent")
+        super().__init__(actions, **agent_kwargs)
+        # No table: q-values come from the weights, see q_by_state
+        self.table = None
+        self.state_function_name = state_function_name
+        self.feature_bits = feature_bits
+        self.tilings = tilings
+        self.tile_width = tile_width
+        self._codec = codec_for(_state_function(state_function_name))
+        self._position = "px" in self._codec.names and "py" in self._codec.names
+        self._others = [name for name in self._codec.names if not (self._position and name in ("px", "py"))]
+        # Spread init_q over the features of a state so unseen states start at (about) init_q
+        active = 1 + (tilings + 2 * len(self._others) if self._position else len(self._others))
+        self.weights = np.full((1 << feature_bits, actions), self.init_q / active, dtype=np.float32)
+        self.touched = np.zeros(1 << feature_bits, dtype=bool) # rows updated at least once
+        self._features = {}
+        self._feature_cache_size = feature_cache_size
+
+    # Row indices of the features active in a state, unique
+    def features(self, state_key):
+        features = self._features.get(state_key)
+        if features is not None:
+            return features
+        state = self._codec.decode(state_key)
+        codes = [(0,)]
+        if self._position:
+            px, py = state["px"], state["py"]
+            for t in range(self.tilings):
+                # Tiling t shifted by t/tilings of a tile on both axes
+                offset = t * self.tile_width // self.tilings
+                codes.append((1, t, (px + offset) // self.tile_width, (py + offset) // self.tile_width))
+            region = (px // _REGION, py // _REGION)
+        for i, name in enumerate(self._others):
+            codes.append((2, i, state[name]))
+            if self._position:
+                codes.append((3, i, state[name], *region))
+        shift = 64 - self.feature_bits
+        rows = []
+        for code in codes:
+            h = 0
+            for value in code:
+                h = (h * 1000003 + int(value) + 1) & _U64
+            rows.append(((h * _HASH_MULT) & _U64) >> shift)
+        features = np.unique(np.array(rows, dtype=np.int64))
+        if len(self._features) >= self._feature_cache_size:
+            self._features.clear()
+        self._features[state_key] = features
+        return features
+
+    def q_values(self, state_key):
+        return self.weights[self.features(state_key)].sum(axis=0)
+
+    # Same read-only state -> q-values view as the tabular agent, defined for every state
+    @property
+    def q_by_state(self):
+        return _LinearView(self)
+
+    # A TypeError, this agent is the wrong kind for the caller. Not an AttributeError: hasattr/getattr fallbacks
+    # would take the agent for one w/o the attribute
+    @property
+    def count_by_state(self):
+        raise TypeError("the linear agent keeps no per state visit counts, count_by_state needs the tabular agent")
+
+    def select_action(self, state_key):
+        return self._policy.select(self.q_values(state_key).tolist(), self.total_steps, self.actions)
+
+    # Semi-gradient Q-learning step, alpha shared among the active features
+    def update(self, init_state_key, action, reward, result_state_key, terminal: bool, steps=1):
+        features = self.features(init_state_key)
+        if terminal:
+            td_target = reward
+        else:
+            td_target = reward + self.discount ** steps * float(self.q_values(result_state_key).max())
+        q_value = float(self.weights[features, action].sum())
+        self.weights[features, action] += self.alpha / len(features) * (td_target - q_value)
+        self.touched[features] = True
+        self.total_steps += 1
+
+    def clear_traces(self):
+        pass
+
+    # Features written at least once, the linear counterpart of a table's state count
+    def __len__(self):
+        return int(np.count_nonzero(self.touched))
+
+    def memory_per_state(self):
+        return self.weights.nbytes / max(1, len(self))
+
+    # Always a pickle, the .qtab format is a table's columns
+    def save(self, path, state_function):
+        if str(path).endswith(".qtab"):
+            raise ValueError(f"can't save the linear agent as {path}, .qtab holds q-tables, use a .pkl path")
+        print(f"linear weights: {self.weights.nbytes / 2**20:.1f} MiB, {len(self)} features in use")
+        payload = dict(self.header(state_function.__name__), weights=self.weights, touched=self.touched)
+        with open(path, "wb") as f:
+            pickle.dump(payload, f)
+
+    def header(self, state_function_name):
+        return dict(
+            super().header(state_function_name),
+            agent="linear", feature_bits=self.feature_bits, tilings=self.tilings, tile_width=self.tile_width,
+        )
+
+    # Loaded through QLearningAgent.load, which hands linear payloads over here
+    @staticmethod
+    def from_payload(payload):
+        agent = LinearQAgent(
+            actions=payload["actions"],
+            state_function_name=payload["state_function_name"],
+            feature_bits=payload["feature_bits"],
+            tilings=payload["tilings"],
+            tile_width=payload["tile_width"],
+            discount=payload["discount"],
+            alpha=payload["alpha"],
+            init_q=payload["init_q"],
+            policy=payload["policy"],
+            frame_skip=payload.get("frame_skip"),
+            macro_actions=payload.get("macro_actions"),
+            **payload["policy_params"],
+        )
+        agent.total_steps = payload["total_steps"]
+        agent.weights = np.asarray(payload["weights"], dtype=np.float32)
+        agent.touched = np.asarray(payload["touched"], dtype=bool)
+        return agent
+
+class _LinearView:
+    def __init__(self, agent: LinearQAgent):
+        self._agent = agent
+
+    def __getitem__(self, key):
+        return self._agent.q_values(key)
+
+    def get(self, key, default=None):
+        return self._agent.q_values(key)
+
+    def __contains__(self, key):
+        return True
+
+    def __len__(self):
+        return len(self._agent)
+
+def _state_function(name):
+    from agent import state_functions
+    return getattr(state_functions, name)
@@ -0,0 +1,205 @@
+import os
+from collections import deque
+
+import numpy as np
+
+from statics.ram_annotations import MS_PACMAN_RAM_INFO
+
+"""
+Maze path distances for state features: the walkable grid is learned from player movement (cells of
+CELL x CELL RAM coordinates, linked when the player steps from one to the other, incl. the side tunnel),
+then BFS from every walkable cell gives all-pairs path lengths and the first step of a shortest path.
+Every layout (RAM maze byte 0..MAZES-1) gets its own tables, load_mazes()[ram[maze]] picks the current one.
+Built once, explicitly (`python -m agent.maze`, or main.py before it starts any worker process) and cached
+in 1 .npz, lookups are then plain array indexing. Per maze byte k:
+    node_k (64, 64) int16 - cell -> node, cells the player never stood on map to the closest walkable one
+    distance_k (n, n) uint8 - path length in cells, UNREACHABLE between disconnected nodes
+    first_step_k (n, n) uint8 - direction of the first move (relative_direction coding, 8 = same cell)
+"""
+
+CELL = 4 # RAM coordinate units per cell, same binning as sector_distance_state's px/py
+GRID = 64
+UNREACHABLE = 255
+MAZES = 4 # layouts the game cycles through, RAM maze byte 0..3 (larger values break the game)
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "statics", "maze_distances.npz")
+
+_PX, _PY = MS_PACMAN_RAM_INFO["player_x"], MS_PACMAN_RAM_INFO["player_y"]
+_MAZE = MS_PACMAN_RAM_INFO["maze"]
+
+class MazeDistances:
+    def __init__(self, node, distance, first_step):
+        self.node = node
+        self.distance = distance
+        self.first_step = first_step
+
+    # Node of RAM coordinates, works on scalars and arrays
+    def node_of(self, x, y):
+        return self.node[np.asarray(x) // CELL % GRID, np.asarray(y) // CELL % GRID]
+
+    # node_of for 1 position, as a python int
+    def node_at(self, x, y):
+        return self.node.item(x // CELL % GRID, y // CELL % GRID)
+
+    # Path length in cells between 2 RAM positions
+    def path_distance(self, x1, y1, x2, y2):
+        return self.distance[self.node_of(x1, y1), self.node_of(x2, y2)]
+
+    # Direction to move from (x1, y1) to get closer to (x2, y2) along the maze
+    def direction(self, x1, y1, x2, y2):
+        return self.first_step[self.node_of(x1, y1), self.node_of(x2, y2)]
+
+    # Per node: True where 3+ corridors meet, the only cells where turning gives a new route
+    def junctions(self):
+        return (self.distance == 1).sum(axis=1) >= 3
+
+    @staticmethod
+    def from_edges(edges):
+        cells = sorted({a for a, _ in edges})
+        index = {cell: i for i, cell in enumerate(cells)}
+        n = len(cells)
+        neighbours = [[] for _ in range(n)]
+        for a, b in edges:
+            dx, dy = b[0] - a[0], b[1] - a[1]
+            if abs(dx) > 1:
+                dx = -int(np.sign(dx)) # through the tunnel, moving away from the far side
+            neighbours[index[a]].append((index[b], _direction(dx, dy)))
+
+        distance = np.full((n, n), UNREACHABLE, dtype=np.uint8)
+        first_step = np.full((n, n), 8, dtype=np.uint8)
+        for source in range(n):
+            distance[source, source] = 0
+            queue = deque()
+            for neighbour, direction in neighbours[source]:
+                if distance[source, neighbour] == UNREACHABLE:
+                    distance[source, neighbour] = 1
+                    first_step[source, neighbour] = direction
+                    queue.append(neighbour)
+            while queue:
+                current = queue.popleft()
+                for neighbour, _ in neighbours[current]:
+                    if distance[source, neighbour] == UNREACHABLE:
+                        distance[source, neighbour] = distance[source, current] + 1
+                        first_step[source, neighbour] = first_step[source, current]
+                        queue.append(neighbour)
+
+        # Every grid cell points at its closest walkable cell, so ghosts in their pen or odd coordinates still resolve
+        walkable = np.array(cells, dtype=np.int64).reshape(-1, 2)
+        gx, gy = np.meshgrid(np.arange(GRID), np.arange(GRID), indexing="ij")
+        d = (gx[..., None] - walkable[:, 0]) ** 2 + (gy[..., None] - walkable[:, 1]) ** 2
+        node = np.argmin(d, axis=-1).astype(np.int16)
+        return MazeDistances(node, distance, first_step)
+
+# Player movement edges per maze byte from (N, 128) RAM sequences, each a run of consecutive frames/steps.
+# Steps between frames on different mazes (a cleared level) link nothing
+def maze_edges(ram_sequences):
+    edges = {}
+    for rams in ram_sequences:
+        rams = np.asarray(rams)
+        cx, cy = rams[:, _PX].astype(np.int64) // CELL, rams[:, _PY].astype(np.int64) // CELL
+        mazes = rams[:, _MAZE].tolist()
+        for a, b, maze, next_maze in zip(zip(cx[:-1].tolist(), cy[:-1].tolist()), zip(cx[1:].tolist(), cy[1:].tolist()), mazes[:-1], mazes[1:]):
+            if a == b or maze != next_maze or maze >= MAZES:
+                continue
+            dx, dy = b[0] - a[0], b[1] - a[1]
+            # Neighbouring cells or a tunnel wrap, longer jumps are deaths/restarts
+            if max(abs(dx), abs(dy)) <= 1 or (dy == 0 and abs(dx) >= GRID // 2):
+                edges.setdefault(maze, set()).update(((a, b), (b, a)))
+    return edges
+
+# relative_direction coding for a 1 cell step
+def _direction(dx, dy):
+    return {(1, 0): 0, (1, 1): 1, (0, 1): 2, (-1, 1): 3, (-1, 0): 4, (-1, -1): 5, (0, -1): 6, (1, -1): 7}[(dx, dy)]
+
+# Walks maze `maze` w/ random held actions to collect player movement, in place of a recording.
+# Random play never clears the first level, so every episode is switched to the maze by its RAM byte
+def explore_rams(maze=0, steps=200000, seed=0, hold=12):
+    from emulator.game_env import MsPacmanALE
+    env = MsPacmanALE(seed=seed, frame_skip=1)
+    rng = np.random.default_rng(seed)
+
+    def reset():
+        env.reset()
+        env.ale.setRAM(_MAZE, maze)
+        return env.read_ram()
+
+    rams, episode, action = [], [reset()], 0
+    for t in range(steps):
+        if t % hold == 0:
+            action = int(rng.integers(4))
+        ram, _, done = env.step(action)
+        episode.append(ram)
+        if done:
+            rams.append(np.stack(episode))
+            episode = [reset()]
+    rams.append(np.stack(episode))
+    return rams
+
+# RAM sequences of every episode in a recording directory (emulator.recording)
+def recorded_rams(directory):
+    from emulator.recording import ReplayMsPacman
+    return [rams for rams, _, _, _ in ReplayMsPacman(directory).episodes()]
+
+# Written next to path and renamed over it, so readers never see a partial file
+def save_mazes(path, mazes):
+    arrays = {}
+    for k, maze in enumerate(mazes):
+        arrays.update({f"node_{k}": maze.node, f"distance_{k}": maze.distance, f"first_step_{k}": maze.first_step})
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(path + ".tmp", path)
+
+# Tables of every maze, indexed by maze byte. Files from before per-maze tables only hold the first maze
+def read_mazes(path):
+    with np.load(path) as data:
+        if f"node_{MAZES - 1}" not in data.files:
+            raise ValueError(f"{path} doesn't hold tables for all {MAZES} mazes, rebuild them: python -m agent.maze")
+        return tuple(
+            MazeDistances(data[f"node_{k}"], data[f"distance_{k}"], data[f"first_step_{k}"]) for k in range(MAZES)
+        )
+
+_loaded = {}
+
+# Cached tables, loaded once per process. Never built here: in worker processes every one would run its
+# own build, build_mazes/ensure_mazes do it once up front
+def load_mazes(path=DEFAULT_PATH):
+    mazes = _loaded.get(path)
+    if mazes is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no maze distance tables at {path}, build them first: python -m agent.maze")
+        _loaded[path] = mazes = read_mazes(path)
+    return mazes
+
+# Learns the tables from `record_dir` recordings and saves them, mazes the recordings don't reach
+# are learned from `steps` steps of random play each
+def build_mazes(path=DEFAULT_PATH, record_dir=None, steps=200000):
+    print(f"Building maze distances into {path}")
+    edges = maze_edges(recorded_rams(record_dir)) if record_dir else {}
+    mazes = []
+    for k in range(MAZES):
+        if k not in edges:
+            edges[k] = maze_edges(explore_rams(k, steps)).get(k, set())
+        mazes.append(MazeDistances.from_edges(edges[k]))
+    mazes = tuple(mazes)
+    save_mazes(path, mazes)
+    _loaded[path] = mazes
+    return mazes
+
+# Built if missing (or from before per-maze tables), for the parent process before it starts workers that load them
+def ensure_mazes(path=DEFAULT_PATH):
+    try:
+        return load_mazes(path)
+    except (FileNotFoundError, ValueError):
+        return build_mazes(path)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuilds the cached maze distance tables")
+    parser.add_argument("--record_ram") # recording directory to learn the maze from, default: random play
+    parser.add_argument("--steps", type=int, default=200000) # random play steps per maze
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    args = parser.parse_args()
+    mazes = build_mazes(args.out, record_dir=args.record_ram, steps=args.steps)
+    for k, maze in enumerate(mazes):
+        reachable = maze.distance[maze.distance != UNREACHABLE]
+        print(f"maze {k}: {len(maze.distance)} walkable cells, longest path {reachable.max()} cells")
+    print(f"saved to {args.out}")
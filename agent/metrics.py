@@ -0,0 +1,65 @@
+import json, os, time
+
+"""
+Opt-in instrumentation for run_episode_ale: cumulative time per phase plus per-episode counters,
+streamed as 1 JSON line per episode so a running training job can be followed (e.g. tail -f)
+"""
+
+PHASES = ("emulator_step", "state_function", "encode", "select_action", "update", "render")
+
+class MetricsStream:
+    def __init__(self, path):
+        self._file = open(path, "a")
+        self.episode = 0
+        # Whole run totals, per phase seconds
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._episode_start, self._table_size = 0.0, 0
+
+    def start_episode(self, agent):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._table_size = len(agent.q_by_state)
+        self._episode_start = time.perf_counter()
+
+    # Charges the time since `since` to phase, returns now for the next lap
+    def lap(self, phase, since):
+        now = time.perf_counter()
+        self.phases[phase] += now - since
+        return now
+
+    def end_episode(self, agent, reward, steps, state_cache=None):
+        wall = time.perf_counter() - self._episode_start
+        for phase, seconds in self.phases.items():
+            self.totals[phase] += seconds
+        table_size = len(agent.q_by_state)
+        record = dict(
+            episode=self.episode,
+            reward=float(reward),
+            steps=steps,
+            total_steps=agent.total_steps,
+            wall_seconds=wall,
+            steps_per_sec=steps / wall if wall > 0 else None,
+            new_states=table_size - self._table_size,
+            table_size=table_size,
+            evictions=getattr(agent.table, "evictions", 0),
+            rss_mb=rss_mb(),
+            # Run totals of the state key cache, if any
+            state_cache=state_cache.stats() if state_cache is not None else None,
+            phase_seconds=self.phases,
+            total_phase_seconds=self.totals,
+        )
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.episode += 1
+
+    def close(self):
+        self._file.close()
+
+# Current resident set size, peak RSS where /proc isn't available
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
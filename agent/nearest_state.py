@@ -0,0 +1,144 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from agent import state_functions
+from agent.q_agent import QLearningAgent
+from agent.state_codec import codec_for
+
+"""
+Nearest known state lookups for unseen states at play time, built once over a loaded agent's table.
+Each index returns the same state the linear *_approximation scan would (ties go to the earliest row)
+"""
+
+# Bounded LRU of resolved misses, state key -> row of the nearest known state
+class _MissCache:
+    def __init__(self, size):
+        self.size = size
+        self._rows = OrderedDict()
+
+    def get(self, key):
+        row = self._rows.get(key)
+        if row is not None:
+            self._rows.move_to_end(key)
+        return row
+
+    def put(self, key, row):
+        self._rows[key] = row
+        if len(self._rows) > self.size:
+            self._rows.popitem(last=False)
+
+# coarse_manhattan_state_distance sums signed differences, so the minimum is always the state w/ the
+# largest px + py + distance_ghost whatever the query: it is found once at build time
+class CoarseManhattanIndex:
+    def __init__(self, agent: QLearningAgent):
+        self._table = agent.table
+        columns = codec_for(state_functions.coarse_manhattan_distance).decode_many(self._table.state_keys())
+        score = columns["px"] + columns["py"] + columns["distance_ghost"]
+        self._row = int(np.argmax(score)) if len(score) else None
+
+    def lookup(self, state_key):
+        if self._row is None:
+            return None
+        return self._table.q[self._row]
+
+# Buckets states by (px, py), then searches rings of growing manhattan radius around the query cell.
+# Every other sector_distance_state_distance term is >= 0, so a ring at radius r can't hold anything
+# closer than r and the search stops once r passes the best distance found. Rings are searched a range
+# at a time, each 1 vectorized distance pass: doubling ranges until a state is found, then every ring
+# up to its distance
+class SectorDistanceIndex:
+    def __init__(self, agent: QLearningAgent, cache_size=4096):
+        self._table = agent.table
+        self._codec = codec_for(state_functions.sector_distance_state)
+        columns = self._codec.decode_many(self._table.state_keys())
+        rows = np.arange(len(self._table), dtype=np.int64)
+        cells = columns["px"] * 64 + columns["py"]
+        # Rows sorted by cell, keeping row order inside a cell for tie breaking. Cell c's states
+        # are [_cell_starts[c], _cell_starts[c + 1]) of _rows/_columns
+        order = np.lexsort((rows, cells))
+        self._rows = rows[order]
+        self._columns = {name: values[order] for name, values in columns.items()}
+        self._cell_starts = np.searchsorted(cells[order], np.arange(64 * 64 + 1))
+        # (dx, dy) of every cell offset by growing radius, radius r's are [_ring_starts[r], _ring_starts[r + 1])
+        self._max_radius = 2 * 63
+        rings = [np.zeros((1, 2), dtype=np.int64)]
+        for radius in range(1, self._max_radius + 1):
+            dx = np.arange(-radius, radius + 1)
+            dy = radius - np.abs(dx)
+            rings.append(np.r_[np.c_[dx, dy], np.c_[dx, -dy][dy > 0]])
+        self._offsets = np.concatenate(rings)
+        self._ring_starts = np.cumsum([0] + [len(ring) for ring in rings])
+        self._misses = _MissCache(cache_size)
+
+    def lookup(self, state_key):
+        row = self._misses.get(state_key)
+        if row is None:
+            row = self.nearest_row(state_key)
+            if row is None:
+                return None
+            self._misses.put(state_key, row)
+        return self._table.q[row]
+
+    def nearest_row(self, state_key):
+        state = self._codec.decode(state_key)
+        best_distance, best_row = np.inf, None
+        low, high = 0, 0
+        # Equal distance still matters, an earlier row wins the tie
+        while low <= min(best_distance, self._max_radius):
+            high = min(high, self._max_radius)
+            distance, row = self._nearest_in_rings(state, low, high)
+            if row is not None and (distance < best_distance or (distance == best_distance and row < best_row)):
+                best_distance, best_row = distance, row
+            low, high = high + 1, 2 * high + 1 if best_row is None else int(best_distance)
+        return best_row
+
+    # (distance, row) of the closest state in rings low..high, (inf, None) if they're empty
+    def _nearest_in_rings(self, state, low, high):
+        offsets = self._offsets[self._ring_starts[low]:self._ring_starts[high + 1]]
+        x, y = state["px"] + offsets[:, 0], state["py"] + offsets[:, 1]
+        cells = (x * 64 + y)[(x >= 0) & (x < 64) & (y >= 0) & (y < 64)]
+        starts = self._cell_starts[cells]
+        lengths = self._cell_starts[cells + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.inf, None
+        # Concatenated [start, end) ranges of the cells
+        index = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        distances = state_functions.sector_distance_state_distance_many(
+            state, {name: values[index] for name, values in self._columns.items()},
+        )
+        distance = distances.min()
+        return distance, int(self._rows[index[distances == distance]].min())
+
+# Table decoded once, each miss is 1 vectorized distance pass over every state
+class MazeDistanceIndex:
+    def __init__(self, agent: QLearningAgent, cache_size=4096):
+        self._table = agent.table
+        self._codec = codec_for(state_functions.maze_distance_state)
+        self._columns = self._codec.decode_many(self._table.state_keys())
+        self._misses = _MissCache(cache_size)
+
+    def lookup(self, state_key):
+        row = self._misses.get(state_key)
+        if row is None:
+            if not len(self._table):
+                return None
+            distances = state_functions.maze_distance_state_distance_many(self._codec.decode(state_key), self._columns)
+            row = int(np.argmin(distances))
+            self._misses.put(state_key, row)
+        return self._table.q[row]
+
+_INDEXES = dict(
+    coarse_manhattan_distance=CoarseManhattanIndex,
+    sector_distance_state=SectorDistanceIndex,
+    maze_distance_state=MazeDistanceIndex,
+)
+
+# Builds the nearest state index for agent's table and attaches it, the approximation functions use it from then on
+def build_nearest_index(agent: QLearningAgent, state_function):
+    # Function approximation agents (no table) have q-values for every state already
+    if agent.table is None:
+        return None
+    agent.nearest_index = _INDEXES[state_function.__name__](agent)
+    return agent.nearest_index
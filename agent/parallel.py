@@ -0,0 +1,175 @@
+import multiprocessing as mp
+import pickle, queue, traceback
+
+from emulator.game_env import MsPacmanALE
+from agent.q_agent import QLearningAgent
+from agent.q_table import QTable
+from agent import runner
+
+"""
+Actor-learner training: actor processes play episodes w/ a read-only copy of the q-table and stream
+transitions to the learner (main process), which is the only one applying TD updates
+"""
+
+_QUEUED_BATCHES = 4 # transition batches each actor can have waiting for the learner before put() blocks
+
+# Acts like a QLearningAgent but sends transitions to the learner instead of learning from them
+class ActorAgent(QLearningAgent):
+    def __init__(self, transitions, snapshots, batch_size=256, **agent_kwargs):
+        super().__init__(**agent_kwargs)
+        self._transitions = transitions
+        self._snapshots = snapshots
+        self._batch_size = batch_size
+        self._batch = []
+
+    def update(self, init_state_key, action, reward, result_state_key, terminal: bool, steps=1):
+        self._batch.append((init_state_key, action, reward, result_state_key, terminal, steps))
+        self.total_steps += 1
+        if len(self._batch) >= self._batch_size or terminal:
+            self.flush()
+
+    # Ships buffered transitions, then picks up the learner's latest tables if a new copy arrived
+    def flush(self):
+        if self._batch:
+            self._transitions.put(("transitions", self._batch))
+            self._batch = []
+        try:
+            snapshot = self._snapshots.get_nowait()
+        except queue.Empty:
+            return
+        self.load_snapshot(snapshot)
+
+    def load_snapshot(self, snapshot):
+        total_steps, state_keys, q_values, counts = pickle.loads(snapshot)
+        self.total_steps = total_steps
+        self.table = QTable.from_arrays(self.actions, self.init_q, state_keys, q_values, counts)
+
+# Actor process: runs its share of episodes on its own emulator + seed
+def _actor(actor_id, seed, episodes, transitions, snapshots, state_function, max_steps, reward_clip,
+           frame_skip, end_when_life_lost, reset_noop_max, macro_actions, batch_size, agent_kwargs):
+    try:
+        env = MsPacmanALE(
+            seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost, reset_noop_max=reset_noop_max,
+            macro_actions=macro_actions,
+        )
+        agent = ActorAgent(transitions, snapshots, batch_size=batch_size, seed=seed, **agent_kwargs)
+        for _ in range(episodes):
+            reward, steps = runner.run_episode_ale(
+                env, agent, state_function, training=True, max_steps=max_steps, reward_clip=reward_clip,
+            )
+            agent.flush()
+            transitions.put(("episode", (actor_id, reward, steps)))
+        transitions.put(("done", actor_id))
+    except Exception:
+        transitions.put(("error", traceback.format_exc()))
+
+# Sends learner tables to every actor, an actor still holding an older copy gets it replaced
+def _broadcast(agent: QLearningAgent, snapshot_queues):
+    snapshot = pickle.dumps(
+        (agent.total_steps, *agent.table.arrays()),
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    for snapshots in snapshot_queues:
+        try:
+            snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            snapshots.put_nowait(snapshot)
+        except queue.Full:
+            pass
+
+# Training loop w/ actors emulating in parallel and the calling process as learner
+def train_parallel(
+    seed,
+    # Training vars
+    episodes,
+    reward_clip,
+    state_function,
+    max_steps,
+    # Emulator vars
+    frame_skip,
+    end_when_life_lost,
+    # Agent vars
+    discount,
+    alpha,
+    init_q,
+    policy,
+    eps_start, eps_end, eps_decay_steps, # Epsilon
+    ucb_strength, # UCB
+
+    filename="q_ale.pkl",
+    actors=None, # defaults to 1 per spare core
+    sync_every=1e4, # learner updates between table copies sent to actors
+    batch_size=256, # transitions per message from an actor
+    reset_noop_max=0, # random no-op frames after each (snapshot) reset
+    macro_actions=False, # actors hold actions until a junction/wall/close ghost, see MsPacmanALE.step_option
+    # Learner side experience replay, buffer size 0 disables it
+    replay_buffer_size=0,
+    replay_ratio=1.0,
+    replay_batch_size=32,
+):
+    actors = actors or max(1, mp.cpu_count() - 1)
+    actors = max(1, min(actors, episodes))
+    agent_kwargs = dict(
+        actions=4, discount=discount, alpha=alpha, init_q=init_q,
+        policy=policy, eps_start=eps_start, eps_end=eps_end, eps_decay_steps=eps_decay_steps,
+        ucb_strength=ucb_strength,
+    )
+    agent = QLearningAgent(
+        seed=seed, replay_buffer_size=replay_buffer_size, replay_ratio=replay_ratio,
+        replay_batch_size=replay_batch_size, frame_skip=frame_skip, macro_actions=macro_actions, **agent_kwargs,
+    )
+
+    # Bounded: actors outrunning the learner wait instead of piling batches up in its memory
+    transitions = mp.Queue(maxsize=_QUEUED_BATCHES * actors)
+    snapshot_queues = [mp.Queue(maxsize=1) for _ in range(actors)]
+    processes = []
+    for i in range(actors):
+        # Spread episodes as evenly as possible
+        actor_episodes = episodes // actors + (1 if i < episodes % actors else 0)
+        process = mp.Process(
+            target=_actor,
+            args=(i, seed + 1 + i, actor_episodes, transitions, snapshot_queues[i], state_function,
+                  max_steps, reward_clip, frame_skip, end_when_life_lost, reset_noop_max, macro_actions, batch_size,
+                  agent_kwargs),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+
+    history = {"reward": [], "steps": []}
+    running, since_sync = actors, 0
+    try:
+        while running:
+            kind, data = transitions.get()
+            if kind == "transitions":
+                for transition in data:
+                    agent.update(*transition)
+                since_sync += len(data)
+                if since_sync >= sync_every:
+                    _broadcast(agent, snapshot_queues)
+                    since_sync = 0
+            elif kind == "episode":
+                _, reward, steps = data
+                history["reward"].append(reward)
+                history["steps"].append(steps)
+            elif kind == "done":
+                running -= 1
+            elif kind == "error":
+                raise RuntimeError("actor process failed:\n" + data)
+    finally:
+        for process in processes:
+            if process.is_alive() and running:
+                process.terminate()
+            process.join()
+        # Unread table copies must not keep this process from exiting
+        for snapshots in snapshot_queues:
+            snapshots.cancel_join_thread()
+
+    # final save
+    if filename:
+        agent.save(filename, state_function)
+        print(f"Saved file")
+
+    return agent, history
@@ -0,0 +1,182 @@
+import bisect, json, struct
+from collections import deque
+
+import numpy as np
+
+from agent import state_functions
+from agent.state_codec import codec_for
+
+"""
+Compiled greedy policy (.qpol): what greedy play needs from a trained agent and nothing else, so the player
+maps a file a fraction of the .pkl size and each decision is 1 binary search:
+    magic (8 bytes) | header length (uint64) | JSON header | padding to 64 bytes
+    sorted state keys (int64, n) | greedy actions (2 bits each, 4 per byte) | bucket fallback actions (2 bits each)
+Buckets are the (px, py) cells of the state function's position fields. A bucket's fallback is the greedy
+action most visited among its known states, cells w/o any take the one of the closest cell that has some,
+so unseen states get an action w/o the nearest state search of `--mode play`
+"""
+
+MAGIC = b"QPOL\x00\x00\x00\x01"
+_ALIGN = 64
+_BUCKET_FIELDS = ("px", "py")
+
+def is_policy(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class CompiledPolicy:
+    def __init__(self, header, keys, actions, fallback):
+        self.header = header
+        self.state_function_name = header["state_function_name"]
+        self.keys, self._actions, self._fallback = keys, actions, fallback
+        # Lookups go through memoryviews: bisect + int indexing on them beats np.searchsorted on a scalar ~2x
+        self._key_view = _view(keys, "q")
+        self._action_view, self._fallback_view = _view(actions, "B"), _view(fallback, "B")
+        codec = codec_for(getattr(state_functions, self.state_function_name))
+        (self._x_shift, self._x_mask, _), (self._y_shift, self._y_mask, _) = map(codec.layout, _BUCKET_FIELDS)
+        self._y_bits = self._y_mask.bit_length()
+        self.fallbacks = 0 # decisions taken from a bucket, i.e. for states the agent never saw
+
+    def __len__(self):
+        return len(self.keys)
+
+    def action(self, state_key):
+        keys = self._key_view
+        i = bisect.bisect_left(keys, state_key)
+        if i < len(keys) and keys[i] == state_key:
+            return _unpack(self._action_view, i)
+        self.fallbacks += 1
+        bucket = ((state_key >> self._x_shift) & self._x_mask) << self._y_bits | (state_key >> self._y_shift) & self._y_mask
+        return _unpack(self._fallback_view, bucket)
+
+    # Greedy action of every known state, unpacked
+    def actions(self):
+        return _unpack_many(self._actions, len(self.keys))
+
+    def save(self, path):
+        header = dict(self.header, states=len(self.keys))
+        header_bytes = json.dumps(header).encode()
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\x00" * (_aligned(f.tell()) - f.tell()))
+            for array in (self.keys, self._actions, self._fallback):
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.write(b"\x00" * (_aligned(f.tell()) - f.tell()))
+
+    # Arrays are read-only maps of the file
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled policy")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length))
+        offset = _aligned(len(MAGIC) + 8 + header_length)
+        arrays = []
+        for dtype, count in ((np.int64, header["states"]), (np.uint8, _packed_size(header["states"])), (np.uint8, _packed_size(header["buckets"]))):
+            if count:
+                # Plain ndarray view of the map, np.memmap indexing is several times slower per lookup
+                arrays.append(np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)).view(np.ndarray))
+            else:
+                arrays.append(np.zeros(0, dtype=dtype))
+            offset = _aligned(offset + count * np.dtype(dtype).itemsize)
+        return CompiledPolicy(header, *arrays)
+
+# Greedy action per known state (ties to the lowest action, like runner.greedy_action) + bucket fallbacks
+def compile_policy(agent):
+    if agent.table is None:
+        raise ValueError("compiling needs a q-table agent, the linear agent has no per state actions")
+    if agent.actions > 4:
+        raise ValueError(f"actions are packed in 2 bits, {agent.actions} don't fit")
+    codec = codec_for(getattr(state_functions, agent.state_function_name))
+    keys, q, counts = agent.table.arrays()
+    order = np.argsort(keys, kind="stable")
+    keys, q, counts = keys[order].astype(np.int64), q[order], counts[order]
+    greedy = np.argmax(q, axis=1) if len(keys) else np.zeros(0, dtype=np.int64)
+
+    (_, x_mask, _), (_, y_mask, _) = map(codec.layout, _BUCKET_FIELDS)
+    width, height = x_mask + 1, y_mask + 1
+    columns = codec.decode_many(keys)
+    buckets = columns["px"] * height + columns["py"]
+    # Every state votes for its greedy action w/ its visit count, so well explored states decide
+    votes = np.zeros((width * height, agent.actions), dtype=np.float64)
+    np.add.at(votes, (buckets, greedy), np.maximum(1, counts.sum(axis=1)))
+    known = votes.sum(axis=1) > 0
+    fallback = _spread(np.argmax(votes, axis=1), known, width, height)
+
+    header = dict(
+        state_function_name=agent.state_function_name, actions=agent.actions, buckets=width * height,
+        bucket_fields=list(_BUCKET_FIELDS), known_buckets=int(known.sum()), total_steps=agent.total_steps,
+        frame_skip=agent.frame_skip, macro_actions=agent.macro_actions,
+    )
+    return CompiledPolicy(header, keys, _pack(greedy), _pack(fallback))
+
+# Multi source BFS over the bucket grid: empty cells take the action of the closest known cell
+def _spread(actions, known, width, height):
+    actions = actions.copy()
+    seen = known.copy()
+    queue = deque(np.flatnonzero(known).tolist())
+    while queue:
+        cell = queue.popleft()
+        x, y = divmod(cell, height)
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= nx < width and 0 <= ny < height and not seen[nx * height + ny]:
+                seen[nx * height + ny] = True
+                actions[nx * height + ny] = actions[cell]
+                queue.append(nx * height + ny)
+    return actions
+
+def _packed_size(n):
+    return (n + 3) // 4
+
+def _pack(actions):
+    padded = np.zeros(_packed_size(len(actions)) * 4, dtype=np.uint8)
+    padded[:len(actions)] = actions
+    padded = padded.reshape(-1, 4)
+    return padded[:, 0] | padded[:, 1] << 2 | padded[:, 2] << 4 | padded[:, 3] << 6
+
+def _unpack(packed, i):
+    return (packed[i >> 2] >> ((i & 3) << 1)) & 3
+
+def _unpack_many(packed, n):
+    packed = np.asarray(packed, dtype=np.uint8)
+    return ((packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3).reshape(-1)[:n]
+
+# Flat memoryview of a contiguous array, indexing it gives python ints
+def _view(array, format):
+    return memoryview(np.ascontiguousarray(array)).cast("B").cast(format)
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+# Plays 1 greedy game w/ a compiled policy, no agent or q-table involved
+def play_episode(env, policy: CompiledPolicy, max_steps=10000, viewer=None, video=None, verbose=0):
+    state_function = getattr(state_functions, policy.state_function_name)
+    encode_state = codec_for(state_function).encode
+    prev_ram = env.reset().copy()
+    prev_action = 3 # pacman faces left at the start, as in runner.run_episode_ale
+    state_key = encode_state(state_function(prev_ram, prev_ram, prev_action))
+    total_reward, steps = 0, 0
+    while True:
+        action = policy.action(state_key)
+        if env.macro_actions:
+            ram, reward, done, frames = env.step_option(action)
+        else:
+            ram, reward, done = env.step(action)
+            frames = env.frame_skip
+        if viewer is not None:
+            viewer.submit(env.ale, frames)
+            done = done or viewer.closed
+        if video is not None:
+            video.submit(env.ale, frames)
+        state_key = encode_state(state_function(ram, prev_ram, prev_action))
+        prev_ram, prev_action = ram.copy(), action
+        total_reward += reward
+        steps += 1
+        if done or steps >= max_steps:
+            break
+    if verbose >= 1:
+        print(f"episode reward: {total_reward} steps: {steps} fallbacks: {policy.fallbacks}")
+    return total_reward, steps
@@ -1,7 +1,11 @@
-from collections import defaultdict
 import pickle, random
 
-from agent import exploration
+import numpy as np
+
+from agent import exploration, checkpoint
+from agent.replay import ReplayBuffer
+from agent.q_table import QTable, SortedQTable, SpillStore, TableView, states_for_budget
+from agent.state_codec import codec_for
 
 class QLearningAgent:
     def __init__(
@@ -18,18 +22,55 @@ class QLearningAgent:
         eps_decay_steps=1e5,
         # ucb vars
         ucb_strength=1.0,
+        # experience replay vars, buffer size 0 disables replay
+        replay_buffer_size=0,
+        replay_ratio=1.0, # replayed updates per real step
+        replay_batch_size=32,
+        # Watkins Q(lambda) vars, trace_lambda 0 keeps the 1 step update
+        trace_lambda=0.0,
+        trace_cutoff=0.01, # traces decayed below this are dropped
+        # Memory budget, 0 = unbounded. Past it the least visited/least recently used states are evicted,
+        # the well visited ones kept in a compact spill store to be restored if seen again (and saved w/ the table)
+        max_table_mb=0,
+        evict_fraction=0.1, # share of the budget's states freed per eviction
+        spill_min_visits=2,
+        # Emulator settings trained with, saved so play/eval step the game the same way (None: not recorded)
+        frame_skip=None,
+        macro_actions=None,
     ):
         self.actions = actions
         self.discount = discount
         self.alpha = alpha
         self.init_q = init_q
         self.total_steps = 0
+        self.frame_skip = frame_skip
+        self.macro_actions = macro_actions
         
         random.seed(seed)
 
-        # Initialize hash table, state -> q_values/action_counts, initialize w/ init_q/0 on first access
-        self.q_by_state = defaultdict(lambda: [float(self.init_q)] * self.actions)
-        self.count_by_state = defaultdict(lambda: [0] * self.actions)
+        # Initialize table, state -> q_values/action_counts, initialize w/ init_q/0 on first access
+        self.max_table_mb = max_table_mb
+        self.evict_fraction = evict_fraction
+        self.spill_min_visits = spill_min_visits
+        self._max_states, self._spill = None, None
+        if max_table_mb:
+            self._max_states = states_for_budget(actions, max_table_mb * 2**20)
+            self._spill = SpillStore(actions, self._max_states, min_visits=spill_min_visits)
+        self.table = QTable(actions, init_q, max_states=self._max_states, spill=self._spill)
+        # Optional nearest known state lookup for unseen states at play time (see nearest_state)
+        self.nearest_index = None
+        # Greedy actions taken from an approximated (unseen) state, see runner.greedy_action
+        self.greedy_fallbacks = 0
+
+        self.replay = ReplayBuffer(replay_buffer_size, seed=seed) if replay_buffer_size > 0 else None
+        self.replay_ratio = replay_ratio
+        self.replay_batch_size = replay_batch_size
+        self._replay_credit = 0.0
+
+        # Sparse eligibility traces: parallel (row, action, trace) arrays of the recent pairs still above the cutoff
+        self.trace_lambda = trace_lambda
+        self.trace_cutoff = trace_cutoff
+        self.clear_traces()
 
         # Initialize exploration policy
         if policy == "eps_greedy":
@@ -41,33 +82,198 @@ class QLearningAgent:
         else:
             raise ValueError("unknown policy")
 
+    # Dict-like read-only views, state key -> q_values/action_counts rows; unseen states are missing
+    @property
+    def q_by_state(self):
+        return TableView(self.table, "q")
+
+    @property
+    def count_by_state(self):
+        return TableView(self.table, "counts")
+
     # Pick action according to policy
     def select_action(self, state_key):
-        qvals = self.q_by_state[state_key]
+        table = self.table
+        # Q(lambda) updates go through the arrays every step, hot rows would be written back each time (see QTable.entry)
+        if self.trace_lambda > 0:
+            row = table.row(state_key)
+            qvals, counts = table.q[row].tolist(), table.counts[row].tolist()
+        else:
+            qvals, counts, _ = table.hot.get(state_key) or table.entry(state_key)
+        # The lookup may have inserted the state, the budget holds here too and not only after updates
+        if self._max_states and table.over_budget():
+            self.evict()
         if self._policy_name == "eps_greedy":
             return self._policy.select(qvals, self.total_steps, self.actions)
         elif self._policy_name == "ucb":
-            return self._policy.select(qvals, self.total_steps, self.count_by_state[state_key])
+            return self._policy.select(qvals, self.total_steps, counts)
         # add more policy?
 
     # Update q_values and count tables after action
-    def update(self, init_state_key, action, reward, result_state_key, terminal: bool):
-        self.count_by_state[init_state_key][action] += 1 # increase action count
-        # td_target = reward of action taken + discounted future greedy reward (if not terminal)
-        if terminal:
-            td_target = reward
+    # steps: env steps the action lasted (option steps, see MsPacmanALE.step_option), the future is discounted by all of them
+    def update(self, init_state_key, action, reward, result_state_key, terminal: bool, steps=1):
+        table = self.table
+        discount = self.discount if steps == 1 else self.discount ** steps
+        if self.trace_lambda > 0:
+            row = table.row(init_state_key)
+            if terminal:
+                td_target = reward
+            else:
+                # Looked up before touching the arrays, inserting result state may grow them
+                result_row = table.row(result_state_key)
+                td_target = reward + discount*max(table.q[result_row].tolist())
+            table.counts[row, action] += 1
+            table.dirty[row] = True
+            self._trace_update(row, action, td_target - table.q.item(row, action), terminal, discount)
         else:
-            td_target = reward + self.discount*max(self.q_by_state[result_state_key])
-        # Update q_value of state+action w/ td_target
-        self.q_by_state[init_state_key][action] += self.alpha * (td_target - self.q_by_state[init_state_key][action])
+            # td_target = reward of action taken + discounted future greedy reward (if not terminal)
+            # Result state's entry first, taking the next one may write back (and detach) entries taken before it
+            hot = table.hot
+            if terminal:
+                td_target = reward
+            else:
+                td_target = reward + discount*max((hot.get(result_state_key) or table.entry(result_state_key))[0])
+            q_values, counts, _ = hot.get(init_state_key) or table.entry(init_state_key)
+            counts[action] += 1 # increase action count
+            # Update q_value of state+action w/ td_target
+            q_values[action] += self.alpha * (td_target - q_values[action])
         self.total_steps += 1
 
+        if self.replay is not None:
+            self.replay.add(init_state_key, action, reward, result_state_key, terminal, steps)
+            # replay_ratio replayed updates per real one, applied a minibatch at a time
+            self._replay_credit += self.replay_ratio
+            while self._replay_credit >= self.replay_batch_size and len(self.replay) >= self.replay_batch_size:
+                self.replay_step()
+                self._replay_credit -= self.replay_batch_size
+
+        if self._max_states and table.over_budget():
+            self.evict()
+
+    # Frees table rows down to the memory budget, traces follow their rows (or go w/ them)
+    def evict(self):
+        remap = self.table.evict(self.evict_fraction)
+        rows = remap[self._trace_rows]
+        kept = rows >= 0
+        self._trace_rows, self._trace_actions, self._traces = rows[kept], self._trace_actions[kept], self._traces[kept]
+
+    # Table over saved arrays w/ this agent's memory budget, rows past it go straight to the spill store
+    def table_from_arrays(self, keys, q, counts):
+        table = QTable.from_arrays(self.actions, self.init_q, keys, q, counts, max_states=self._max_states, spill=self._spill)
+        if table.over_budget():
+            table.evict(self.evict_fraction)
+        return table
+
+    # Watkins Q(lambda) step: the td error of (row, action) is applied to every traced pair
+    def _trace_update(self, row, action, td_error, terminal, discount):
+        table = self.table
+        rows, actions, traces = self._trace_rows, self._trace_actions, self._traces
+        # Credit doesn't flow back through an exploratory action, older pairs stop being traced
+        if table.q.item(row, action) < max(table.q[row].tolist()):
+            rows, actions, traces = rows[:0], actions[:0], traces[:0]
+        # Replacing trace, a revisited pair restarts at 1
+        other = (rows != row) | (actions != action)
+        rows = np.append(rows[other], row)
+        actions = np.append(actions[other], action)
+        traces = np.append(traces[other], 1.0)
+        # Pairs are unique, so a plain fancy-indexed add is safe
+        table.q[rows, actions] += self.alpha * td_error * traces
+        table.dirty[rows] = True
+        if terminal:
+            self.clear_traces()
+            return
+        traces *= discount * self.trace_lambda
+        keep = traces >= self.trace_cutoff
+        self._trace_rows, self._trace_actions, self._traces = rows[keep], actions[keep], traces[keep]
+
+    # Drops every trace, called at episode starts
+    def clear_traces(self):
+        self._trace_rows = np.empty(0, dtype=np.int64)
+        self._trace_actions = np.empty(0, dtype=np.int64)
+        self._traces = np.empty(0, dtype=np.float32)
+
+    # 1 minibatch of Q-learning updates from the replay buffer, visit counts only track real steps
+    def replay_step(self):
+        table = self.table
+        state_keys, actions, rewards, result_state_keys, terminals, steps = self.replay.sample(self.replay_batch_size)
+        rows = table.find_many(state_keys)
+        result_rows = table.find_many(result_state_keys)
+        # Rows gone from the table (evicted) are skipped, unseen result states count as init_q
+        valid = rows >= 0
+        rows, actions, rewards, result_rows, terminals, steps = (
+            rows[valid], actions[valid], rewards[valid], result_rows[valid], terminals[valid], steps[valid]
+        )
+        next_max = np.where(result_rows >= 0, table.q[result_rows].max(axis=1), table.init_q)
+        td_target = rewards + self.discount ** steps * next_max * ~terminals
+        # Duplicate (state, action) pairs in a batch get the mean of their updates, not alpha * delta once each
+        _, pair, duplicates = np.unique(rows * self.actions + actions, return_inverse=True, return_counts=True)
+        updates = self.alpha * (td_target - table.q[rows, actions]) / duplicates[pair]
+        np.add.at(table.q, (rows, actions), updates)
+        table.dirty[rows] = True
+
+    # Table bytes per stored state, for sizing workers
+    def memory_per_state(self):
+        return self.table.bytes_per_state()
+
     # Saves agent variables + state function used to train into a while
+    # .qtab paths get the memory-mappable columnar format (see checkpoint), anything else a pickle
     def save(self, path, state_function):
-        print("about to save; q_by_state len:", len(self.q_by_state))
-        first_key = next(iter(self.q_by_state))
-        print("example key:", first_key)
-        payload = dict(
+        print("about to save; q_by_state len:", len(self.table))
+        print(f"q-table memory: {self.table.nbytes() / 2**20:.1f} MiB, {self.memory_per_state():.1f} bytes/state")
+        state_keys, q_values, counts = self.table.arrays()
+        spill = getattr(self.table, "spill", None)
+        if spill is not None and len(spill):
+            # Evicted states are saved too, so a loaded agent still knows them
+            gone = self.table.find_many(spill.keys) < 0
+            state_keys = np.concatenate([state_keys, spill.keys[gone]])
+            q_values = np.concatenate([q_values, spill.q[gone].astype(np.float32)])
+            counts = np.concatenate([counts, spill.counts[gone].astype(np.uint32)])
+            print(f"evicted {self.table.evictions} states, {int(gone.sum())} spilled ones saved w/ the table")
+        header = self.header(state_function.__name__)
+        if str(path).endswith(".qtab"):
+            checkpoint.write_qtab(path, header, state_keys, q_values, counts)
+            return
+        payload = dict(header, state_keys=state_keys, q_values=q_values, counts=counts)
+        with open(path, "wb") as f: 
+            pickle.dump(payload, f)
+
+    # Loads previously saved file as a new agent object, extra attribute state_function
+    # .qtab files are memory-mapped read-only unless mmap is False (needed to keep training)
+    @staticmethod
+    def load(path: str, mmap=True):
+        if checkpoint.is_qtab(path):
+            header, state_keys, q_values, counts = checkpoint.read_qtab(path, mmap=mmap)
+            agent = QLearningAgent.from_header(header)
+            if mmap:
+                agent.table = SortedQTable(agent.actions, agent.init_q, state_keys, q_values, counts)
+            else:
+                agent.table = agent.table_from_arrays(state_keys, q_values, counts)
+            return agent
+
+        with open(path, "rb") as f: 
+            payload = pickle.load(f)
+            if payload.get("agent") == "linear":
+                from agent.linear_agent import LinearQAgent
+                return LinearQAgent.from_payload(payload)
+            agent = QLearningAgent.from_header(payload)
+            if "state_keys" in payload:
+                agent.table = agent.table_from_arrays(payload["state_keys"], payload["q_values"], payload["counts"])
+                return agent
+
+            # Older pickles hold dicts of lists
+            q_by_state, count_by_state = payload["q_by_state"], payload["count_by_state"]
+            # ... keyed by sorted (field, value) tuples before keys were packed ints
+            if q_by_state and isinstance(next(iter(q_by_state)), tuple):
+                from agent import state_functions
+                codec = codec_for(getattr(state_functions, agent.state_function_name))
+                q_by_state = {codec.encode_legacy(k): v for k, v in q_by_state.items()}
+                count_by_state = {codec.encode_legacy(k): v for k, v in count_by_state.items()}
+            agent.table = QTable.from_dicts(agent.actions, agent.init_q, q_by_state, count_by_state)
+            return agent
+
+    # Agent settings saved alongside the table
+    def header(self, state_function_name):
+        return dict(
             actions=self.actions,
             discount=self.discount,
             alpha=self.alpha,
@@ -75,32 +281,45 @@ class QLearningAgent:
             policy=self._policy_name,
             policy_params=self.policy_params(),
             total_steps=self.total_steps,
-            q_by_state=dict(self.q_by_state),
-            count_by_state=dict(self.count_by_state),
-            state_function_name=state_function.__name__
+            state_function_name=state_function_name,
+            trace_lambda=self.trace_lambda,
+            trace_cutoff=self.trace_cutoff,
+            max_table_mb=self.max_table_mb,
+            evict_fraction=self.evict_fraction,
+            spill_min_visits=self.spill_min_visits,
+            replay_buffer_size=self.replay.capacity if self.replay is not None else 0,
+            replay_ratio=self.replay_ratio,
+            replay_batch_size=self.replay_batch_size,
+            frame_skip=self.frame_skip,
+            macro_actions=self.macro_actions,
         )
-        with open(path, "wb") as f: 
-            pickle.dump(payload, f)
 
-    # Loads previously saved file as a new agent object, extra attribute state_function
+    # Agent w/ the saved settings and an empty table
     @staticmethod
-    def load(path: str):
-        with open(path, "rb") as f: 
-            payload = pickle.load(f)
-            agent = QLearningAgent(
-                actions=payload["actions"],
-                discount=payload["discount"],
-                alpha=payload["alpha"],
-                init_q=payload["init_q"],
-                policy=payload["policy"],
-                **payload["policy_params"]
-            )
-            agent.total_steps = payload["total_steps"]
-            agent.state_function_name = payload["state_function_name"]
-            # Dict instead of defaultdict to recognize unseen states
-            agent.q_by_state = dict(payload["q_by_state"])
-            agent.count_by_state = dict(payload["count_by_state"])
-            return agent
+    def from_header(header):
+        agent = QLearningAgent(
+            actions=header["actions"],
+            discount=header["discount"],
+            alpha=header["alpha"],
+            init_q=header["init_q"],
+            policy=header["policy"],
+            # Absent from files saved before Q(lambda)
+            trace_lambda=header.get("trace_lambda", 0.0),
+            trace_cutoff=header.get("trace_cutoff", 0.01),
+            max_table_mb=header.get("max_table_mb", 0),
+            evict_fraction=header.get("evict_fraction", 0.1),
+            spill_min_visits=header.get("spill_min_visits", 2),
+            # Absent from files saved before replay settings were
+            replay_buffer_size=header.get("replay_buffer_size", 0),
+            replay_ratio=header.get("replay_ratio", 1.0),
+            replay_batch_size=header.get("replay_batch_size", 32),
+            frame_skip=header.get("frame_skip"),
+            macro_actions=header.get("macro_actions"),
+            **header["policy_params"]
+        )
+        agent.total_steps = header["total_steps"]
+        agent.state_function_name = header["state_function_name"]
+        return agent
 
     def policy_params(self):
         if self._policy_name == "eps_greedy":
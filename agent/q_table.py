@@ -0,0 +1,440 @@
+import sys
+from collections.abc import Mapping
+
+import numpy as np
+
+"""
+Compact q-table: packed int state key -> row through an open addressing (linear probing) index,
+q-values/action counts live in contiguous float32/uint32 arrays that double when full.
+A dict of the same key -> row pairs sits in front of the index for single key lookups (row/find), probing
+the numpy index 1 key at a time costs more than the rest of a training step; batches (find_many) use the index.
+Single row updates (QLearningAgent.select_action/update) go through entry(): recently used rows are held as
+python lists, numpy scalar reads/writes would cost more than the update. sync() writes them back, the q/counts/dirty
+properties call it so array users always see current values.
+With max_states set the table stops growing there and evict() drops the least visited, least recently
+used rows; well visited ones are kept in a SpillStore and restored if their state comes back.
+"""
+
+_EMPTY = -1
+_HEADROOM = 64 # rows a budgeted table can hold past max_states before evict() runs
+_HASH_MULT = 0x9E3779B97F4A7C15 # 2^64 / golden ratio, spreads consecutive keys over the slots
+_DICT_INT_BYTES = 32 + 28 # int objects of a dict entry, a ~50 bit key and a row
+_HOT_ROWS = 8192 # rows entry() holds as lists before sync() writes them back
+
+class QTable:
+    def __init__(self, actions, init_q=0.0, capacity=1024, max_states=None, spill=None):
+        self.actions = actions
+        self.init_q = float(init_q)
+        self.max_states = max_states or None
+        self.spill = spill # SpillStore for evicted rows, None drops them
+        self.evictions = 0
+        # A budgeted table's rows stop at max_states + _HEADROOM exactly, only the index is rounded up to a power of 2
+        if self.max_states:
+            capacity = min(capacity, self.max_states + _HEADROOM)
+        else:
+            capacity = _next_pow2(capacity)
+        self._size = 0
+        self.keys = np.empty(capacity, dtype=np.int64) # row -> state key
+        self._q = np.empty((capacity, actions), dtype=np.float32)
+        self._counts = np.empty((capacity, actions), dtype=np.uint32)
+        # Rows changed since the last take_dirty, for incremental checkpoints
+        self._dirty = np.zeros(capacity, dtype=bool)
+        # Changed rows evicted before take_dirty got them, (keys, q, counts) batches
+        self._evicted_dirty = []
+        # Tick of each row's latest use (insert only when unbudgeted), for eviction
+        self.last_access = np.zeros(capacity, dtype=np.int64)
+        self._clock = 0
+        # >= 2 slots per row keeps the load factor <= 0.5, slot -> row or _EMPTY
+        self._slots = np.full(_next_pow2(2 * capacity), _EMPTY, dtype=np.int32)
+        self._mask = len(self._slots) - 1
+        self._rows = {} # key -> row, same pairs as the index
+        self._unindexed = [] # rows inserted since the index was last updated, find_many indexes them first
+        # key -> [q list, counts list, row], newer than the arrays until sync(). Hot paths read it before
+        # falling back to entry(). A budgeted table keeps fewer, they count against its budget
+        self.hot = {}
+        self._hot_limit = hot_rows(self.max_states)
+
+    # Builds a table from parallel key/q/count arrays (e.g. a saved agent)
+    @staticmethod
+    def from_arrays(actions, init_q, keys, q, counts, max_states=None, spill=None):
+        table = QTable(actions, init_q, capacity=max(1024, len(keys)), spill=spill)
+        table.max_states = max_states or None
+        table._hot_limit = hot_rows(table.max_states)
+        n = len(keys)
+        table.keys[:n] = keys
+        table._q[:n] = q
+        table._counts[:n] = counts
+        table._size = n
+        table._rows = dict(zip(keys.tolist(), range(n)))
+        table._rebuild_slots()
+        return table
+
+    # Builds a table from the older dict of lists layout
+    @staticmethod
+    def from_dicts(actions, init_q, q_by_state, count_by_state):
+        keys = np.fromiter(q_by_state.keys(), dtype=np.int64, count=len(q_by_state))
+        q = np.array([q_by_state[k] for k in q_by_state], dtype=np.float32).reshape(-1, actions)
+        counts = np.array(
+            [count_by_state.get(k, [0] * actions) for k in q_by_state], dtype=np.uint32
+        ).reshape(-1, actions)
+        return QTable.from_arrays(actions, init_q, keys, q, counts)
+
+    def __len__(self):
+        return self._size
+
+    # Arrays over every row, hot rows written back first
+    @property
+    def q(self):
+        if self.hot:
+            self.sync()
+        return self._q
+
+    @property
+    def counts(self):
+        if self.hot:
+            self.sync()
+        return self._counts
+
+    @property
+    def dirty(self):
+        if self.hot:
+            self.sync()
+        return self._dirty
+
+    # [q-values, counts, row] of key as lists to read and update in place, inserted like row() if unseen.
+    # Only valid until the next sync(): the next entry() call may do one, so finish w/ an entry before taking another
+    def entry(self, key):
+        entry = self.hot.get(key)
+        if entry is None:
+            if len(self.hot) >= self._hot_limit:
+                self.sync()
+            # Access ticks of hot rows are set by sync()
+            row = self._rows.get(key)
+            if row is not None:
+                entry = [self._q[row].tolist(), self._counts[row].tolist(), row]
+            else:
+                # _insert inlined, the array row is left for sync() to write. It can't tell an unwritten row
+                # changed, new rows are dirty from the start
+                row = self._size
+                if row == len(self.keys):
+                    self._grow()
+                self.keys[row] = key
+                self._dirty[row] = True
+                self._rows[key] = row
+                self._unindexed.append(row)
+                self._size = row + 1
+                spilled = self.spill.get(key) if self.spill is not None else None
+                if spilled is None:
+                    entry = [[self.init_q] * self.actions, [0] * self.actions, row]
+                else:
+                    entry = [spilled[0].tolist(), spilled[1].tolist(), row]
+            self.hot[key] = entry
+        return entry
+
+    # Writes the hot rows back, the changed ones are marked dirty and every one counts as used now
+    def sync(self):
+        entries = list(self.hot.values())
+        self.hot.clear()
+        if not entries:
+            return
+        rows = np.fromiter((entry[2] for entry in entries), dtype=np.int64, count=len(entries))
+        q = np.array([entry[0] for entry in entries], dtype=np.float32)
+        counts = np.array([entry[1] for entry in entries], dtype=np.uint32)
+        changed = (q != self._q[rows]).any(axis=1) | (counts != self._counts[rows]).any(axis=1)
+        self._dirty[rows[changed]] = True
+        self._q[rows] = q
+        self._counts[rows] = counts
+        if self.max_states:
+            self._clock += 1
+            self.last_access[rows] = self._clock
+
+    def __contains__(self, key):
+        return self.find(key) != _EMPTY
+
+    # Row of key, _EMPTY (-1) if unseen
+    def find(self, key):
+        return self._rows.get(key, _EMPTY)
+
+    # Rows of an array of keys, _EMPTY where unseen; probes every key at once
+    def find_many(self, keys):
+        if self._unindexed:
+            self._index(np.array(self._unindexed, dtype=np.int32))
+            self._unindexed = []
+        keys = np.asarray(keys, dtype=np.int64)
+        rows = np.full(len(keys), _EMPTY, dtype=np.int64)
+        pending = np.arange(len(keys))
+        pos = _hash_many(keys, self._mask)
+        while pending.size:
+            slot_rows = self._slots[pos]
+            occupied = slot_rows != _EMPTY
+            hit = occupied & (self.keys[slot_rows] == keys[pending])
+            rows[pending[hit]] = slot_rows[hit]
+            probing = occupied & ~hit
+            pending, pos = pending[probing], (pos[probing] + 1) & self._mask
+        return rows
+
+    # Row of key, inserted w/ init_q/0 counts (or its spilled values) on first access
+    def row(self, key):
+        row = self._rows.get(key)
+        if row is not None:
+            # Access ticks only matter to a budgeted table
+            if self.max_states:
+                self._clock += 1
+                self.last_access[row] = self._clock
+            return row
+        key = int(key)
+        row = self._insert(key)
+        spilled = self.spill.get(key) if self.spill is not None else None
+        if spilled is None:
+            self._q[row] = self.init_q
+            self._counts[row] = 0
+        else:
+            self._q[row], self._counts[row] = spilled
+        self._clock += 1
+        self.last_access[row] = self._clock
+        return row
+
+    # Adds key's row w/o setting its values, the index gets it w/ the next find_many/_grow
+    def _insert(self, key):
+        row = self._size
+        if row == len(self.keys):
+            self._grow()
+        self.keys[row] = key
+        self._rows[key] = row
+        self._unindexed.append(row)
+        self._size += 1
+        return row
+
+    # Past max_states, evict() should be called before rows are inserted again
+    def over_budget(self):
+        return self.max_states is not None and self._size >= self.max_states
+
+    # Evicts down to (1 - fraction) * max_states rows, fewest visits first and least recently used among equals.
+    # Rows are compacted, returns old row -> new row (_EMPTY for evicted ones) for callers holding rows
+    def evict(self, fraction=0.1):
+        self.sync()
+        n = self._size
+        visits = self.counts[:n].sum(axis=1, dtype=np.int64)
+        order = np.lexsort((self.last_access[:n], visits))
+        evicted = order[:max(1, n - int((1 - fraction) * self.max_states))]
+        if self.spill is not None:
+            self.spill.add(self.keys[evicted], self.q[evicted], self.counts[evicted])
+        # Their last values still go in the next checkpoint
+        changed = evicted[self.dirty[evicted]]
+        if len(changed):
+            self._evicted_dirty.append((self.keys[changed].copy(), self.q[changed].copy(), self.counts[changed].copy()))
+        keep = np.ones(n, dtype=bool)
+        keep[evicted] = False
+        kept = np.flatnonzero(keep)
+        remap = np.full(n, _EMPTY, dtype=np.int64)
+        remap[kept] = np.arange(len(kept))
+        for array in (self.keys, self._q, self._counts, self._dirty, self.last_access):
+            array[:len(kept)] = array[kept]
+        self._size = len(kept)
+        self.evictions += len(evicted)
+        self._rows = dict(zip(self.keys[:self._size].tolist(), range(self._size)))
+        self._rebuild_slots()
+        return remap
+
+    def state_keys(self):
+        return self.keys[:self._size]
+
+    # Trimmed copies of the used rows
+    def arrays(self):
+        self.sync()
+        n = self._size
+        return self.keys[:n].copy(), self._q[:n].copy(), self._counts[:n].copy()
+
+    # Copies of the rows changed since the last call (evicted ones first, so live rows win), clears their dirty flags
+    def take_dirty(self):
+        self.sync()
+        n = self._size
+        rows = np.flatnonzero(self._dirty[:n])
+        self._dirty[rows] = False
+        parts = self._evicted_dirty + [(self.keys[rows], self._q[rows], self._counts[rows])]
+        self._evicted_dirty = []
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    # Bytes allocated for keys, q, counts, dirty flags, access ticks, the index, the key -> row dict
+    # (its table and int objects), the rows waiting for the index, the hot rows and the spill store
+    def nbytes(self):
+        spill = self.spill.nbytes() if self.spill is not None else 0
+        return (
+            self.keys.nbytes + self._q.nbytes + self._counts.nbytes + self._dirty.nbytes + self.last_access.nbytes
+            + self._slots.nbytes + sys.getsizeof(self._rows) + _DICT_INT_BYTES * self._size + sys.getsizeof(self._unindexed)
+            + hot_row_bytes(self.actions) * len(self.hot) + spill
+        )
+
+    def bytes_per_state(self):
+        return self.nbytes() / max(1, self._size)
+
+    def _grow(self):
+        capacity = 2 * len(self.keys)
+        if self.max_states:
+            # A budgeted table only needs room for the few rows inserted between evictions
+            capacity = max(len(self.keys) + _HEADROOM, min(capacity, self.max_states + _HEADROOM))
+        n = self._size
+        keys = np.empty(capacity, dtype=np.int64)
+        q = np.empty((capacity, self.actions), dtype=np.float32)
+        counts = np.empty((capacity, self.actions), dtype=np.uint32)
+        dirty = np.zeros(capacity, dtype=bool)
+        last_access = np.zeros(capacity, dtype=np.int64)
+        keys[:n], q[:n], counts[:n], dirty[:n] = self.keys[:n], self._q[:n], self._counts[:n], self._dirty[:n]
+        last_access[:n] = self.last_access[:n]
+        self.keys, self._q, self._counts, self._dirty, self.last_access = keys, q, counts, dirty, last_access
+        self._slots = np.full(_next_pow2(2 * capacity), _EMPTY, dtype=np.int32)
+        self._mask = len(self._slots) - 1
+        self._rebuild_slots()
+
+    # Reinserts every row into the (empty) index
+    def _rebuild_slots(self):
+        self._slots.fill(_EMPTY)
+        self._unindexed = []
+        self._index(np.arange(self._size, dtype=np.int32))
+
+    # Inserts rows into the index, vectorized by probe round
+    def _index(self, rows):
+        slots, mask = self._slots, self._mask
+        pos = _hash_many(self.keys[rows], mask)
+        while rows.size:
+            # Rows probing an empty slot claim it, the lowest row wins when several probe the same one
+            free = np.flatnonzero(slots[pos] == _EMPTY)
+            claimed_pos, first = np.unique(pos[free], return_index=True)
+            slots[claimed_pos] = rows[free[first]]
+            placed = np.zeros(rows.size, dtype=bool)
+            placed[free[first]] = True
+            rows, pos = rows[~placed], (pos[~placed] + 1) & mask
+
+# Compact sorted copy of evicted rows visited at least `min_visits` times: key, float16 q-values and
+# uint16 counts, ~3x smaller than a table row. Past `capacity` entries the least visited ones are dropped.
+# Lives in memory only, QLearningAgent.save writes the spilled rows w/ the table
+class SpillStore:
+    def __init__(self, actions, capacity, min_visits=2):
+        self.actions = actions
+        self.capacity = capacity
+        self.min_visits = min_visits
+        self.keys = np.empty(0, dtype=np.int64)
+        self.q = np.empty((0, actions), dtype=np.float16)
+        self.counts = np.empty((0, actions), dtype=np.uint16)
+        self.dropped = 0 # evicted rows not kept (too few visits or over capacity)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, keys, q, counts):
+        kept = counts.sum(axis=1, dtype=np.int64) >= self.min_visits
+        self.dropped += int(np.count_nonzero(~kept))
+        # New values last so unique keeps them over older spills of the same key
+        keys = np.concatenate([self.keys, keys[kept]])
+        q = np.concatenate([self.q, q[kept].astype(np.float16)])
+        counts = np.concatenate([self.counts, np.minimum(counts[kept], np.iinfo(np.uint16).max).astype(np.uint16)])
+        unique_keys, reversed_index = np.unique(keys[::-1], return_index=True)
+        latest = len(keys) - 1 - reversed_index
+        q, counts = q[latest], counts[latest]
+        if len(unique_keys) > self.capacity:
+            most_visited = np.sort(np.argsort(-counts.sum(axis=1, dtype=np.int64), kind="stable")[:self.capacity])
+            self.dropped += len(unique_keys) - self.capacity
+            unique_keys, q, counts = unique_keys[most_visited], q[most_visited], counts[most_visited]
+        self.keys, self.q, self.counts = unique_keys, q, counts
+
+    # (q, counts) of a spilled key, None if it isn't here
+    def get(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.q[i], self.counts[i]
+        return None
+
+    def nbytes(self):
+        return self.keys.nbytes + self.q.nbytes + self.counts.nbytes
+
+# Read-only table over sorted key/q/count arrays (e.g. a memory-mapped .qtab), found by binary search
+class SortedQTable:
+    def __init__(self, actions, init_q, keys, q, counts):
+        self.actions = actions
+        self.init_q = float(init_q)
+        self.keys, self.q, self.counts = keys, q, counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.find(key) != _EMPTY
+
+    def find(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return _EMPTY
+
+    def row(self, key):
+        row = self.find(key)
+        if row == _EMPTY:
+            raise KeyError(f"{key} not in read-only table, load w/ mmap=False to keep training")
+        return row
+
+    def state_keys(self):
+        return self.keys
+
+    def arrays(self):
+        return np.array(self.keys), np.array(self.q), np.array(self.counts)
+
+    # Mapped pages aren't private memory, this is the file's share per state
+    def nbytes(self):
+        return self.keys.nbytes + self.q.nbytes + self.counts.nbytes
+
+    def bytes_per_state(self):
+        return self.nbytes() / max(1, len(self))
+
+# States a max_table_mb budget holds: a table row (key, q, counts, dirty flag, access tick, up to 4 index slots,
+# its key -> row dict entry of up to 60 bytes w/ its ints, a not yet indexed row and a 16th of a hot row) plus room for
+# 1 spilled row each, after the arrays and index slots of the _HEADROOM rows past them
+def states_for_budget(actions, budget_bytes):
+    array_bytes = 8 + 4 * actions + 4 * actions + 1 + 8 + 4 * 4
+    row_bytes = array_bytes + 60 + _DICT_INT_BYTES + 8 + hot_row_bytes(actions) / 16
+    spill_bytes = 8 + 2 * actions + 2 * actions
+    return max(1, int((budget_bytes - _HEADROOM * array_bytes) // (row_bytes + spill_bytes)))
+
+# Rows QTable.entry holds, a budgeted table 1 per 16 states it's allowed
+def hot_rows(max_states):
+    return _HOT_ROWS if not max_states else max(1, min(_HOT_ROWS, max_states // 16))
+
+# Upper estimate of 1 hot row: dict slot, the entry list, q/counts lists and their float/int objects
+def hot_row_bytes(actions):
+    return 48 + 80 + 2 * (56 + 8 * actions) + 24 * actions + 28 * actions
+
+# Index slots of an array of keys
+def _hash_many(keys, mask):
+    hashed = keys.astype(np.uint64) * np.uint64(_HASH_MULT)
+    return ((hashed >> np.uint64(32)) & np.uint64(mask)).astype(np.int64)
+
+def _next_pow2(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+# Read-only dict-like view of one of the table's per-state arrays (q or counts)
+class TableView(Mapping):
+    def __init__(self, table: QTable, attribute):
+        self._table = table
+        self._attribute = attribute
+
+    def __getitem__(self, key):
+        row = self._table.find(key)
+        if row == _EMPTY:
+            raise KeyError(key)
+        return getattr(self._table, self._attribute)[row]
+
+    def get(self, key, default=None):
+        row = self._table.find(key)
+        if row == _EMPTY:
+            return default
+        return getattr(self._table, self._attribute)[row]
+
+    def __iter__(self):
+        return iter(self._table.state_keys().tolist())
+
+    def __len__(self):
+        return len(self._table)
+
+    # Walks rows directly instead of a lookup per key
+    def items(self):
+        n = len(self._table)
+        return zip(self._table.state_keys().tolist(), getattr(self._table, self._attribute)[:n])
@@ -0,0 +1,41 @@
+import numpy as np
+
+"""
+Experience replay: fixed capacity ring buffer of packed transitions in numpy arrays,
+QLearningAgent samples minibatches from it and applies the TD updates w/ vectorized gathers/scatters
+"""
+
+class ReplayBuffer:
+    def __init__(self, capacity, seed=17):
+        capacity = int(capacity)
+        self.capacity = capacity
+        self.state_keys = np.empty(capacity, dtype=np.int64)
+        self.actions = np.empty(capacity, dtype=np.uint8)
+        self.rewards = np.empty(capacity, dtype=np.float32)
+        self.result_state_keys = np.empty(capacity, dtype=np.int64)
+        self.terminals = np.empty(capacity, dtype=bool)
+        self.steps = np.empty(capacity, dtype=np.uint16) # env steps the action lasted, > 1 for option steps
+        self._next = 0
+        self._size = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self._size
+
+    # Overwrites the oldest transition once full
+    def add(self, state_key, action, reward, result_state_key, terminal, steps=1):
+        i = self._next
+        self.state_keys[i] = state_key
+        self.actions[i] = action
+        self.rewards[i] = reward
+        # Terminal transitions never read their result state
+        self.result_state_keys[i] = state_key if result_state_key is None else result_state_key
+        self.terminals[i] = terminal
+        self.steps[i] = steps
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    # Uniform minibatch: (state_keys, actions, rewards, result_state_keys, terminals, steps)
+    def sample(self, batch_size):
+        i = self._rng.integers(0, self._size, batch_size)
+        return self.state_keys[i], self.actions[i], self.rewards[i], self.result_state_keys[i], self.terminals[i], self.steps[i]
@@ -1,10 +1,20 @@
 import time
 
-from emulator.game_env import MsPacmanALE
+import numpy as np
+
+from emulator.game_env import MsPacmanALE, VectorMsPacmanALE
+from emulator.recording import ReplayMsPacman, TrajectoryRecorder
+from emulator.start_pool import StartStatePool
+from emulator.render import FrameViewer
 from agent.q_agent import QLearningAgent
-from agent import state_functions
+from agent.linear_agent import LinearQAgent
+from agent import state_functions, checkpoint
+from agent.metrics import MetricsStream
+from agent.state_codec import codec_for
+from agent.state_cache import StateKeyCache
 
 # Makes agent play 1 game on emulator
+# metrics (agent.metrics.MetricsStream) times every phase of the loop, verbose >= 2 prints positions every step
 def run_episode_ale(
         env: MsPacmanALE,
         agent: QLearningAgent,
@@ -13,60 +23,99 @@ def run_episode_ale(
         max_steps=10000, 
         reward_clip=False,
         render=False,
-        fps=60
+        fps=60,
+        metrics=None,
+        verbose=0,
+        recorder=None, # emulator.recording.TrajectoryRecorder, gets every RAM/action/reward/done
+        video=None, # emulator.render.VideoRecorder, gets (decimated) frames
+        state_cache=None, # agent.state_cache.StateKeyCache of state_function, replaces state_function + encode
     ):  
+        if recorder is not None and env.macro_actions:
+            # 1 recorded row per option would be replayed (train_offline) as a 1 step transition
+            raise ValueError("recording RAM trajectories needs plain steps, turn macro actions off")
+        timed = metrics is not None
+        if timed:
+            metrics.start_episode(agent)
+            t = time.perf_counter()
         init_ram = env.reset()
+        if timed:
+            t = metrics.lap("emulator_step", t)
+        if recorder is not None:
+            recorder.reset(init_ram)
         prev_action = 3 # Initialize as 3 as pacman faces left side
-        # State function generalizes states to a state key
-        init_state_raw = state_function(init_ram, init_ram, prev_action)
-        init_state_key = encode_state(init_state_raw)
+        if training:
+            agent.clear_traces() # Q(lambda) traces end w/ the episode, even a max_steps cut one
+        # State function generalizes states, codec packs them into an int state key
+        encode_state = codec_for(state_function).encode
+        if state_cache is not None:
+            init_state_key = state_cache(init_ram, init_ram, prev_action)
+        else:
+            init_state_key = encode_state(state_function(init_ram, init_ram, prev_action))
         prev_ram = init_ram.copy()
         total_reward = 0
         steps = 0
+        frames = 0
         
-        if render:
-            import pygame
-            pygame.init()
-            screen = pygame.display.set_mode((160, 210))
-            pygame.display.set_caption("Ms. Pac-Man ALE")
+        # Frames go to a render thread, the loop only copies the screen into its frame ring
+        viewer = FrameViewer(fps) if render else None
 
         while True:
+            if timed:
+                t = time.perf_counter()
             # If training, agent uses exploration policy; else, be greedy and take largest q
             if training:
                 action = agent.select_action(init_state_key)
             else:
-                q_vals = agent.q_by_state.get(init_state_key)
-                if q_vals is None:
-                    approximation_function = getattr(state_functions, state_function.__name__ + "_approximation")
-                    closest_state_q_vals = approximation_function(agent, init_state_key)
-                    action = int(max(range(agent.actions), key=lambda i: closest_state_q_vals[i]))
-                else:
-                    action = int(max(range(agent.actions), key=lambda i: agent.q_by_state[init_state_key][i]))
+                action = greedy_action(agent, state_function, init_state_key)
+            if timed:
+                t = metrics.lap("select_action", t)
 
-            # take action in emulator
-            cur_ram, reward, isTerminal = env.step(action)
+            # take action in emulator, w/ macro actions it's held until the next junction (or a close ghost)
+            if env.macro_actions:
+                cur_ram, reward, isTerminal, action_frames = env.step_option(action)
+            else:
+                cur_ram, reward, isTerminal = env.step(action)
+                action_frames = env.frame_skip
+            frames += action_frames
+            if recorder is not None:
+                recorder.step(cur_ram, action, reward, isTerminal)
             if reward_clip:
                 reward = max(-1.0, min(1.0, reward))
+            if timed:
+                t = metrics.lap("emulator_step", t)
             
-            print("prev_x: ", prev_ram[10], " prev_y: ", prev_ram[16], end="")
-            print("cur_x: ", cur_ram[10], " cur_y: ", cur_ram[16])
+            if verbose >= 2:
+                print("prev_x: ", prev_ram[10], " prev_y: ", prev_ram[16], end="")
+                print("cur_x: ", cur_ram[10], " cur_y: ", cur_ram[16])
             
-            # Optionally render w/ pygames
-            if render:
-                # Closing window kills process
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        isTerminal = True
-                frame = env.ale.getScreenRGB()
-                surf = pygame.surfarray.make_surface(frame.swapaxes(0, 1))
-                screen.blit(surf, (0, 0))
-                pygame.display.flip()
-                time.sleep(1/fps)
-
-            result_state_key = encode_state(state_function(cur_ram, prev_ram, prev_action))
+            # Optionally render w/ pygames and/or record a video
+            if viewer is not None:
+                viewer.submit(env.ale, action_frames)
+                # Closing window ends the episode
+                if viewer.closed:
+                    isTerminal = True
+            if video is not None:
+                video.submit(env.ale, action_frames)
+            if timed and (viewer is not None or video is not None):
+                t = metrics.lap("render", t)
+
+            if state_cache is not None:
+                # Hits skip both phases, all of it counts as state_function
+                result_state_key = state_cache(cur_ram, prev_ram, prev_action)
+                if timed:
+                    t = metrics.lap("state_function", t)
+            else:
+                result_state_raw = state_function(cur_ram, prev_ram, prev_action)
+                if timed:
+                    t = metrics.lap("state_function", t)
+                result_state_key = encode_state(result_state_raw)
+                if timed:
+                    t = metrics.lap("encode", t)
 
             if training:
-                agent.update(init_state_key, action, reward, result_state_key, isTerminal)
+                agent.update(init_state_key, action, reward, result_state_key, isTerminal, steps=action_frames // env.frame_skip)
+                if timed:
+                    metrics.lap("update", t)
             init_state_key = result_state_key
             prev_ram = cur_ram.copy()
             prev_action = action
@@ -76,12 +125,106 @@ def run_episode_ale(
             if isTerminal or steps >= max_steps:
                 break
 
-        if render:
-            pygame.quit()
+        if viewer is not None:
+            viewer.close()
+        if timed:
+            metrics.end_episode(agent, total_reward, steps, state_cache=state_cache)
+        if verbose >= 1:
+            print(f"episode reward: {total_reward} steps: {steps} frames: {frames} states: {len(agent.q_by_state)} evicted: {getattr(agent.table, 'evictions', 0)}")
         return total_reward, steps
 
-def encode_state(state):
-    return tuple(sorted(state.items()))
+# Largest q action, unseen states fall back to the closest known state's q-values
+def greedy_action(agent: QLearningAgent, state_function, state_key):
+    q_vals = agent.q_by_state.get(state_key)
+    if q_vals is None:
+        agent.greedy_fallbacks += 1
+        approximation_function = getattr(state_functions, state_function.__name__ + "_approximation")
+        q_vals = approximation_function(agent, state_key)
+    return int(max(range(agent.actions), key=lambda i: q_vals[i]))
+
+# Makes agent play on every sub-env of a vector emulator until `episodes` games have finished
+def run_episodes_vec(
+        env: VectorMsPacmanALE,
+        agent: QLearningAgent,
+        state_function,
+        episodes,
+        training=True,
+        max_steps=10000,
+        reward_clip=False,
+        on_episode_end=None, # called w/ (reward, steps) of every counted episode as it ends, other sub-envs keep running
+    ):
+        num_envs = env.num_envs
+        codec = codec_for(state_function)
+        encode_state = codec.encode
+        # Batched variant encodes every sub-env's next state in one numpy pass
+        batch_state_function = getattr(state_functions, state_function.__name__ + "_batch")
+        rams = env.reset()
+        prev_rams = rams.copy()
+        prev_actions = [3] * num_envs # pacman faces left side at start
+        state_keys = [encode_state(state_function(rams[i], rams[i], 3)) for i in range(num_envs)]
+        episode_rewards, episode_steps = [0] * num_envs, [0] * num_envs
+        finished_rewards, finished_steps = [], []
+
+        while len(finished_rewards) < episodes:
+            if training:
+                actions = [agent.select_action(key) for key in state_keys]
+            else:
+                actions = [greedy_action(agent, state_function, key) for key in state_keys]
+
+            rams, rewards, dones = env.step(actions)
+            result_state_keys = codec.encode_many(batch_state_function(rams, prev_rams, prev_actions)).tolist()
+            for i in range(num_envs):
+                reward = float(rewards[i])
+                if reward_clip:
+                    reward = max(-1.0, min(1.0, reward))
+                episode_rewards[i] += reward
+                episode_steps[i] += 1
+
+                # Done sub-envs already hold the next episode's RAM, terminal update never reads result state
+                result_state_key = None if dones[i] else result_state_keys[i]
+                if training:
+                    agent.update(state_keys[i], actions[i], reward, result_state_key, bool(dones[i]))
+
+                if dones[i] or episode_steps[i] >= max_steps:
+                    finished_rewards.append(episode_rewards[i])
+                    finished_steps.append(episode_steps[i])
+                    if on_episode_end is not None and len(finished_rewards) <= episodes:
+                        on_episode_end(episode_rewards[i], episode_steps[i])
+                    episode_rewards[i], episode_steps[i] = 0, 0
+                    if not dones[i]:
+                        rams[i] = env.reset_at(i)
+                    prev_actions[i] = 3
+                    state_keys[i] = encode_state(state_function(rams[i], rams[i], 3))
+                else:
+                    prev_actions[i] = actions[i]
+                    state_keys[i] = result_state_key
+                prev_rams[i] = rams[i]
+
+        return finished_rewards[:episodes], finished_steps[:episodes]
+
+# Offline Q-learning pass over a RAM recording, every recorded transition goes through agent.update w/o emulating
+def train_offline(agent: QLearningAgent, replay: ReplayMsPacman, state_function, reward_clip=False):
+    codec = codec_for(state_function)
+    batch_state_function = getattr(state_functions, state_function.__name__ + "_batch")
+    history = {"reward": [], "steps": []}
+    for rams, actions, rewards, dones in replay.episodes():
+        if len(rams) < 2:
+            continue
+        # Same keys as run_episode_ale: state t is (ram t, ram t-1, action taken before the one leading to t)
+        prev_rams = np.concatenate([rams[:1], rams[:-1]])
+        prev_actions = np.concatenate([[3, 3], actions[1:-1]])
+        keys = codec.encode_many(batch_state_function(rams, prev_rams, prev_actions)).tolist()
+        total_reward = 0
+        agent.clear_traces()
+        for t in range(1, len(rams)):
+            reward = float(rewards[t])
+            if reward_clip:
+                reward = max(-1.0, min(1.0, reward))
+            agent.update(keys[t - 1], int(actions[t]), reward, keys[t], bool(dones[t]))
+            total_reward += reward
+        history["reward"].append(total_reward)
+        history["steps"].append(len(rams) - 1)
+    return history
 
 # Training loop
 def train_loop(
@@ -103,23 +246,139 @@ def train_loop(
     ucb_strength, # UCB
 
     filename="q_ale.pkl",
+    # Experience replay, buffer size 0 disables it
+    replay_buffer_size=0,
+    replay_ratio=1.0,
+    replay_batch_size=32,
+    # Watkins Q(lambda), trace_lambda 0 keeps 1 step Q-learning
+    trace_lambda=0.0,
+    trace_cutoff=0.01,
+    # Q-table memory budget in MiB, 0 = unbounded
+    max_table_mb=0,
+    num_envs=1, # > 1 steps that many emulators in worker processes
+    reset_noop_max=0, # random no-op frames after each (snapshot) reset
+    state_cache_size=0, # memoized state keys (agent.state_cache), 0 disables the cache
+    # Mid-game start states, pool size 0 disables them; episodes then report rewards from where they started
+    start_pool_size=0,
+    start_pool_prob=0.5,
+    macro_actions=False, # hold actions until a junction/wall/close ghost (MsPacmanALE.step_option), 1 decision per option
+    # Background incremental checkpoints, None disables them
+    checkpoint_dir=None,
+    checkpoint_every_episodes=5,
+    checkpoint_every_seconds=600,
+    resume=False, # continue the run saved in checkpoint_dir
+    metrics_path=None, # JSONL file for per-episode phase timings/counters, None disables them
+    verbose=0, # 1: print every episode, 2: print positions every step
+    record_dir=None, # directory to record RAM trajectories into, None disables recording
+    agent_type="table", # "table" (QLearningAgent) or "linear" (LinearQAgent, fixed size hashed features)
+    linear_kwargs=None, # LinearQAgent feature settings (feature_bits, tilings, tile_width)
 ):
-    env = MsPacmanALE(seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost)
+    if trace_lambda > 0 and num_envs > 1:
+        # Interleaved sub-env transitions would leak traces across episodes
+        raise ValueError("Q(lambda) traces need sequential episodes, use num_envs=1")
+    if macro_actions and num_envs > 1:
+        raise ValueError("macro actions are only implemented for the single emulator loop, use num_envs=1")
+    if macro_actions and record_dir:
+        raise ValueError("recording RAM trajectories needs plain steps, turn macro actions off")
+    if num_envs > 1:
+        # The vector loop steps every sub-env per batch, per step hooks aren't wired into it (per episode prints are)
+        unsupported = [
+            name for name, value in (
+                ("metrics", metrics_path), ("record_dir", record_dir), ("state_cache_size", state_cache_size),
+                ("verbose >= 2", verbose >= 2),
+            ) if value
+        ]
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} only work w/ the single emulator loop, use num_envs=1")
+    if num_envs > 1:
+        env = VectorMsPacmanALE(
+            num_envs, seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost, reset_noop_max=reset_noop_max,
+            start_pool_size=start_pool_size, start_pool_prob=start_pool_prob,
+        )
+    else:
+        start_pool = StartStatePool(start_pool_size, start_pool_prob, seed=seed) if start_pool_size > 0 else None
+        env = MsPacmanALE(
+            seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost, reset_noop_max=reset_noop_max,
+            start_pool=start_pool, macro_actions=macro_actions,
+        )
     actions = env.actions_count
 
-    agent = QLearningAgent(
-        actions=actions, discount=discount, alpha=alpha, init_q=init_q,
-        policy=policy, eps_start=eps_start, eps_end=eps_end, eps_decay_steps=eps_decay_steps,
-        ucb_strength=ucb_strength, seed=seed,
-    )
+    if agent_type == "linear" and (resume or checkpoint_dir):
+        # Delta checkpoints are made of changed table rows, the linear agent is only saved whole at the end
+        raise ValueError("checkpointing/resuming needs the tabular agent, the linear agent is only saved at the end")
+    if agent_type == "linear" and filename and str(filename).endswith(".qtab"):
+        # Checked before training rather than when the final save fails
+        raise ValueError(f"can't save the linear agent as {filename}, .qtab holds q-tables, use a .pkl path")
+    if agent_type == "linear":
+        agent = LinearQAgent(
+            actions=actions, state_function_name=state_function.__name__, discount=discount, alpha=alpha, init_q=init_q,
+            policy=policy, eps_start=eps_start, eps_end=eps_end, eps_decay_steps=eps_decay_steps, seed=seed,
+            replay_buffer_size=replay_buffer_size, trace_lambda=trace_lambda, # rejected if set
+            frame_skip=frame_skip, macro_actions=macro_actions,
+            **(linear_kwargs or {}),
+        )
+        history = {"reward": [], "steps": []}
+    else:
+        agent = QLearningAgent(
+            actions=actions, discount=discount, alpha=alpha, init_q=init_q,
+            policy=policy, eps_start=eps_start, eps_end=eps_end, eps_decay_steps=eps_decay_steps,
+            ucb_strength=ucb_strength, seed=seed,
+            replay_buffer_size=replay_buffer_size, replay_ratio=replay_ratio, replay_batch_size=replay_batch_size,
+            trace_lambda=trace_lambda, trace_cutoff=trace_cutoff,
+            max_table_mb=max_table_mb, frame_skip=frame_skip, macro_actions=macro_actions,
+        )
+        history = {"reward": [], "steps": []}
+    if resume:
+        # Agent, total_steps and history come back from the last checkpoint, if it was made w/ these settings
+        settings = agent.header(state_function.__name__)
+        agent, history = checkpoint.restore(checkpoint_dir)
+        checkpoint.check_resume(agent.header(agent.state_function_name), settings)
+        print(f"Resuming at episode {len(history['reward'])}, {agent.total_steps} steps")
 
-    history = {"reward": [], "steps": []}
-    for ep in range(episodes):
-        reward, steps = run_episode_ale(
-            env, agent, state_function, training=True, max_steps=max_steps, reward_clip=reward_clip,
+    metrics = MetricsStream(metrics_path) if metrics_path else None
+    state_cache = StateKeyCache(state_function, state_cache_size) if state_cache_size > 0 else None
+    recorder = TrajectoryRecorder(record_dir) if record_dir else None
+    checkpointer = None
+    if checkpoint_dir:
+        checkpointer = checkpoint.DeltaCheckpointer(
+            checkpoint_dir, state_function, every_episodes=checkpoint_every_episodes,
+            every_seconds=checkpoint_every_seconds, resume=resume, start_episode=len(history["reward"]),
         )
-        history["reward"].append(reward); 
-        history["steps"].append(steps)
+
+    try:
+        if num_envs > 1:
+            # Checkpoints are taken as episodes end, w/o stopping the sub-envs still mid-episode
+            def episode_end(reward, steps):
+                history["reward"].append(reward)
+                history["steps"].append(steps)
+                if verbose >= 1:
+                    print(f"episode {len(history['reward'])} reward: {reward} steps: {steps} states: {len(agent.q_by_state)}")
+                if checkpointer:
+                    checkpointer.maybe_checkpoint(agent, history)
+            try:
+                run_episodes_vec(
+                    env, agent, state_function, episodes - len(history["reward"]), training=True, max_steps=max_steps,
+                    reward_clip=reward_clip, on_episode_end=episode_end,
+                )
+            finally:
+                env.close()
+        else:
+            for ep in range(len(history["reward"]), episodes):
+                reward, steps = run_episode_ale(
+                    env, agent, state_function, training=True, max_steps=max_steps, reward_clip=reward_clip,
+                    metrics=metrics, verbose=verbose, recorder=recorder, state_cache=state_cache,
+                )
+                history["reward"].append(reward); 
+                history["steps"].append(steps)
+                if checkpointer:
+                    checkpointer.maybe_checkpoint(agent, history)
+    finally:
+        if checkpointer:
+            checkpointer.close(agent, history)
+        if metrics:
+            metrics.close()
+        if recorder:
+            recorder.close()
 
     # final save
     if filename:
@@ -0,0 +1,52 @@
+import operator
+
+from agent.state_codec import codec_for
+
+"""
+Memoized state keys: a state function only reads the RAM bytes it declares (ram_bytes/prev_ram_bytes),
+so the key of a step is a function of those bytes + prev_action and repeated RAM configurations (frequent,
+things move < 1 pixel a frame) skip the feature computation and encoding entirely
+"""
+
+class StateKeyCache:
+    def __init__(self, state_function, size=65536):
+        self.state_function = state_function
+        self.size = size
+        self._encode = codec_for(state_function).encode
+        self._ram_values = _bytes_getter(tuple(state_function.ram_bytes))
+        prev_ram_bytes = tuple(state_function.prev_ram_bytes)
+        self._prev_ram_values = _bytes_getter(prev_ram_bytes) if prev_ram_bytes else None
+        # Insertion ordered dict as LRU: hits move to the end, the front is evicted
+        self._keys = {}
+        self.hits, self.misses = 0, 0
+
+    # Same as codec_for(state_function).encode(state_function(ram, prev_ram, prev_action))
+    def __call__(self, ram, prev_ram, prev_action):
+        prev_ram_values = None
+        if prev_ram is not None:
+            prev_ram_values = self._prev_ram_values(prev_ram.tobytes()) if self._prev_ram_values else ()
+        cache_key = (self._ram_values(ram.tobytes()), prev_ram_values, int(prev_action))
+        keys = self._keys
+        state_key = keys.pop(cache_key, None)
+        if state_key is None:
+            self.misses += 1
+            state_key = self._encode(self.state_function(ram, prev_ram, prev_action))
+            if len(keys) >= self.size:
+                del keys[next(iter(keys))]
+        else:
+            self.hits += 1
+        keys[cache_key] = state_key
+        return state_key
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._keys), max_size=self.size)
+
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+# itemgetter over ram.tobytes() is the cheapest way to pull a few bytes out as a hashable tuple
+def _bytes_getter(addresses):
+    if len(addresses) == 1:
+        address = addresses[0]
+        return lambda data: (data[address],)
+    return operator.itemgetter(*addresses)
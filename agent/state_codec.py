@@ -0,0 +1,94 @@
+import operator
+
+import numpy as np
+
+from agent import config
+
+"""
+Packs state dicts from the state functions into a single int key (and back), fields are laid out
+by the (name, bits[, offset]) widths each state function declares in its `fields` attribute
+"""
+
+class StateCodec:
+    def __init__(self, fields, check_ranges=False):
+        # (name, shift, mask, offset), offset shifts signed fields (e.g. -1..1) to start at 0
+        self._fields = []
+        shift = 0
+        for field in fields:
+            name, bits = field[0], field[1]
+            offset = field[2] if len(field) > 2 else 0
+            self._fields.append((name, shift, (1 << bits) - 1, offset))
+            shift += bits
+        # Keys have to fit int64 for the numpy backed tables
+        if shift > 63:
+            raise ValueError(f"state fields need {shift} bits, at most 63 fit a key")
+        self.bits = shift
+        self.names = tuple(name for name, _, _, _ in self._fields)
+        # Flat plan for encode(): the values in field order, their shifts and every offset packed into 1 key
+        if len(self.names) == 1:
+            name = self.names[0]
+            self._values = lambda state: (state[name],)
+        else:
+            self._values = operator.itemgetter(*self.names)
+        self._shifts = tuple(shift for _, shift, _, _ in self._fields)
+        self._offsets = sum(offset << shift for _, shift, _, offset in self._fields)
+        if check_ranges:
+            self.encode = self.encode_checked
+
+    # Hot path, values have to be python ints/bools (numpy scalars would wrap) and aren't range checked:
+    # one outside its field spills into the neighbouring fields. encode_checked/encode_many raise instead
+    def encode(self, state) -> int:
+        return self._offsets + sum(map(operator.lshift, self._values(state), self._shifts))
+
+    # encode() w/ any int-like values, the ones outside a field's range raise
+    def encode_checked(self, state) -> int:
+        key = 0
+        for name, shift, mask, offset in self._fields:
+            value = int(state[name]) + offset
+            if value & ~mask:
+                raise ValueError(_out_of_range(name, value - offset, mask, offset))
+            key |= value << shift
+        return key
+
+    # Packs many states at once, states is a structured array or field name -> array
+    def encode_many(self, states):
+        keys = np.zeros(len(states[self.names[0]]), dtype=np.int64)
+        for name, shift, mask, offset in self._fields:
+            values = states[name].astype(np.int64) + offset
+            bad = np.flatnonzero(values & ~mask)
+            if bad.size:
+                raise ValueError(_out_of_range(name, int(values[bad[0]]) - offset, mask, offset))
+            keys |= values << shift
+        return keys
+
+    def decode(self, key) -> dict:
+        key = int(key)
+        return {name: ((key >> shift) & mask) - offset for name, shift, mask, offset in self._fields}
+
+    # Decodes an int64 array of keys into field name -> int64 array
+    def decode_many(self, keys) -> dict:
+        keys = np.asarray(keys, dtype=np.int64)
+        return {name: ((keys >> shift) & mask) - offset for name, shift, mask, offset in self._fields}
+
+    # (shift, mask, offset) of 1 field, to pull it out of keys w/o decoding the rest
+    def layout(self, name):
+        for field_name, shift, mask, offset in self._fields:
+            if field_name == name:
+                return shift, mask, offset
+        raise KeyError(name)
+
+    # Keys from older pickles are sorted (field, value) tuples
+    def encode_legacy(self, key) -> int:
+        return self.encode_checked(dict(key))
+
+def _out_of_range(name, value, mask, offset):
+    return f"state field {name} = {value} is outside {-offset}..{mask - offset}, widen it in the state function's fields"
+
+_codecs = {}
+
+# One shared codec per state function, encode() range checks every state w/ config.CHECK_STATE_RANGES
+def codec_for(state_function) -> StateCodec:
+    codec = _codecs.get(state_function)
+    if codec is None:
+        codec = _codecs[state_function] = StateCodec(state_function.fields, config.CHECK_STATE_RANGES)
+    return codec
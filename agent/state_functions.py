@@ -1,17 +1,36 @@
 import math
 
+import numpy as np
+
 from statics.ram_annotations import MS_PACMAN_RAM_INFO
 from agent.q_agent import QLearningAgent
+from agent.state_codec import codec_for
+from agent.maze import load_mazes
 
 """
-State functions that generalize similar situations to same state key (tuple)
+State functions that generalize similar situations to same state key (packed int, see state_codec)
+Each state function declares `fields`: (name, bits[, offset]) for every entry of the dict it returns,
+`ram_bytes`/`prev_ram_bytes`: the only RAM addresses it reads from ram/prev_ram (see state_cache),
+and has a *_batch variant computing the same fields for (N, 128) RAM arrays w/ numpy
 """
 
+_GHOSTS_X = [MS_PACMAN_RAM_INFO[f"enemy_{ghost}_x"] for ghost in ("blinky", "pinky", "inky", "sue")]
+_GHOSTS_Y = [MS_PACMAN_RAM_INFO[f"enemy_{ghost}_y"] for ghost in ("blinky", "pinky", "inky", "sue")]
+_POSITIONS = (
+    MS_PACMAN_RAM_INFO["player_x"], MS_PACMAN_RAM_INFO["player_y"], *_GHOSTS_X, *_GHOSTS_Y,
+    MS_PACMAN_RAM_INFO["fruit_x"], MS_PACMAN_RAM_INFO["fruit_y"],
+)
+_PROGRESS = (MS_PACMAN_RAM_INFO["dots_eaten_count"], MS_PACMAN_RAM_INFO["num_lives"])
+
+# Empty structured array w/ one int16 column per field of the state function
+def state_array(state_function, n):
+    return np.zeros(n, dtype=[(field[0], np.int16) for field in state_function.fields])
+
 """State Function 1"""
 # State is identified by (player_position, dots_eaten, distance to closest ghost/fruit, if there is fruit, lives remaining)
 def coarse_manhattan_distance(ram, prev_ram, prev_action):
     r = MS_PACMAN_RAM_INFO
-    player_x, player_y = ram[r["player_x"]], ram[r["player_y"]]
+    player_x, player_y = int(ram[r["player_x"]]), int(ram[r["player_y"]])
     ghosts_coords = [
         (ram[r["enemy_blinky_x"]], ram[r["enemy_blinky_y"]]),
         (ram[r["enemy_pinky_x"]], ram[r["enemy_pinky_y"]]),
@@ -29,12 +48,12 @@ def coarse_manhattan_distance(ram, prev_ram, prev_action):
     else:
         d_fruit = 0
 
-    dots_eaten = ram[r["dots_eaten_count"]]
-    lives = ram[r["num_lives"]]
+    dots_eaten = int(ram[r["dots_eaten_count"]])
+    lives = int(ram[r["num_lives"]])
 
     return dict(
         # Round positions and dots eaten
-        prev_action = prev_action,
+        prev_action = int(prev_action),
         px=player_x // 2,
         py=player_y // 2,
         dots=(dots_eaten // 5),
@@ -44,24 +63,67 @@ def coarse_manhattan_distance(ram, prev_ram, prev_action):
         lives=lives,
     )
 
+coarse_manhattan_distance.fields = (
+    ("prev_action", 2),
+    ("px", 7),
+    ("py", 7),
+    ("dots", 6),
+    ("distance_ghost", 2),
+    ("distance_fruit", 2),
+    ("fruit", 1),
+    ("lives", 8),
+)
+coarse_manhattan_distance.ram_bytes = _POSITIONS + _PROGRESS
+coarse_manhattan_distance.prev_ram_bytes = ()
+
+# Batched coarse_manhattan_distance over (N, 128) RAM, returns a structured array w/ the same fields
+def coarse_manhattan_distance_batch(rams, prev_rams, prev_actions):
+    r = MS_PACMAN_RAM_INFO
+    rams = np.asarray(rams).astype(np.int64)
+    player_x, player_y = rams[:, r["player_x"]], rams[:, r["player_y"]]
+    ghosts_x, ghosts_y = rams[:, _GHOSTS_X], rams[:, _GHOSTS_Y]
+    closest_ghost_distance = (np.abs(player_x[:, None] - ghosts_x) + np.abs(player_y[:, None] - ghosts_y)).min(axis=1)
+
+    fruit_x, fruit_y = rams[:, r["fruit_x"]], rams[:, r["fruit_y"]]
+    fruit_flag = (fruit_x > 0) | (fruit_y > 0)
+    d_fruit = np.where(fruit_flag, np.abs(player_x - fruit_x) + np.abs(player_y - fruit_y), 0)
+
+    states = state_array(coarse_manhattan_distance, len(rams))
+    states["prev_action"] = prev_actions
+    states["px"] = player_x // 2
+    states["py"] = player_y // 2
+    states["dots"] = rams[:, r["dots_eaten_count"]] // 5
+    states["distance_ghost"] = round_distances_many(closest_ghost_distance)
+    states["distance_fruit"] = round_distances_many(d_fruit)
+    states["fruit"] = fruit_flag
+    states["lives"] = rams[:, r["num_lives"]]
+    return states
+
 def round_distances(d):
     if d <= 5: return 0
     if d <= 10: return 1
     if d <= 15: return 2
     return 3
 
+def round_distances_many(d):
+    return np.searchsorted((5, 10, 15), d, side="left")
+
 def coarse_manhattan_distance_approximation(agent: QLearningAgent, cur_state):
+    # Prebuilt index (agent.nearest_index) gives the same state w/o scanning the table
+    if agent.nearest_index is not None:
+        return agent.nearest_index.lookup(cur_state)
+    codec = codec_for(coarse_manhattan_distance)
+    cur_state = codec.decode(cur_state)
     min_distance, closest_q_vals = math.inf, None
     for state, q_vals in agent.q_by_state.items():
-        distance = coarse_manhattan_state_distance(cur_state, state)
+        distance = coarse_manhattan_state_distance(cur_state, codec.decode(state))
         if distance < min_distance:
             min_distance = distance
             closest_q_vals = q_vals
     return closest_q_vals
 
+# Takes decoded state dicts
 def coarse_manhattan_state_distance(state1, state2):
-    state1 = dict(state1)
-    state2 = dict(state2)
     diff_px, diff_py = (state1["px"] - state2["px"]), (state1["py"] - state2["py"])
     diff_ghost = (state1["distance_ghost"] - state2["distance_ghost"])
     return diff_px + diff_py + diff_ghost
@@ -131,7 +193,67 @@ def sector_distance_state(ram, prev_ram, prev_action):
         lives=int(ram[r["num_lives"]]),
         prev_action=int(prev_action),
     )
-    
+
+sector_distance_state.fields = (
+    ("px", 6),
+    ("py", 6),
+    ("vx", 2, 1),
+    ("vy", 2, 1),
+    ("heading", 2),
+    ("ghost_sector", 3),
+    ("ghost_direction", 4),
+    ("fruit_flag", 1),
+    ("fruit_sector", 3),
+    ("fruit_direction", 4),
+    ("dots", 6),
+    ("lives", 8),
+    ("prev_action", 2),
+)
+sector_distance_state.ram_bytes = _POSITIONS + (MS_PACMAN_RAM_INFO["player_direction"],) + _PROGRESS
+sector_distance_state.prev_ram_bytes = (MS_PACMAN_RAM_INFO["player_x"], MS_PACMAN_RAM_INFO["player_y"])
+
+# Batched sector_distance_state over (N, 128) RAM, returns a structured array w/ the same fields
+def sector_distance_state_batch(rams, prev_rams, prev_actions):
+    r = MS_PACMAN_RAM_INFO
+    rams = np.asarray(rams).astype(np.int64)
+    player_x, player_y = rams[:, r["player_x"]], rams[:, r["player_y"]]
+
+    # Nearest ghost, argmin keeps the first of equally close ghosts like min() does
+    dx_ghosts, dy_ghosts = rams[:, _GHOSTS_X] - player_x[:, None], rams[:, _GHOSTS_Y] - player_y[:, None]
+    d_ghosts = np.sqrt(dx_ghosts * dx_ghosts + dy_ghosts * dy_ghosts)
+    nearest = np.argmin(d_ghosts, axis=1)[:, None]
+    dxg = np.take_along_axis(dx_ghosts, nearest, axis=1)[:, 0]
+    dyg = np.take_along_axis(dy_ghosts, nearest, axis=1)[:, 0]
+    dg = np.take_along_axis(d_ghosts, nearest, axis=1)[:, 0]
+
+    fruit_x, fruit_y = rams[:, r["fruit_x"]], rams[:, r["fruit_y"]]
+    fruit_flag = (fruit_x > 0) | (fruit_y > 0)
+    dxf, dyf = fruit_x - player_x, fruit_y - player_y
+    df = np.sqrt(dxf * dxf + dyf * dyf)
+
+    if prev_rams is None:
+        vxs = vys = np.zeros(len(rams), dtype=np.int64)
+    else:
+        prev_rams = np.asarray(prev_rams).astype(np.int64)
+        vxs = np.sign(player_x - prev_rams[:, r["player_x"]])
+        vys = np.sign(player_y - prev_rams[:, r["player_y"]])
+
+    states = state_array(sector_distance_state, len(rams))
+    states["px"] = player_x // 4
+    states["py"] = player_y // 4
+    states["vx"] = vxs
+    states["vy"] = vys
+    states["heading"] = rams[:, r["player_direction"]] % 4
+    states["ghost_sector"] = round_distance_sector_many(dg)
+    states["ghost_direction"] = relative_direction_many(dxg, dyg)
+    states["fruit_flag"] = fruit_flag
+    states["fruit_sector"] = np.where(fruit_flag, round_distance_sector_many(df), 4)
+    states["fruit_direction"] = np.where(fruit_flag, relative_direction_many(dxf, dyf), 8)
+    states["dots"] = rams[:, r["dots_eaten_count"]] // 5
+    states["lives"] = rams[:, r["num_lives"]]
+    states["prev_action"] = prev_actions
+    return states
+
 # Calculates euclidean distance given distance on 2 axes
 def euclid_distance(dx, dy):
     return math.sqrt(dx*dx + dy*dy)
@@ -156,6 +278,15 @@ def relative_direction(dx, dy):
         if dx < 0 and dy < 0: return 5
         if dx > 0 and dy < 0: return 7
 
+def relative_direction_many(dx, dy):
+    abs_dx, abs_dy = np.abs(dx), np.abs(dy)
+    diagonal = np.select([(dx > 0) & (dy > 0), (dx < 0) & (dy > 0), (dx < 0) & (dy < 0)], [1, 3, 5], 7)
+    return np.select(
+        [(dx == 0) & (dy == 0), abs_dx > abs_dy, abs_dy > abs_dx],
+        [8, np.where(dx > 0, 0, 4), np.where(dy > 0, 2, 6)],
+        diagonal,
+    )
+
 # Rounds distances into buckets
 def round_distance_sector(d, edges=(8, 16, 32, 64)):
     # 0: very close, 1: close, 2: mid, 3: far, 4: very far
@@ -164,20 +295,26 @@ def round_distance_sector(d, edges=(8, 16, 32, 64)):
     if d <= 32: return 2
     if d <= 64: return 3
     return 4
+
+def round_distance_sector_many(d):
+    return np.searchsorted((8, 16, 32, 64), d, side="left")
     
 def sector_distance_state_approximation(agent: QLearningAgent, cur_state):
+    # Prebuilt index (agent.nearest_index) gives the same state w/o scanning the table
+    if agent.nearest_index is not None:
+        return agent.nearest_index.lookup(cur_state)
+    codec = codec_for(sector_distance_state)
+    cur_state = codec.decode(cur_state)
     min_distance, closest_q_vals = math.inf, None
     for state, q_vals in agent.q_by_state.items():
-        distance = sector_distance_state_distance(cur_state, state)
+        distance = sector_distance_state_distance(cur_state, codec.decode(state))
         if distance < min_distance:
             min_distance = distance
             closest_q_vals = q_vals
     return closest_q_vals
 
+# Takes decoded state dicts
 def sector_distance_state_distance(state1, state2):
-    state1 = dict(state1)
-    state2 = dict(state2)
-
     # coarse position
     diff_px = abs(int(state1["px"]) - int(state2["px"]))
     diff_py = abs(int(state1["py"]) - int(state2["py"]))
@@ -196,6 +333,24 @@ def sector_distance_state_distance(state1, state2):
     distance = diff_px + diff_py + diff_vx + diff_vy + diff_heading + diff_ghost_sector + diff_ghost_direction + diff_progress + diff_prev_act
     return float(distance)
 
+# sector_distance_state_distance from 1 decoded state to many, states2 is field -> array (StateCodec.decode_many)
+# Terms are summed in the same order so results are bit-identical to the scalar version
+def sector_distance_state_distance_many(state1, states2):
+    diff_px = np.abs(int(state1["px"]) - states2["px"])
+    diff_py = np.abs(int(state1["py"]) - states2["py"])
+    diff_vx = 0.5 * np.abs(int(state1["vx"]) - states2["vx"])
+    diff_vy = 0.5 * np.abs(int(state1["vy"]) - states2["vy"])
+    diff_heading = direction_dist_many(4, state1["heading"], states2["heading"])
+    # state1's ghost_sector against state2's ghost_direction, as in the scalar version
+    diff_ghost_sector = np.abs(int(state1["ghost_sector"]) - states2["ghost_direction"])
+    diff_ghost_direction = relative_direction_dist_many(state1["ghost_sector"], states2["ghost_direction"])
+
+    diff_progress = 0.05 * np.abs(int(state1["dots"]) - states2["dots"])
+    diff_prev_act = 0.1 * (int(state1["prev_action"]) != states2["prev_action"])
+
+    distance = diff_px + diff_py + diff_vx + diff_vy + diff_heading + diff_ghost_sector + diff_ghost_direction + diff_progress + diff_prev_act
+    return distance.astype(np.float64)
+
 def direction_dist(mod, a, b):
     a, b = int(a) % mod, int(b) % mod
     diff = abs(a - b) % mod
@@ -209,4 +364,138 @@ def relative_direction_dist(a, b):
     return direction_dist(8, a, b)
 
 def heading_dist(a, b):
-    return direction_dist(4, a, b)
\ No newline at end of file
+    return direction_dist(4, a, b)
+
+def direction_dist_many(mod, a, b):
+    diff = np.abs(int(a) % mod - b % mod) % mod
+    return np.minimum(diff, mod - diff)
+
+def relative_direction_dist_many(a, b):
+    a = int(a)
+    if a == 8:
+        return np.where(b == 8, 0, 4)
+    return np.where(b == 8, 4, direction_dist_many(8, a, b))
+
+
+"""State Function 3"""
+# Like sector_distance_state, but ghost/fruit proximity is the path length through the maze and their direction
+# the first move of that path (agent.maze tables of the current maze) instead of straight-line distance/bearing through walls
+
+def maze_distance_state(ram, prev_ram, prev_action):
+    r = MS_PACMAN_RAM_INFO
+    maze = load_mazes()[ram[r["maze"]]]
+    player_x, player_y = int(ram[r["player_x"]]), int(ram[r["player_y"]])
+    player = maze.node_at(player_x, player_y)
+    distance, first_step = maze.distance, maze.first_step
+
+    # Nearest ghost by path, first of equally close ones
+    ghost_nodes = [maze.node_at(int(ram[x]), int(ram[y])) for x, y in zip(_GHOSTS_X, _GHOSTS_Y)]
+    ghost_node = min(ghost_nodes, key=lambda node: distance.item(player, node))
+
+    fruit_x, fruit_y = int(ram[r["fruit_x"]]), int(ram[r["fruit_y"]])
+    fruit_flag = True if fruit_x > 0 or fruit_y > 0 else False
+    if fruit_flag:
+        fruit_node = maze.node_at(fruit_x, fruit_y)
+        fruit_band = round_path_distance(distance.item(player, fruit_node))
+        fruit_step = first_step.item(player, fruit_node)
+    else:
+        fruit_band, fruit_step = 4, 8
+
+    return dict(
+        px=player_x // 4, py=player_y // 4,
+        heading=int(ram[r["player_direction"]]) % 4,
+        ghost_band=round_path_distance(distance.item(player, ghost_node)), # 0..4
+        ghost_step=first_step.item(player, ghost_node), # 0..8
+        fruit_flag=fruit_flag,
+        fruit_band=fruit_band,
+        fruit_step=fruit_step,
+        dots=int(ram[r["dots_eaten_count"]]) // 5,
+        lives=int(ram[r["num_lives"]]),
+        prev_action=int(prev_action),
+    )
+
+maze_distance_state.fields = (
+    ("px", 6),
+    ("py", 6),
+    ("heading", 2),
+    ("ghost_band", 3),
+    ("ghost_step", 4),
+    ("fruit_flag", 1),
+    ("fruit_band", 3),
+    ("fruit_step", 4),
+    ("dots", 6),
+    ("lives", 8),
+    ("prev_action", 2),
+)
+maze_distance_state.ram_bytes = _POSITIONS + (MS_PACMAN_RAM_INFO["player_direction"], MS_PACMAN_RAM_INFO["maze"]) + _PROGRESS
+maze_distance_state.prev_ram_bytes = ()
+
+# Batched maze_distance_state over (N, 128) RAM, returns a structured array w/ the same fields
+def maze_distance_state_batch(rams, prev_rams, prev_actions):
+    r = MS_PACMAN_RAM_INFO
+    mazes = load_mazes()
+    rams = np.asarray(rams).astype(np.int64)
+    player_x, player_y = rams[:, r["player_x"]], rams[:, r["player_y"]]
+    fruit_x, fruit_y = rams[:, r["fruit_x"]], rams[:, r["fruit_y"]]
+    fruit_flag = (fruit_x > 0) | (fruit_y > 0)
+
+    # Path lengths/first steps to the nearest ghost and the fruit, rows of each maze w/ that maze's tables
+    ghost_distance, ghost_step = np.empty(len(rams), np.int64), np.empty(len(rams), np.int64)
+    fruit_distance, fruit_step = np.empty(len(rams), np.int64), np.empty(len(rams), np.int64)
+    maze_bytes = rams[:, r["maze"]]
+    for maze_byte in np.unique(maze_bytes):
+        maze, rows = mazes[maze_byte], maze_bytes == maze_byte
+        player = maze.node_of(player_x[rows], player_y[rows])
+        ghost_nodes = maze.node_of(rams[rows][:, _GHOSTS_X], rams[rows][:, _GHOSTS_Y])
+        ghost_distances = maze.distance[player[:, None], ghost_nodes]
+        ghost_node = np.take_along_axis(ghost_nodes, np.argmin(ghost_distances, axis=1)[:, None], axis=1)[:, 0]
+        fruit_node = maze.node_of(fruit_x[rows], fruit_y[rows])
+        ghost_distance[rows], ghost_step[rows] = maze.distance[player, ghost_node], maze.first_step[player, ghost_node]
+        fruit_distance[rows], fruit_step[rows] = maze.distance[player, fruit_node], maze.first_step[player, fruit_node]
+
+    states = state_array(maze_distance_state, len(rams))
+    states["px"] = player_x // 4
+    states["py"] = player_y // 4
+    states["heading"] = rams[:, r["player_direction"]] % 4
+    states["ghost_band"] = round_path_distance_many(ghost_distance)
+    states["ghost_step"] = ghost_step
+    states["fruit_flag"] = fruit_flag
+    states["fruit_band"] = np.where(fruit_flag, round_path_distance_many(fruit_distance), 4)
+    states["fruit_step"] = np.where(fruit_flag, fruit_step, 8)
+    states["dots"] = rams[:, r["dots_eaten_count"]] // 5
+    states["lives"] = rams[:, r["num_lives"]]
+    states["prev_action"] = prev_actions
+    return states
+
+# Buckets path lengths (in maze cells): 0: adjacent, 1: close, 2: mid, 3: far, 4: very far
+def round_path_distance(d):
+    if d <= 2: return 0
+    if d <= 4: return 1
+    if d <= 8: return 2
+    if d <= 16: return 3
+    return 4
+
+def round_path_distance_many(d):
+    return np.searchsorted((2, 4, 8, 16), d, side="left")
+
+def maze_distance_state_approximation(agent: QLearningAgent, cur_state):
+    # Prebuilt index (agent.nearest_index) gives the same state w/o scanning the table
+    if agent.nearest_index is not None:
+        return agent.nearest_index.lookup(cur_state)
+    codec = codec_for(maze_distance_state)
+    distances = maze_distance_state_distance_many(codec.decode(cur_state), codec.decode_many(agent.table.state_keys()))
+    if not len(distances):
+        return None
+    return agent.table.q[int(np.argmin(distances))]
+
+# From 1 decoded state to many, states2 is field -> array (StateCodec.decode_many)
+def maze_distance_state_distance_many(state1, states2):
+    diff_px = np.abs(int(state1["px"]) - states2["px"])
+    diff_py = np.abs(int(state1["py"]) - states2["py"])
+    diff_heading = 0.5 * direction_dist_many(4, state1["heading"], states2["heading"])
+    diff_ghost_band = np.abs(int(state1["ghost_band"]) - states2["ghost_band"])
+    diff_ghost_step = relative_direction_dist_many(state1["ghost_step"], states2["ghost_step"])
+    diff_progress = 0.05 * np.abs(int(state1["dots"]) - states2["dots"])
+    diff_prev_act = 0.1 * (int(state1["prev_action"]) != states2["prev_action"])
+    distance = diff_px + diff_py + diff_heading + diff_ghost_band + diff_ghost_step + diff_progress + diff_prev_act
+    return distance.astype(np.float64)
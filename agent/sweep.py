@@ -0,0 +1,135 @@
+import hashlib, itertools, json, os, random, time
+import multiprocessing as mp
+
+import numpy as np
+
+from agent import runner, state_functions, config
+
+"""
+Hyperparameter sweep: every combination (or `samples` random ones) of a search space x seeds becomes a
+train_loop run on a process pool, 1 run per worker at a time. Each run makes its own emulator, seeded w/ the
+run's seed (ALE only takes a seed before loading the ROM), so a worker holds 1 emulator at a time but not the same one.
+Results go to <out>/runs/<run id>.json as runs finish, the id being a hash of the run's fully resolved
+settings (swept ones + everything taken from agent.config), so a restarted sweep skips what's already there
+but reruns everything once the config changed. <out>/summary.csv aggregates the seeds of each setting.
+"""
+
+# Settings a run can vary, anything else comes from agent.config
+SEARCH_KEYS = ("policy", "state_function", "alpha", "discount", "eps_start", "eps_end", "eps_decay_steps", "ucb_strength")
+
+# Run settings (dicts incl. seed) for the space: full grid when samples is 0, else that many random picks
+def expand(space, seeds, samples=0, seed=0):
+    unknown = set(space) - set(SEARCH_KEYS)
+    if unknown:
+        raise ValueError(f"can't sweep over {sorted(unknown)}, choose from {SEARCH_KEYS}")
+    names = sorted(space)
+    if samples:
+        rng = random.Random(seed)
+        settings = [{name: rng.choice(space[name]) for name in names} for _ in range(samples)]
+    else:
+        settings = [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    runs, seen = [], set()
+    for setting in settings:
+        for run_seed in seeds:
+            run = dict(setting, seed=run_seed)
+            if run_id(run) not in seen:
+                seen.add(run_id(run))
+                runs.append(run)
+    return runs
+
+# Every train_loop argument of a run (state function by name): its swept settings over the config defaults
+def resolve(run):
+    settings = dict(
+        policy="eps_greedy", state_function="coarse_manhattan_distance",
+        alpha=config.ALPHA, discount=config.DISCOUNT, eps_start=config.EPS_START, eps_end=config.EPS_END,
+        eps_decay_steps=config.EPS_DECAY_STEPS, ucb_strength=config.UCB_STRENGTH,
+        episodes=config.EPISODES, reward_clip=config.REWARD_CLIP, max_steps=config.MAX_STEPS,
+        frame_skip=config.FRAME_SKIP, end_when_life_lost=config.END_ON_LIFE_LOSS,
+        reset_noop_max=config.RESET_NOOP_MAX, init_q=config.INIT_Q, macro_actions=config.MACRO_ACTIONS,
+    )
+    settings.update(run)
+    return settings
+
+def run_id(run):
+    return hashlib.sha1(json.dumps(resolve(run), sort_keys=True).encode()).hexdigest()[:12]
+
+# Pool worker: trains 1 setting, returns its result record (or the error)
+def _train(run):
+    settings = resolve(run)
+    start = time.perf_counter()
+    try:
+        agent, history = runner.train_loop(
+            **dict(settings, state_function=getattr(state_functions, settings["state_function"])),
+            filename=None,
+        )
+    except Exception as e:
+        return dict(id=run_id(run), run=run, error=repr(e))
+    rewards = [float(r) for r in history["reward"]]
+    return dict(
+        id=run_id(run), run=run, settings=settings,
+        rewards=rewards, steps=[int(s) for s in history["steps"]],
+        # Score = mean reward over the last quarter of training
+        score=float(np.mean(rewards[-max(1, len(rewards) // 4):])),
+        states=len(agent.q_by_state),
+        wall_seconds=time.perf_counter() - start,
+    )
+
+def _write_json(path, record):
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f)
+    os.replace(path + ".tmp", path)
+
+def run_sweep(space, seeds, out_dir, samples=0, workers=None, seed=0):
+    runs_dir = os.path.join(out_dir, "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+    runs = expand(space, seeds, samples=samples, seed=seed)
+    todo = [run for run in runs if not os.path.exists(os.path.join(runs_dir, run_id(run) + ".json"))]
+    print(f"{len(runs)} runs, {len(runs) - len(todo)} already done")
+
+    if todo:
+        workers = max(1, min(workers or mp.cpu_count(), len(todo)))
+        with mp.Pool(workers) as pool:
+            for i, result in enumerate(pool.imap_unordered(_train, todo), start=1):
+                if "error" in result:
+                    # Not written, so the next sweep retries it
+                    print(f"[{i}/{len(todo)}] {result['run']} failed: {result['error']}")
+                    continue
+                _write_json(os.path.join(runs_dir, result["id"] + ".json"), result)
+                print(f"[{i}/{len(todo)}] {result['run']} score {result['score']:.1f}")
+
+    results = []
+    for run in runs:
+        path = os.path.join(runs_dir, run_id(run) + ".json")
+        if os.path.exists(path):
+            with open(path) as f:
+                results.append(json.load(f))
+    return summarize(results, os.path.join(out_dir, "summary.csv"))
+
+# Groups results by setting (all seeds), writes them best first as csv and prints them
+def summarize(results, path):
+    groups = {}
+    for result in results:
+        setting = {k: v for k, v in result["run"].items() if k != "seed"}
+        groups.setdefault(json.dumps(setting, sort_keys=True), []).append(result)
+    rows = []
+    for setting, group in groups.items():
+        scores = [result["score"] for result in group]
+        rows.append(dict(
+            json.loads(setting), seeds=len(group), score_mean=float(np.mean(scores)), score_std=float(np.std(scores)),
+            states_mean=float(np.mean([result["states"] for result in group])),
+        ))
+    rows.sort(key=lambda row: -row["score_mean"])
+
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join(str(row.get(column, "")) for column in columns) + "\n")
+    widths = [max(len(column), *(len(_cell(row.get(column, ""))) for row in rows)) for column in columns] if rows else []
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(_cell(row.get(column, "")).ljust(width) for column, width in zip(columns, widths)))
+    return rows
+
+def _cell(value):
+    return f"{value:.3g}" if isinstance(value, float) else str(value)
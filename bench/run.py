@@ -0,0 +1,196 @@
+import argparse, json, platform, random, subprocess, time
+
+import numpy as np
+
+from agent import maze, state_functions
+from agent.nearest_state import build_nearest_index
+from agent.q_agent import QLearningAgent
+from agent.q_table import QTable
+from agent.state_codec import codec_for
+from emulator.game_env import MsPacmanALE
+
+"""
+Benchmarks for the training hot path, run from the repo root:
+    python -m bench.run --out bench_results.json
+Every component reports ops/sec and p50/p99 latency per op, results are written as JSON so runs can
+be compared across commits
+"""
+
+STATE_FUNCTIONS = (
+    state_functions.coarse_manhattan_distance, state_functions.sector_distance_state, state_functions.maze_distance_state,
+)
+
+# Calls fn(arg) for every arg, timing each call
+def measure(fn, args):
+    latencies = np.empty(len(args), dtype=np.int64)
+    clock = time.perf_counter_ns
+    start = clock()
+    for i, arg in enumerate(args):
+        t = clock()
+        fn(arg)
+        latencies[i] = clock() - t
+    total = clock() - start
+    return summarize(latencies, total, len(args))
+
+# Times a single call doing `ops` operations (batched variants)
+def measure_batch(fn, ops, repeats=5):
+    latencies = []
+    for _ in range(repeats):
+        t = time.perf_counter_ns()
+        fn()
+        latencies.append(time.perf_counter_ns() - t)
+    per_op = np.array(latencies, dtype=np.float64) / ops
+    return summarize(per_op, sum(latencies), ops * repeats)
+
+def summarize(latencies_ns, total_ns, ops):
+    return dict(
+        ops=int(ops),
+        ops_per_sec=ops / (total_ns / 1e9) if total_ns else float("inf"),
+        p50_us=float(np.percentile(latencies_ns, 50)) / 1e3,
+        p99_us=float(np.percentile(latencies_ns, 99)) / 1e3,
+    )
+
+# (ram, prev_ram, prev_action) samples from random play
+def record_samples(count, seed=0):
+    env = MsPacmanALE(seed=seed, frame_skip=1)
+    rng = random.Random(seed)
+    ram = env.reset()
+    samples, prev_ram, prev_action = [], ram.copy(), 3
+    while len(samples) < count:
+        action = rng.randrange(env.actions_count)
+        ram, _, done = env.step(action)
+        samples.append((ram.copy(), prev_ram, prev_action))
+        prev_ram, prev_action = ram.copy(), action
+        if done:
+            ram = env.reset()
+            prev_ram, prev_action = ram.copy(), 3
+    return samples
+
+# Uniformly random keys over each field's declared bit width
+def random_keys(state_function, count, rng):
+    states = {}
+    for field in state_function.fields:
+        name, bits = field[0], field[1]
+        offset = field[2] if len(field) > 2 else 0
+        states[name] = rng.integers(0, 1 << bits, count) - offset
+    return np.unique(codec_for(state_function).encode_many(states))
+
+def bench_state_functions(samples):
+    results = {}
+    rams = np.stack([ram for ram, _, _ in samples])
+    prev_rams = np.stack([prev_ram for _, prev_ram, _ in samples])
+    prev_actions = np.array([prev_action for _, _, prev_action in samples])
+    for state_function in STATE_FUNCTIONS:
+        name = state_function.__name__
+        codec = codec_for(state_function)
+        results[f"state_function/{name}"] = measure(lambda s: state_function(*s), samples)
+        batch = getattr(state_functions, name + "_batch")
+        results[f"state_function_batch/{name}"] = measure_batch(lambda: batch(rams, prev_rams, prev_actions), len(samples))
+
+        states = [state_function(*s) for s in samples]
+        results[f"encode/{name}"] = measure(codec.encode, states)
+        results[f"encode_checked/{name}"] = measure(codec.encode_checked, states)
+        results[f"encode_legacy_tuple/{name}"] = measure(lambda s: tuple(sorted(s.items())), states)
+        batch_states = batch(rams, prev_rams, prev_actions)
+        results[f"encode_many/{name}"] = measure_batch(lambda: codec.encode_many(batch_states), len(samples))
+    return results
+
+def bench_agent(samples, ops):
+    results = {}
+    codec = codec_for(state_functions.sector_distance_state)
+    keys = [codec.encode(state_functions.sector_distance_state(*s)) for s in samples]
+    keys = [keys[i % len(keys)] for i in range(ops)]
+    for policy in ("eps_greedy", "ucb"):
+        agent = QLearningAgent(4, init_q=5.0, policy=policy)
+        for key in keys:
+            agent.table.row(key)
+        results[f"select_action/{policy}"] = measure(agent.select_action, keys)
+
+    agent = QLearningAgent(4, init_q=5.0)
+    transitions = [(keys[i], i % 4, 1.0, keys[(i + 1) % len(keys)], False) for i in range(len(keys))]
+    results["update"] = measure(lambda t: agent.update(*t), transitions)
+    return results
+
+def bench_approximation(table_sizes, queries, linear_max, seed=0):
+    results = {}
+    rng = np.random.default_rng(seed)
+    for state_function in STATE_FUNCTIONS:
+        name = state_function.__name__
+        approximation = getattr(state_functions, name + "_approximation")
+        for size in table_sizes:
+            keys = random_keys(state_function, size, rng)
+            agent = QLearningAgent(4)
+            agent.table = QTable.from_arrays(
+                4, 0.0, keys, rng.random((len(keys), 4), dtype=np.float32), np.zeros((len(keys), 4), dtype=np.uint32),
+            )
+            query_keys = random_keys(state_function, queries, rng).tolist()
+            # Linear scan is O(table) per query, only timed on smaller tables
+            if size <= linear_max:
+                results[f"approximation_linear/{name}/{size}"] = measure(
+                    lambda k: approximation(agent, k), query_keys[:max(1, queries // 100)],
+                )
+            t = time.perf_counter()
+            build_nearest_index(agent, state_function)
+            build_seconds = time.perf_counter() - t
+            results[f"approximation_index/{name}/{size}"] = dict(
+                measure(lambda k: approximation(agent, k), query_keys), build_seconds=build_seconds,
+            )
+    return results
+
+def bench_emulator(frame_skips, steps, seed=0):
+    results = {}
+    rng = random.Random(seed)
+    for frame_skip in frame_skips:
+        env = MsPacmanALE(seed=seed, frame_skip=frame_skip)
+        env.reset()
+
+        def step(action):
+            _, _, done = env.step(action)
+            if done:
+                env.reset()
+        results[f"emulator_step/frame_skip={frame_skip}"] = measure(step, [rng.randrange(4) for _ in range(steps)])
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--samples", type=int, default=5000) # recorded RAM snapshots
+    parser.add_argument("--ops", type=int, default=20000) # select_action/update calls
+    parser.add_argument("--table-sizes", type=int, nargs="+", default=[10**4, 10**5, 10**6])
+    parser.add_argument("--queries", type=int, default=1000) # approximation lookups per table
+    parser.add_argument("--linear-max", type=int, default=10**5) # largest table the linear scan is timed on
+    parser.add_argument("--frame-skips", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--emulator-steps", type=int, default=5000)
+    args = parser.parse_args()
+
+    # maze_distance_state reads the cached maze tables, built here on the first run
+    maze.ensure_mazes()
+    samples = record_samples(args.samples)
+    results = {}
+    results.update(bench_state_functions(samples))
+    results.update(bench_agent(samples, args.ops))
+    results.update(bench_approximation(args.table_sizes, args.queries, args.linear_max))
+    results.update(bench_emulator(args.frame_skips, args.emulator_steps))
+
+    for name, result in results.items():
+        print(f"{name:55s} {result['ops_per_sec']:>14.0f} ops/s  p50 {result['p50_us']:>9.2f}us  p99 {result['p99_us']:>9.2f}us")
+    report = dict(
+        commit=git_commit(),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        args=vars(args),
+        results=results,
+    )
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args.out}")
+
+if __name__ == "__main__":
+    main()
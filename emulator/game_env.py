@@ -1,15 +1,29 @@
+import multiprocessing as mp
+import random
+
+import numpy as np
 from ale_py import ALEInterface, LoggerMode, roms
 from statics.ram_annotations import MS_PACMAN_RAM_INFO
+from emulator.start_pool import StartStatePool
+
+_PX, _PY, _MAZE = MS_PACMAN_RAM_INFO["player_x"], MS_PACMAN_RAM_INFO["player_y"], MS_PACMAN_RAM_INFO["maze"]
+_STALL_FRAMES = 4 # frames w/o moving that end an option step
+_GHOSTS_XY = [(MS_PACMAN_RAM_INFO[f"enemy_{ghost}_x"], MS_PACMAN_RAM_INFO[f"enemy_{ghost}_y"]) for ghost in ("blinky", "pinky", "inky", "sue")]
 
 class MsPacmanALE:
-    def __init__(self, seed=0, frame_skip=4, end_when_life_lost=False):
+    # Post-intro emulator states shared by every env in this process, keyed by (seed, mode)
+    _start_snapshots = {}
+
+    def __init__(self, seed=0, frame_skip=4, end_when_life_lost=False, fast_reset=True, reset_noop_max=0, start_pool=None,
+                 macro_actions=False, macro_ghost_cells=4, macro_max_frames=60):
         self.ale = ALEInterface()
         self.ale.setLoggerMode(LoggerMode.Error) # Stops "sending reset..." spam
         self.ale.setInt("random_seed", seed)
         self.ale.setInt("frame_skip", 1)
         self.ale.loadROM(roms.get_rom_path("ms_pacman"))
         #self.ale.loadROM("./bin/MSPACMAN.BIN")
-        self.ale.setMode(0)
+        self.mode = 0
+        self.ale.setMode(self.mode)
         self.ale.setDifficulty(0)
 
         # less options then legalactionset, better learning?
@@ -19,9 +33,54 @@ class MsPacmanALE:
         self.end_when_life_lost = end_when_life_lost
         self.lives = self.ale.lives()
 
+        # Fast reset restores the post-intro snapshot instead of replaying the intro every episode,
+        # reset_noop_max > 0 adds 0..reset_noop_max random no-op frames after it so starts still vary
+        self.seed = seed
+        self.fast_reset = fast_reset
+        self.reset_noop_max = reset_noop_max
+        self._rng = random.Random(seed)
+        # Optional emulator.start_pool.StartStatePool, collects mid-game snapshots and starts some episodes from them
+        self.start_pool = start_pool
+        self._ram = None
+
+        # Option steps (step_option): an action is held until pacman reaches a junction, is stopped by a wall,
+        # a ghost is within macro_ghost_cells along the maze or macro_max_frames frames pass
+        self.macro_actions = macro_actions
+        self.macro_ghost_cells = macro_ghost_cells
+        self.macro_max_frames = macro_max_frames
+        if macro_actions:
+            from agent.maze import load_mazes, CELL
+            self._mazes = load_mazes()
+            self._ghost_ram_distance = macro_ghost_cells * CELL
+            self._junctions = [maze.junctions().tolist() for maze in self._mazes]
+
     def reset(self):
-        self.ale.reset_game()
+        snapshot_key = (self.seed, self.mode)
+        snapshot = MsPacmanALE._start_snapshots.get(snapshot_key) if self.fast_reset else None
+        pool_start = self.start_pool.sample() if self.start_pool is not None else None
+        if pool_start is not None:
+            state, ram = pool_start
+            self.ale.restoreState(state)
+        elif snapshot is not None:
+            state, ram = snapshot
+            self.ale.restoreState(state)
+        else:
+            self._reset_and_skip_intro()
+            ram = self.read_ram()
+            if self.fast_reset:
+                # getRAM isn't refreshed by restoreState (only by act), so the snapshot keeps its RAM
+                MsPacmanALE._start_snapshots[snapshot_key] = (self.ale.cloneState(), ram.copy())
+        noops = self._rng.randint(0, self.reset_noop_max) if self.reset_noop_max > 0 else 0
+        for _ in range(noops):
+            self.ale.act(0)
+        if noops:
+            ram = self.read_ram()
         self._lives = self.ale.lives()
+        self._ram = ram.copy()
+        return ram.copy()
+
+    def _reset_and_skip_intro(self):
+        self.ale.reset_game()
         ram = self.read_ram()
         player_x, player_y = ram[MS_PACMAN_RAM_INFO["player_x"]], ram[MS_PACMAN_RAM_INFO["player_y"]]
         # Spins to avoid long waiting period at game start to affect learning
@@ -31,7 +90,6 @@ class MsPacmanALE:
             new_x, new_y = new_ram[MS_PACMAN_RAM_INFO["player_x"]], new_ram[MS_PACMAN_RAM_INFO["player_y"]]
             if (player_x != new_x or player_y != new_y):
                 break
-        return self.read_ram()
     
     # Return an independent copy of RAM
     def read_ram(self):
@@ -50,4 +108,126 @@ class MsPacmanALE:
         done = self.ale.game_over() or (self.end_when_life_lost and self.ale.lives() < self._lives)
         self._lives = self.ale.lives()
         ram = self.read_ram()
-        return ram, reward, done
\ No newline at end of file
+        if self.start_pool is not None and not done:
+            self.start_pool.observe(self.ale, self._ram, ram)
+        self._ram = ram
+        return ram, reward, done
+
+    # Repeats step(a_index) while pacman runs along a corridor, returns (ram, summed reward, done, frames)
+    # Frames are a multiple of frame_skip, so decisions still land where plain steps would
+    def step_option(self, a_index):
+        prev_ram = self._ram
+        # Tables of the maze the option starts on, a cleared level ends the episode step anyway
+        maze, junction = self._mazes[prev_ram[_MAZE]], self._junctions[prev_ram[_MAZE]]
+        start = maze.node_at(int(prev_ram[_PX]), int(prev_ram[_PY]))
+        total_reward, frames, still = 0, 0, 0
+        while True:
+            ram, reward, done = self.step(a_index)
+            total_reward += reward
+            frames += self.frame_skip
+            if done or frames >= self.macro_max_frames:
+                break
+            x, y = int(ram[_PX]), int(ram[_PY])
+            # Pacman moves every other frame, standing still longer means a wall or a frozen game (death, eaten ghost)
+            still = still + self.frame_skip if x == prev_ram[_PX] and y == prev_ram[_PY] else 0
+            if still >= _STALL_FRAMES:
+                break
+            node = maze.node_at(x, y)
+            if node != start:
+                if junction[node]:
+                    break
+                # Left the start node, running back into it (a loop, the tunnel) ends the option like any junction
+                start = -1
+            if self._ghost_near(maze, ram, node, x, y):
+                break
+            prev_ram = ram
+        return ram, total_reward, done, frames
+
+    # Ghosts in their pen map to the maze cell closest to it, the RAM distance check keeps them from counting as near
+    def _ghost_near(self, maze, ram, node, x, y):
+        cells = self.macro_ghost_cells
+        for gx, gy in _GHOSTS_XY:
+            gx, gy = int(ram[gx]), int(ram[gy])
+            if abs(gx - x) + abs(gy - y) <= self._ghost_ram_distance and maze.distance.item(node, maze.node_at(gx, gy)) <= cells:
+                return True
+        return False
+
+# Worker process loop, owns 1 emulator and answers commands sent down the pipe
+def _vector_worker(remote, seed, frame_skip, end_when_life_lost, reset_noop_max, start_pool_size, start_pool_prob):
+    start_pool = StartStatePool(start_pool_size, start_pool_prob, seed=seed) if start_pool_size > 0 else None
+    env = MsPacmanALE(
+        seed=seed, frame_skip=frame_skip, end_when_life_lost=end_when_life_lost, reset_noop_max=reset_noop_max,
+        start_pool=start_pool,
+    )
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                ram, reward, done = env.step(data)
+                # Auto reset finished games, parent gets the new episode's first RAM
+                if done:
+                    ram = env.reset()
+                remote.send((ram, reward, done))
+            elif cmd == "reset":
+                remote.send(env.reset())
+            elif cmd == "close":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+# N emulators in worker processes, stepped together w/ a batch of actions
+class VectorMsPacmanALE:
+    # start_pool_size > 0 gives every sub-env its own StartStatePool
+    def __init__(self, num_envs, seed=0, frame_skip=4, end_when_life_lost=False, reset_noop_max=0,
+                 start_pool_size=0, start_pool_prob=0.5):
+        self.num_envs = num_envs
+        self.actions_count = 4
+        self._remotes, self._processes = [], []
+        for i in range(num_envs):
+            remote, worker_remote = mp.Pipe()
+            # Each sub-env gets its own seed so rollouts differ
+            process = mp.Process(
+                target=_vector_worker,
+                args=(worker_remote, seed + i, frame_skip, end_when_life_lost, reset_noop_max, start_pool_size, start_pool_prob),
+                daemon=True,
+            )
+            process.start()
+            worker_remote.close()
+            self._remotes.append(remote)
+            self._processes.append(process)
+        self._closed = False
+
+    # Resets every sub-env, returns (N, 128) uint8 RAM
+    def reset(self):
+        for remote in self._remotes:
+            remote.send(("reset", None))
+        return np.stack([remote.recv() for remote in self._remotes]).astype(np.uint8, copy=False)
+
+    # Resets a single sub-env (e.g. hit max_steps), returns its RAM
+    def reset_at(self, index):
+        self._remotes[index].send(("reset", None))
+        return self._remotes[index].recv()
+
+    # Steps every sub-env w/ its action, done sub-envs come back already reset
+    def step(self, actions):
+        for remote, action in zip(self._remotes, actions):
+            remote.send(("step", int(action)))
+        results = [remote.recv() for remote in self._remotes]
+        rams = np.stack([ram for ram, _, _ in results]).astype(np.uint8, copy=False)
+        rewards = np.array([reward for _, reward, _ in results], dtype=np.float64)
+        dones = np.array([done for _, _, done in results], dtype=bool)
+        return rams, rewards, dones
+
+    def close(self):
+        if self._closed:
+            return
+        for remote in self._remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join()
+        self._closed = True
@@ -0,0 +1,126 @@
+import glob, os
+
+import numpy as np
+
+"""
+RAM trajectory recording: (ram, action, reward, done) streams from run_episode_ale written to compressed
+chunk files, and ReplayMsPacman which plays them back through the same reset/step interface as MsPacmanALE.
+Row layout per chunk (chunk_#####.npz):
+    rams (n, 128) uint8, actions int8, rewards float32, dones bool, resets bool
+A reset row holds an episode's first RAM (action -1, reward 0); every other row is the RAM after `action`
+"""
+
+class TrajectoryRecorder:
+    def __init__(self, directory, chunk_size=10000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        # Continue numbering after chunks already in the directory
+        self._chunk_index = len(_chunk_paths(directory))
+        self._rams = np.empty((chunk_size, 128), dtype=np.uint8)
+        self._actions = np.empty(chunk_size, dtype=np.int8)
+        self._rewards = np.empty(chunk_size, dtype=np.float32)
+        self._dones = np.empty(chunk_size, dtype=bool)
+        self._resets = np.empty(chunk_size, dtype=bool)
+        self._size = 0
+
+    def reset(self, ram):
+        self._append(ram, -1, 0.0, False, True)
+
+    def step(self, ram, action, reward, done):
+        self._append(ram, action, reward, done, False)
+
+    def _append(self, ram, action, reward, done, reset):
+        i = self._size
+        self._rams[i] = ram
+        self._actions[i] = action
+        self._rewards[i] = reward
+        self._dones[i] = done
+        self._resets[i] = reset
+        self._size += 1
+        if self._size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._size == 0:
+            return
+        n = self._size
+        path = os.path.join(self.directory, f"chunk_{self._chunk_index:05d}.npz")
+        np.savez_compressed(
+            path, rams=self._rams[:n], actions=self._actions[:n], rewards=self._rewards[:n],
+            dones=self._dones[:n], resets=self._resets[:n],
+        )
+        self._chunk_index += 1
+        self._size = 0
+
+    def close(self):
+        self.flush()
+
+def _chunk_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, "chunk_*.npz")))
+
+# Streams recorded rows, 1 chunk in memory at a time
+def _rows(directory):
+    for path in _chunk_paths(directory):
+        with np.load(path) as chunk:
+            rams, actions, rewards = chunk["rams"], chunk["actions"], chunk["rewards"]
+            dones, resets = chunk["dones"], chunk["resets"]
+        for i in range(len(rams)):
+            yield rams[i], int(actions[i]), float(rewards[i]), bool(dones[i]), bool(resets[i])
+
+# Stand-in for MsPacmanALE replaying a recording: actions passed to step are ignored, the recorded
+# one is left in `recorded_action`
+class ReplayMsPacman:
+    # Recordings hold 1 row per plain step (run_episode_ale refuses to record options)
+    macro_actions = False
+    frame_skip = 1
+
+    def __init__(self, directory, loop=False):
+        if not _chunk_paths(directory):
+            raise FileNotFoundError(f"no recorded chunks in {directory}")
+        self.directory = directory
+        self.loop = loop
+        self.actions_count = 4
+        self.recorded_action = None
+        self._rows = _rows(directory)
+        self._pending = None # reset row read ahead by step at an episode boundary
+
+    def _next_row(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            if not self.loop:
+                raise EOFError("recording exhausted")
+            self._rows = _rows(self.directory)
+            return next(self._rows)
+
+    # Skips to the next recorded episode start
+    def reset(self):
+        row, self._pending = self._pending, None
+        while row is None or not row[4]:
+            row = self._next_row()
+        self.recorded_action = None
+        return row[0]
+
+    def step(self, a_index):
+        row = self._next_row()
+        # Recording stopped mid-episode (max_steps): report done so the caller resets
+        if row[4]:
+            self._pending = row
+            return row[0], 0.0, True
+        ram, self.recorded_action, reward, done, _ = row
+        return ram, reward, done
+
+    # Whole episodes as arrays (rams, actions, rewards, dones), row 0 is the reset RAM
+    def episodes(self):
+        rams, actions, rewards, dones = [], [], [], []
+        for ram, action, reward, done, reset in _rows(self.directory):
+            if reset and rams:
+                yield np.stack(rams), np.array(actions), np.array(rewards), np.array(dones)
+                rams, actions, rewards, dones = [], [], [], []
+            rams.append(ram)
+            actions.append(action)
+            rewards.append(reward)
+            dones.append(done)
+        if rams:
+            yield np.stack(rams), np.array(actions), np.array(rewards), np.array(dones)
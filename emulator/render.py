@@ -0,0 +1,242 @@
+import os, queue, threading, time, traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+"""
+Frame output for play mode, off the agent loop: the loop copies the ALE screen straight into a slot of a preallocated
+frame ring and only the slot index is passed on, to a viewer process displaying it (FrameViewer, the ring is in shared
+memory) or a background thread encoding it (VideoRecorder).
+Frames are (210, 160, 3) uint8 RGB as returned by getScreenRGB. Both play back in emulated time: submit() takes the
+emulated frames since the last call, so frame skipping and option steps (MsPacmanALE.step_option) don't speed them up.
+"""
+
+SCREEN_SHAPE = (210, 160, 3)
+
+# Fixed set of frame buffers passed between the agent loop and a consumer thread by slot index
+class _FrameRing:
+    def __init__(self, slots):
+        self.frames = np.empty((slots, *SCREEN_SHAPE), dtype=np.uint8)
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for i in range(slots):
+            self._free.put(i)
+
+    # Fills a free slot from the emulator, blocks while every slot is in use unless block is False.
+    # The consumer gets (slot, repeats)
+    def put_screen(self, ale, repeats=1, block=True):
+        try:
+            slot = self._free.get(block=block)
+        except queue.Empty:
+            return False
+        ale.getScreenRGB(self.frames[slot])
+        self._ready.put((slot, repeats))
+        return True
+
+    # (slot index, repeats) of the next frame, None once closed
+    def get(self, timeout=None):
+        return self._ready.get(timeout=timeout)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        self._ready.put(None)
+
+# Pygame window in its own (spawned) process, so SDL runs on that process's main thread as macOS requires and a
+# crash there can't take the agent loop w/ it. Screens are copied into a ring of `slots` frames in shared memory,
+# only slot indices go through the queues. Frames are shown against fixed deadlines, fps emulated frames a second, so
+# pacing doesn't drift w/ the agent's compute time; the agent loop only waits when it gets `slots` frames ahead
+class FrameViewer:
+    def __init__(self, fps=60, slots=4, caption="Ms. Pac-Man ALE"):
+        context = mp.get_context("spawn")
+        self.fps = fps
+        self.error = None # traceback of the viewer process if it failed
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * int(np.prod(SCREEN_SHAPE)))
+        self._screens = np.ndarray((slots, *SCREEN_SHAPE), dtype=np.uint8, buffer=self._memory.buf)
+        self._ready = context.Queue() # (slot, emulated frames) to show, None to stop
+        self._free = context.Queue() # slots the viewer is done with
+        for slot in range(slots):
+            self._free.put(slot)
+        self._closed = context.Event() # window closed by the user, or the viewer failed
+        self._failed = context.Event()
+        self._errors = context.Queue()
+        self._process = context.Process(
+            target=_viewer_main,
+            args=(self._memory.name, slots, self._ready, self._free, self._closed, self._failed, self._errors, fps, caption),
+            daemon=True,
+        )
+        self._process.start()
+
+    # Set once the window is closed, the caller ends the episode
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    # frames: emulated frames since the last submit (frame_skip, or step_option's count). Raises once the viewer is
+    # gone for any reason but the user closing its window, so a dead viewer can never leave the loop waiting for a slot
+    def submit(self, ale, frames=1):
+        if self.closed:
+            self._raise_if_failed()
+            return
+        while True:
+            try:
+                slot = self._free.get(timeout=0.25)
+                break
+            except queue.Empty:
+                if self.closed:
+                    self._raise_if_failed()
+                    return
+                if not self._process.is_alive():
+                    self._closed.set()
+                    self.error = f"viewer process exited w/ code {self._process.exitcode}"
+                    self._ready.cancel_join_thread()
+                    raise RuntimeError(self.error)
+        ale.getScreenRGB(self._screens[slot])
+        self._ready.put((slot, frames))
+
+    def _raise_if_failed(self):
+        if self._failed.is_set():
+            if self.error is None:
+                self.error = self._errors.get(timeout=5)
+            # Slots the viewer never read mustn't hold up interpreter exit if the caller doesn't close()
+            self._ready.cancel_join_thread()
+            raise RuntimeError(f"frame viewer failed:\n{self.error}")
+
+    def close(self):
+        if self._memory is None:
+            return
+        self._ready.put(None)
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._ready.cancel_join_thread()
+        # The array is a view of the shared buffer, it has to go before the memory can be closed
+        self._screens = None
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+# Viewer process loop: frames until a None, window events, errors reported back before exiting
+def _viewer_main(memory_name, slots, ready, free, closed, failed, errors, fps, caption):
+    pygame = None
+    memory = shared_memory.SharedMemory(name=memory_name)
+    screens = np.ndarray((slots, *SCREEN_SHAPE), dtype=np.uint8, buffer=memory.buf)
+    try:
+        import pygame # optional, only needed to watch
+        pygame.init()
+        screen = pygame.display.set_mode(SCREEN_SHAPE[1::-1])
+        pygame.display.set_caption(caption)
+        surface = pygame.Surface(SCREEN_SHAPE[1::-1])
+        interval = 1 / fps if fps else 0
+        deadline = time.perf_counter()
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            slot, frames = item
+            if not closed.is_set():
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        closed.set()
+            # Once closed the loop only hands slots back until close() sends None
+            if closed.is_set():
+                free.put(slot)
+                continue
+            # The surface holds a copy, the slot can be refilled while this frame is on screen
+            pygame.surfarray.blit_array(surface, screens[slot].swapaxes(0, 1))
+            free.put(slot)
+            deadline += frames * interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -frames * interval:
+                # Fell behind (e.g. a slow first frame), restart the schedule instead of rushing to catch up
+                deadline = time.perf_counter()
+            screen.blit(surface, (0, 0))
+            pygame.display.flip()
+    except Exception:
+        errors.put(traceback.format_exc())
+        failed.set()
+        closed.set()
+    finally:
+        if pygame is not None:
+            pygame.quit()
+        del screens
+        memory.close()
+
+# Headless episode video at fps / every, 1 of every `every` emulated frames written from a background thread:
+#   .mp4 - encoded as frames arrive (needs imageio w/ its ffmpeg plugin)
+#   .npz - frames (n, 210, 160, 3) uint8 + fps, spooled to a raw file and compressed on close
+class VideoRecorder:
+    def __init__(self, path, fps=60, every=2, slots=16):
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in (".mp4", ".npz"):
+            raise ValueError(f"unsupported video format {extension}, use .mp4 or .npz")
+        self.path = path
+        self.every = max(1, every)
+        self.fps = fps / self.every
+        self.frames_written = 0
+        self._frame = 0
+        self._error = None
+        if extension == ".mp4":
+            import imageio.v2 as imageio # optional, only needed for .mp4
+            self._writer = imageio.get_writer(path, fps=self.fps, macro_block_size=1)
+            self._spool = None
+        else:
+            self._writer = None
+            self._spool = open(path + ".frames", "wb")
+        self._ring = _FrameRing(slots)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    # frames: emulated frames since the last submit (frame_skip, or step_option's count). The screen is written once
+    # per kept frame they cover, none if they cover no kept frame (then it isn't even read)
+    def submit(self, ale, frames=1):
+        start = self._frame
+        self._frame += frames
+        # Kept frames are the multiples of every in [start, start + frames)
+        repeats = (self._frame - 1) // self.every - (start - 1) // self.every
+        if not repeats:
+            return
+        if self._error is not None:
+            raise RuntimeError("video writer failed") from self._error
+        self._ring.put_screen(ale, repeats)
+
+    def _write_loop(self):
+        while True:
+            item = self._ring.get()
+            if item is None:
+                return
+            slot, repeats = item
+            try:
+                if self._error is None:
+                    frame = self._ring.frames[slot]
+                    for _ in range(repeats):
+                        if self._writer is not None:
+                            self._writer.append_data(frame)
+                        else:
+                            self._spool.write(frame.tobytes())
+                        self.frames_written += 1
+            except Exception as e:
+                self._error = e
+            finally:
+                self._ring.release(slot)
+
+    def close(self):
+        self._ring.close()
+        self._thread.join()
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self._spool.close()
+            spool_path = self._spool.name
+            n = self.frames_written
+            frames = np.memmap(spool_path, dtype=np.uint8, mode="r", shape=(n, *SCREEN_SHAPE)) if n else np.empty((0, *SCREEN_SHAPE), dtype=np.uint8)
+            np.savez_compressed(self.path, frames=frames, fps=self.fps)
+            del frames
+            os.remove(spool_path)
+        if self._error is not None:
+            raise RuntimeError("video writer failed") from self._error
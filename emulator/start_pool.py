@@ -0,0 +1,63 @@
+import random
+
+from statics.ram_annotations import MS_PACMAN_RAM_INFO
+
+"""
+Mid-game start states for training: MsPacmanALE clones the emulator at dot-count milestones and when a
+fruit appears, and resets start from a weighted sample of those snapshots part of the time, so emulator
+time goes to late-maze states (many dots eaten, fruit on screen) that full games rarely reach.
+Pool size is bounded, the most replayed snapshot is evicted first.
+"""
+
+_DOTS = MS_PACMAN_RAM_INFO["dots_eaten_count"]
+_FRUIT_X, _FRUIT_Y = MS_PACMAN_RAM_INFO["fruit_x"], MS_PACMAN_RAM_INFO["fruit_y"]
+
+class _Snapshot:
+    __slots__ = ("state", "ram", "dots", "uses", "order")
+
+    def __init__(self, state, ram, order):
+        self.state = state
+        self.ram = ram # getRAM isn't refreshed by restoreState, reset returns this copy
+        self.dots = int(ram[_DOTS])
+        self.uses = 0
+        self.order = order
+
+class StartStatePool:
+    def __init__(self, capacity=64, start_prob=0.5, dots_every=25, seed=0):
+        self.capacity = capacity
+        self.start_prob = start_prob # chance a reset starts from the pool instead of the maze start
+        self.dots_every = dots_every # dots eaten between milestone snapshots
+        self._rng = random.Random(seed)
+        self._snapshots = []
+        self._added = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    # Called by the env after every non-terminal step w/ the RAM before and after it
+    def observe(self, ale, prev_ram, ram):
+        milestone = ram[_DOTS] // self.dots_every > prev_ram[_DOTS] // self.dots_every
+        fruit_appeared = (ram[_FRUIT_X] > 0 or ram[_FRUIT_Y] > 0) and not (prev_ram[_FRUIT_X] > 0 or prev_ram[_FRUIT_Y] > 0)
+        if milestone or fruit_appeared:
+            self.add(ale.cloneState(), ram)
+
+    def add(self, state, ram):
+        if len(self._snapshots) >= self.capacity:
+            # Most replayed snapshot goes first, oldest among equals
+            worn = max(range(len(self._snapshots)), key=lambda i: (self._snapshots[i].uses, -self._snapshots[i].order))
+            self._snapshots[worn] = self._snapshots[-1]
+            self._snapshots.pop()
+            self.evictions += 1
+        self._snapshots.append(_Snapshot(state, ram.copy(), self._added))
+        self._added += 1
+
+    # (ALEState, ram) to start from, None when this reset should use the maze start
+    def sample(self):
+        if not self._snapshots or self._rng.random() >= self.start_prob:
+            return None
+        # Fewer replays and more dots eaten -> more likely, keeps starts spread over the pool
+        weights = [(1 + s.dots / self.dots_every) / (1 + s.uses) for s in self._snapshots]
+        snapshot = self._rng.choices(self._snapshots, weights=weights)[0]
+        snapshot.uses += 1
+        return snapshot.state, snapshot.ram
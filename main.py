@@ -1,51 +1,218 @@
 import argparse
 
-from agent import runner, state_functions, config
+from agent import runner, state_functions, config, parallel, nearest_state, sweep, evaluate, policy, maze
 from agent.q_agent import QLearningAgent
+from agent.metrics import MetricsStream
 from emulator.game_env import MsPacmanALE
+from emulator.recording import TrajectoryRecorder
+from emulator.render import VideoRecorder, FrameViewer
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--mode", choices=["training", "play"], required=True)
-parser.add_argument("--policy", choices=["eps_greedy", "ucb"])
-parser.add_argument("--state_function", choices=["coarse_manhattan_distance", "sector_distance_state"])
-parser.add_argument("--display", choices=["true", "false"])
-parser.add_argument("--file")
-args = parser.parse_args()
-
-if args.mode == "training":
-    agent, history = runner.train_loop(
-        seed=42, #ARGPATH,
-        
-        episodes=config.EPISODES,
-        reward_clip=config.REWARD_CLIP,
-        max_steps=config.MAX_STEPS,
-        policy=args.policy,
-        
-        frame_skip=config.FRAME_SKIP,
-        end_when_life_lost=config.END_ON_LIFE_LOSS,
-        
-        init_q=5.0,
-        discount=config.DISCOUNT,
-        alpha=config.ALPHA,
-        eps_start=config.EPS_START, eps_end=config.EPS_END, eps_decay_steps=config.EPS_DECAY_STEPS,
-        ucb_strength=config.UCB_STRENGTH,
-        
-        filename=args.file,
-        state_function=getattr(state_functions, args.state_function),
-    )
-    print(history["reward"])
-elif args.mode == "play":
-    agent = QLearningAgent.load(args.file)
-    env = MsPacmanALE(seed=0, frame_skip=config.FRAME_SKIP, end_when_life_lost=config.END_ON_LIFE_LOSS)
-    print(len(agent.q_by_state))
-    print(agent.state_function_name)
-    runner.run_episode_ale(
-        env=env, 
-        agent=agent, 
-        state_function=getattr(state_functions, agent.state_function_name), 
-        training=False,
-        max_steps=config.MAX_STEPS,
-        reward_clip=False,
-        render=True if args.display == "true" else False,
-        fps=60
+# Maze tables are built here, once, before any worker process (vector envs, actors, pools) needs to load them
+def prepare_mazes(state_function_names, macro_actions):
+    if macro_actions or "maze_distance_state" in state_function_names:
+        maze.ensure_mazes()
+
+# (frame_skip, macro_actions) an agent/policy was trained with, the config's for files saved before they were recorded
+def trained_env_settings(frame_skip, macro_actions):
+    return (
+        config.FRAME_SKIP if frame_skip is None else frame_skip,
+        config.MACRO_ACTIONS if macro_actions is None else macro_actions,
     )
+
+# Script body in main() so spawned worker processes (vector envs, actors, sweep/eval pools) can import this
+# module w/o parsing args or starting a run of their own
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["training", "train_parallel", "play", "convert", "sweep", "eval"], required=True)
+    parser.add_argument("--policy", choices=["eps_greedy", "ucb"])
+    parser.add_argument("--agent", choices=["table", "linear"], default="table") # training only, linear: hashed tile features
+    parser.add_argument("--learning", choices=["q", "q_lambda"], default="q") # training only, q_lambda: Watkins Q(lambda)
+    parser.add_argument("--state_function", choices=["coarse_manhattan_distance", "sector_distance_state", "maze_distance_state"])
+    parser.add_argument("--display", choices=["true", "false"])
+    parser.add_argument("--file")
+    parser.add_argument("--actors", type=int) # train_parallel only, defaults to config.NUM_ACTORS
+    parser.add_argument("--out") # convert: .qtab (memory-mapped), .qpol (compiled greedy policy) or .pkl destination, sweep: results directory, eval: JSON report
+    parser.add_argument("--workers", type=int) # sweep/eval only, defaults to 1 per core
+    parser.add_argument("--episodes", type=int) # eval only, defaults to config.EVAL_EPISODES
+    parser.add_argument("--resume", action="store_true") # training only, continue from <file>.ckpt/
+    parser.add_argument("--metrics") # JSONL file for per-episode phase timings and counters
+    parser.add_argument("--verbose", type=int, default=0) # 1: per episode, 2: per step prints
+    parser.add_argument("--record_ram") # directory to record (ram, action, reward, done) chunks into
+    parser.add_argument("--record") # play only, headless video of the episode, out.mp4 or out.npz
+    args = parser.parse_args()
+    if args.resume and args.mode != "training":
+        parser.error("--resume only applies to --mode training")
+    if args.resume and not args.file:
+        # W/o a file there's no <file>.ckpt/ to continue from, the run would silently start over
+        parser.error("--resume needs --file, the run continues from <file>.ckpt/")
+
+    if args.mode in ("training", "train_parallel"):
+        prepare_mazes([args.state_function], config.MACRO_ACTIONS)
+    elif args.mode == "sweep":
+        prepare_mazes(config.SWEEP_SPACE.get("state_function", ["coarse_manhattan_distance"]), config.MACRO_ACTIONS)
+
+    if args.mode == "training":
+        agent, history = runner.train_loop(
+            seed=42, #ARGPATH,
+
+            episodes=config.EPISODES,
+            reward_clip=config.REWARD_CLIP,
+            max_steps=config.MAX_STEPS,
+            policy=args.policy,
+
+            frame_skip=config.FRAME_SKIP,
+            end_when_life_lost=config.END_ON_LIFE_LOSS,
+            reset_noop_max=config.RESET_NOOP_MAX,
+            start_pool_size=config.START_POOL_SIZE,
+            start_pool_prob=config.START_POOL_PROB,
+            state_cache_size=config.STATE_CACHE_SIZE,
+            macro_actions=config.MACRO_ACTIONS,
+            num_envs=config.NUM_ENVS,
+            # The linear agent has no checkpoints (train_loop rejects them), only its final save
+            checkpoint_dir=args.file + ".ckpt" if args.file and args.agent == "table" else None,
+            checkpoint_every_episodes=config.CHECKPOINT_EVERY_EPISODES,
+            checkpoint_every_seconds=config.CHECKPOINT_EVERY_SECONDS,
+            resume=args.resume,
+            metrics_path=args.metrics,
+            verbose=args.verbose,
+            record_dir=args.record_ram,
+
+            init_q=5.0,
+            discount=config.DISCOUNT,
+            alpha=config.ALPHA,
+            eps_start=config.EPS_START, eps_end=config.EPS_END, eps_decay_steps=config.EPS_DECAY_STEPS,
+            ucb_strength=config.UCB_STRENGTH,
+            replay_buffer_size=int(config.REPLAY_BUFFER_SIZE),
+            replay_ratio=config.REPLAY_RATIO,
+            replay_batch_size=config.REPLAY_BATCH_SIZE,
+            trace_lambda=config.TRACE_LAMBDA if args.learning == "q_lambda" else 0.0,
+            trace_cutoff=config.TRACE_CUTOFF,
+            max_table_mb=config.MAX_TABLE_MB,
+            agent_type=args.agent,
+            linear_kwargs=dict(
+                feature_bits=config.LINEAR_FEATURE_BITS, tilings=config.LINEAR_TILINGS, tile_width=config.LINEAR_TILE_WIDTH,
+            ),
+
+            filename=args.file,
+            state_function=getattr(state_functions, args.state_function),
+        )
+        print(history["reward"])
+    elif args.mode == "train_parallel":
+        agent, history = parallel.train_parallel(
+            seed=42,
+
+            episodes=config.EPISODES,
+            reward_clip=config.REWARD_CLIP,
+            max_steps=config.MAX_STEPS,
+            policy=args.policy,
+
+            frame_skip=config.FRAME_SKIP,
+            end_when_life_lost=config.END_ON_LIFE_LOSS,
+            reset_noop_max=config.RESET_NOOP_MAX,
+            macro_actions=config.MACRO_ACTIONS,
+
+            init_q=5.0,
+            discount=config.DISCOUNT,
+            alpha=config.ALPHA,
+            eps_start=config.EPS_START, eps_end=config.EPS_END, eps_decay_steps=config.EPS_DECAY_STEPS,
+            ucb_strength=config.UCB_STRENGTH,
+            replay_buffer_size=int(config.REPLAY_BUFFER_SIZE),
+            replay_ratio=config.REPLAY_RATIO,
+            replay_batch_size=config.REPLAY_BATCH_SIZE,
+
+            filename=args.file,
+            state_function=getattr(state_functions, args.state_function),
+            actors=args.actors or config.NUM_ACTORS,
+            sync_every=config.SYNC_EVERY,
+        )
+        print(history["reward"])
+    elif args.mode == "play" and policy.is_policy(args.file):
+        # Compiled policy (convert --out x.qpol): mapped file, 1 binary search per decision
+        compiled = policy.CompiledPolicy.load(args.file)
+        print(f"{len(compiled)} states, {compiled.state_function_name}")
+        frame_skip, macro_actions = trained_env_settings(compiled.header.get("frame_skip"), compiled.header.get("macro_actions"))
+        prepare_mazes([compiled.state_function_name], macro_actions)
+        env = MsPacmanALE(
+            seed=0, frame_skip=frame_skip, end_when_life_lost=config.END_ON_LIFE_LOSS, macro_actions=macro_actions,
+        )
+        viewer = FrameViewer(60) if args.display == "true" else None
+        video = VideoRecorder(args.record, every=config.RECORD_EVERY) if args.record else None
+        reward, steps = policy.play_episode(env, compiled, max_steps=config.MAX_STEPS, viewer=viewer, video=video, verbose=1)
+        if viewer:
+            viewer.close()
+        if video:
+            video.close()
+            print(f"Wrote {video.frames_written} frames to {args.record}")
+    elif args.mode == "play":
+        agent = QLearningAgent.load(args.file)
+        frame_skip, macro_actions = trained_env_settings(agent.frame_skip, agent.macro_actions)
+        prepare_mazes([agent.state_function_name], macro_actions)
+        env = MsPacmanALE(
+            seed=0, frame_skip=frame_skip, end_when_life_lost=config.END_ON_LIFE_LOSS, macro_actions=macro_actions,
+        )
+        print(len(agent.q_by_state))
+        print(agent.state_function_name)
+        state_function = getattr(state_functions, agent.state_function_name)
+        # Unseen states look up their nearest known state through an index instead of a table scan
+        nearest_state.build_nearest_index(agent, state_function)
+        metrics = MetricsStream(args.metrics) if args.metrics else None
+        recorder = TrajectoryRecorder(args.record_ram) if args.record_ram else None
+        video = VideoRecorder(args.record, every=config.RECORD_EVERY) if args.record else None
+        runner.run_episode_ale(
+            env=env, 
+            agent=agent, 
+            state_function=state_function, 
+            training=False,
+            max_steps=config.MAX_STEPS,
+            reward_clip=False,
+            render=True if args.display == "true" else False,
+            fps=60,
+            metrics=metrics,
+            verbose=args.verbose,
+            recorder=recorder,
+            video=video,
+        )
+        if video:
+            video.close()
+            print(f"Wrote {video.frames_written} frames to {args.record}")
+        if metrics:
+            metrics.close()
+        if recorder:
+            recorder.close()
+    elif args.mode == "convert":
+        # e.g. --file q_ale.pkl --out q_ale.qtab, format picked from the --out extension
+        agent = QLearningAgent.load(args.file, mmap=False)
+        if args.out.endswith(".qpol"):
+            compiled = policy.compile_policy(agent)
+            compiled.save(args.out)
+            print(f"{len(compiled)} states, {compiled.header['known_buckets']}/{compiled.header['buckets']} buckets w/ known states")
+        else:
+            agent.save(args.out, getattr(state_functions, agent.state_function_name))
+    elif args.mode == "sweep":
+        # Rerunning w/ the same --out only trains the runs that haven't finished
+        sweep.run_sweep(
+            space=config.SWEEP_SPACE,
+            seeds=config.SWEEP_SEEDS,
+            out_dir=args.out or "sweep",
+            samples=config.SWEEP_SAMPLES,
+            workers=args.workers,
+        )
+    elif args.mode == "eval":
+        # Greedy, unrendered episodes on parallel workers sharing 1 loaded table
+        agent = QLearningAgent.load(args.file)
+        frame_skip, macro_actions = trained_env_settings(agent.frame_skip, agent.macro_actions)
+        prepare_mazes([agent.state_function_name], macro_actions)
+        report = evaluate.evaluate(
+            agent,
+            episodes=args.episodes or config.EVAL_EPISODES,
+            max_steps=config.MAX_STEPS,
+            frame_skip=frame_skip,
+            end_when_life_lost=config.END_ON_LIFE_LOSS,
+            workers=args.workers,
+            out=args.out,
+            macro_actions=macro_actions,
+        )
+        evaluate.print_report(report)
+
+if __name__ == "__main__":
+    main()
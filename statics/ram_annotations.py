@@ -1,4 +1,5 @@
 MS_PACMAN_RAM_INFO = dict(
+    maze=0, # maze layout shown, 0 for the first one
     enemy_sue_x=6,
     enemy_inky_x=7,
     enemy_pinky_x=8,
@@ -0,0 +1,4 @@
+import os, sys
+
+# Tests import the agent package from the repository root, however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
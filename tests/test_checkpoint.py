@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pytest
+
+from agent import checkpoint, state_functions
+from agent.q_agent import QLearningAgent
+
+STATE_FUNCTION = state_functions.sector_distance_state
+
+def _trained_agent(states=50, seed=0):
+    agent = QLearningAgent(4, alpha=0.5, seed=seed)
+    rng = np.random.default_rng(seed)
+    for _ in range(5 * states):
+        key = int(rng.integers(states))
+        agent.update(key, int(rng.integers(4)), float(rng.normal()), int(rng.integers(states)), False)
+    return agent
+
+def _history(episodes):
+    return {"reward": [float(i) for i in range(episodes)], "steps": [10] * episodes}
+
+def test_qtab_round_trip(tmp_path):
+    path = str(tmp_path / "agent.qtab")
+    keys = np.array([5, -3, 99, 0], dtype=np.int64)
+    q = np.arange(16, dtype=np.float32).reshape(4, 4)
+    counts = np.arange(16, dtype=np.uint32).reshape(4, 4)
+    checkpoint.write_qtab(path, dict(actions=4, note="x"), keys, q, counts)
+    assert checkpoint.is_qtab(path)
+    for mmap in (True, False):
+        header, read_keys, read_q, read_counts = checkpoint.read_qtab(path, mmap=mmap)
+        assert header["states"] == 4 and header["note"] == "x"
+        # Rows come back sorted by key
+        order = np.argsort(keys)
+        assert np.array_equal(read_keys, keys[order])
+        assert np.array_equal(read_q, q[order]) and np.array_equal(read_counts, counts[order])
+
+def test_agent_qtab_save_load(tmp_path):
+    agent = _trained_agent()
+    path = str(tmp_path / "agent.qtab")
+    agent.save(path, STATE_FUNCTION)
+    for mmap in (True, False):
+        loaded = QLearningAgent.load(path, mmap=mmap)
+        assert loaded.header(STATE_FUNCTION.__name__) == agent.header(STATE_FUNCTION.__name__)
+        for key in agent.table.state_keys():
+            assert np.array_equal(loaded.q_by_state[key], agent.q_by_state[key])
+
+def test_delta_run_and_compaction(tmp_path):
+    directory = str(tmp_path / "run")
+    agent = _trained_agent()
+    checkpointer = checkpoint.DeltaCheckpointer(directory, STATE_FUNCTION, every_episodes=2, compact_every=3)
+    for episode in range(1, 8):
+        # Later episodes touch new and old states, later records must win
+        agent.update(episode, 0, 1.0, episode + 1, False)
+        agent.update(1000 + episode, 1, 2.0, None, True)
+        checkpointer.maybe_checkpoint(agent, _history(episode))
+    checkpointer.close(agent, _history(7))
+
+    # close compacts, the log is empty and the base holds everything
+    assert os.path.getsize(os.path.join(directory, checkpoint.DELTA_FILE)) == 0
+    header, history, keys, q, counts = checkpoint.read_run(directory)
+    assert history == _history(7)
+    assert header["total_steps"] == agent.total_steps
+    table_keys, table_q, table_counts = agent.table.arrays()
+    order = np.argsort(table_keys)
+    assert np.array_equal(keys, table_keys[order])
+    assert np.array_equal(q, table_q[order]) and np.array_equal(counts, table_counts[order])
+
+    restored, restored_history = checkpoint.restore(directory)
+    assert restored_history == _history(7)
+    assert np.array_equal(restored.q_by_state[1001], agent.q_by_state[1001])
+
+def test_first_checkpoint_on_schedule(tmp_path):
+    agent = _trained_agent()
+    checkpointer = checkpoint.DeltaCheckpointer(str(tmp_path / "run"), STATE_FUNCTION, every_episodes=5)
+    taken, write = [], checkpointer.checkpoint
+    def checkpoint_spy(agent, history):
+        taken.append(len(history["reward"]))
+        write(agent, history)
+    checkpointer.checkpoint = checkpoint_spy
+    for episode in range(1, 12):
+        checkpointer.maybe_checkpoint(agent, _history(episode))
+    assert taken == [5, 10]
+    checkpointer.close(agent, _history(11))
+
+def test_truncated_record_is_ignored(tmp_path):
+    directory = str(tmp_path / "run")
+    agent = _trained_agent()
+    checkpointer = checkpoint.DeltaCheckpointer(directory, STATE_FUNCTION, compact_every=100)
+    checkpointer.checkpoint(agent, _history(1))
+    agent.update(5000, 2, 3.0, None, True)
+    checkpointer.checkpoint(agent, _history(2))
+    checkpointer._jobs.put(None)
+    checkpointer._writer.join()
+    delta_path = os.path.join(directory, checkpoint.DELTA_FILE)
+    with open(delta_path, "rb+") as f:
+        f.truncate(os.path.getsize(delta_path) - 10)
+    # A crash mid-write loses the last record only
+    _, history, keys, _, _ = checkpoint.read_run(directory)
+    assert history == _history(1)
+    assert 5000 not in keys
+
+def test_new_run_refuses_existing_checkpoint(tmp_path):
+    directory = str(tmp_path / "run")
+    agent = _trained_agent()
+    checkpoint.DeltaCheckpointer(directory, STATE_FUNCTION).close(agent, _history(1))
+    with pytest.raises(FileExistsError):
+        checkpoint.DeltaCheckpointer(directory, STATE_FUNCTION)
+    checkpoint.DeltaCheckpointer(directory, STATE_FUNCTION, resume=True).close(agent, _history(2))
+
+def test_check_resume():
+    agent = QLearningAgent(4, alpha=0.1)
+    saved = agent.header("sector_distance_state")
+    checkpoint.check_resume(saved, dict(saved, total_steps=123))
+    with pytest.raises(ValueError, match="alpha"):
+        checkpoint.check_resume(saved, QLearningAgent(4, alpha=0.2).header("sector_distance_state"))
+    with pytest.raises(ValueError, match="state_function_name"):
+        checkpoint.check_resume(saved, agent.header("maze_distance_state"))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from agent import state_functions
+from agent.linear_agent import LinearQAgent
+from agent.q_agent import QLearningAgent
+from agent.state_codec import codec_for
+
+STATE_FUNCTION = state_functions.sector_distance_state
+
+def _agent(**kwargs):
+    return LinearQAgent(4, STATE_FUNCTION.__name__, **dict(dict(feature_bits=12, init_q=2.0, alpha=0.5, seed=0), **kwargs))
+
+def _key(**fields):
+    codec = codec_for(STATE_FUNCTION)
+    return codec.encode({name: fields.get(name, 0) for name in codec.names})
+
+def test_unseen_states_start_at_init_q():
+    agent = _agent()
+    assert agent.q_values(_key(px=5, py=9)) == pytest.approx([2.0] * 4, rel=1e-5)
+
+def test_update_moves_q_by_alpha_towards_the_target():
+    agent = _agent()
+    key = _key(px=5, py=9, dots=3)
+    agent.update(key, 1, 10.0, None, True)
+    assert agent.q_values(key).tolist() == pytest.approx([2.0, 6.0, 2.0, 2.0], rel=1e-5)
+    # States sharing features w/ it move too, the weights are the only storage
+    assert agent.q_values(_key(px=5, py=9, dots=4))[1] > 2.0
+    assert agent.weights.shape == (2**12, 4) and len(agent) == len(agent.features(key))
+
+def test_memory_stays_fixed():
+    agent = _agent()
+    nbytes = agent.weights.nbytes
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        agent.update(_key(px=int(rng.integers(64)), py=int(rng.integers(64))), 0, 1.0, _key(px=1), False)
+    assert agent.weights.nbytes == nbytes
+
+def test_save_load_round_trip(tmp_path):
+    agent = _agent()
+    agent.update(_key(px=1), 2, 1.0, _key(px=2), False)
+    path = str(tmp_path / "linear.pkl")
+    agent.save(path, STATE_FUNCTION)
+    loaded = QLearningAgent.load(path)
+    assert isinstance(loaded, LinearQAgent) and loaded.total_steps == 1
+    assert np.array_equal(loaded.weights, agent.weights)
+    assert np.array_equal(loaded.q_by_state[_key(px=1)], agent.q_by_state[_key(px=1)])
+    with pytest.raises(ValueError, match="qtab"):
+        agent.save(str(tmp_path / "linear.qtab"), STATE_FUNCTION)
+
+def test_unsupported_options():
+    with pytest.raises(ValueError, match="ucb"):
+        _agent(policy="ucb")
+    with pytest.raises(ValueError):
+        _agent(trace_lambda=0.5)
+    with pytest.raises(TypeError, match="visit counts"):
+        _agent().count_by_state
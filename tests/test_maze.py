@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from agent import maze, state_functions
+from statics.ram_annotations import MS_PACMAN_RAM_INFO
+
+R = MS_PACMAN_RAM_INFO
+
+def _corridor(cells):
+    edges = set()
+    for a, b in zip(cells[:-1], cells[1:]):
+        edges.update(((a, b), (b, a)))
+    return edges
+
+# An L: (0, 0) -> (5, 0) -> (5, 5)
+L_CELLS = [(x, 0) for x in range(6)] + [(5, y) for y in range(1, 6)]
+# A straight corridor along y = 2 w/ a side branch at x = 3
+T_EDGES = _corridor([(x, 2) for x in range(8)]) | _corridor([(3, 2), (3, 3), (3, 4)])
+
+def test_path_distance_and_first_step():
+    tables = maze.MazeDistances.from_edges(_corridor(L_CELLS))
+    c = maze.CELL
+    assert tables.path_distance(0, 0, 5 * c, 5 * c) == 10
+    # First move from (0, 0) towards the corner's far end is right, from the far end it's up
+    assert tables.direction(0, 0, 5 * c, 5 * c) == 0
+    assert tables.direction(5 * c, 5 * c, 0, 0) == 6
+    assert tables.direction(0, 0, 0, 0) == 8
+    # Cells off the corridor resolve to the closest walkable one
+    assert tables.node_at(0, 3 * c) == tables.node_at(0, 0)
+
+def test_tunnel_wraps():
+    edges = _corridor([(x, 0) for x in range(3)]) | _corridor([(x, 0) for x in range(61, 64)])
+    edges |= {((0, 0), (63, 0)), ((63, 0), (0, 0))}
+    tables = maze.MazeDistances.from_edges(edges)
+    c = maze.CELL
+    assert tables.path_distance(c, 0, 62 * c, 0) == 3
+    # Through the tunnel from the left side is a move left
+    assert tables.direction(0, 0, 63 * c, 0) == 4
+
+def test_junctions():
+    tables = maze.MazeDistances.from_edges(T_EDGES)
+    c = maze.CELL
+    assert tables.junctions().tolist().count(True) == 1
+    assert tables.junctions()[tables.node_at(3 * c, 2 * c)]
+
+def test_edges_are_kept_per_maze():
+    rams = np.zeros((6, 128), dtype=np.uint8)
+    rams[:, R["player_x"]] = [0, 4, 8, 8, 12, 16]
+    rams[:, R["maze"]] = [0, 0, 0, 1, 1, 1]
+    edges = maze.maze_edges([rams])
+    # The step from maze 0 to maze 1 links nothing
+    assert edges[0] == _corridor([(0, 0), (1, 0), (2, 0)])
+    assert edges[1] == _corridor([(2, 0), (3, 0), (4, 0)])
+
+def _mazes():
+    return tuple(maze.MazeDistances.from_edges(_corridor(L_CELLS) if k % 2 else T_EDGES) for k in range(maze.MAZES))
+
+def test_save_read_round_trip(tmp_path):
+    path = str(tmp_path / "mazes.npz")
+    mazes = _mazes()
+    maze.save_mazes(path, mazes)
+    for saved, read in zip(mazes, maze.read_mazes(path)):
+        assert np.array_equal(saved.node, read.node) and np.array_equal(saved.distance, read.distance)
+        assert np.array_equal(saved.first_step, read.first_step)
+
+def test_single_maze_files_are_rejected(tmp_path):
+    path = str(tmp_path / "old.npz")
+    tables = maze.MazeDistances.from_edges(T_EDGES)
+    np.savez(path, node=tables.node, distance=tables.distance, first_step=tables.first_step)
+    with pytest.raises(ValueError, match="rebuild"):
+        maze.read_mazes(path)
+
+def test_state_function_uses_the_current_mazes_tables(monkeypatch):
+    mazes = _mazes()
+    monkeypatch.setitem(maze._loaded, maze.DEFAULT_PATH, mazes)
+    c = maze.CELL
+    rams = np.zeros((2, 128), dtype=np.uint8)
+    rams[:, R["player_x"]], rams[:, R["player_y"]] = 0, 0
+    for x, y in zip(state_functions._GHOSTS_X, state_functions._GHOSTS_Y):
+        rams[:, x], rams[:, y] = 5 * c, 5 * c
+    rams[:, R["maze"]] = [1, 2]
+    states = [state_functions.maze_distance_state(ram, ram, 0) for ram in rams]
+    # Maze 1 is the L: the ghost is 10 cells away along it. Maze 2 is the T: the ghost resolves to the
+    # branch's end (3, 4), 5 cells from the player's closest cell (0, 2)
+    assert (states[0]["ghost_band"], states[0]["ghost_step"]) == (3, 0)
+    assert (states[1]["ghost_band"], states[1]["ghost_step"]) == (2, 0)
+    batch = state_functions.maze_distance_state_batch(rams, rams, np.zeros(2, dtype=np.int64))
+    assert [{name: int(batch[name][i]) for name in batch.dtype.names} for i in range(2)] == states
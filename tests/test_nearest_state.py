@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from agent import state_functions
+from agent.nearest_state import build_nearest_index
+from agent.q_agent import QLearningAgent
+from agent.q_table import QTable
+from agent.state_codec import codec_for
+
+STATE_FUNCTIONS = (
+    state_functions.coarse_manhattan_distance, state_functions.sector_distance_state, state_functions.maze_distance_state,
+)
+
+# Random states w/ every field in its range, px/py capped so cells hold several states and distances tie
+def _random_keys(state_function, count, rng, max_position=64):
+    codec = codec_for(state_function)
+    states = {}
+    for name in codec.names:
+        _, mask, offset = codec.layout(name)
+        high = min(mask, max_position - 1) if name in ("px", "py") else mask
+        states[name] = rng.integers(0, high + 1, count) - offset
+    return codec.encode_many(states)
+
+def _agent(state_function, states, rng, max_position):
+    keys = np.unique(_random_keys(state_function, states, rng, max_position))
+    rng.shuffle(keys)
+    agent = QLearningAgent(4)
+    agent.table = QTable.from_arrays(
+        4, 0.0, keys, rng.random((len(keys), 4), dtype=np.float32), np.zeros((len(keys), 4), dtype=np.uint32),
+    )
+    return agent
+
+@pytest.mark.parametrize("state_function", STATE_FUNCTIONS, ids=lambda f: f.__name__)
+@pytest.mark.parametrize("max_position", [8, 64])
+def test_index_finds_the_scans_neighbour(state_function, max_position):
+    rng = np.random.default_rng(0)
+    agent = _agent(state_function, 400, rng, max_position)
+    approximation = getattr(state_functions, state_function.__name__ + "_approximation")
+    queries = _random_keys(state_function, 40, rng, max_position).tolist()
+    # Without an index the approximation scans the table
+    scanned = [approximation(agent, key) for key in queries]
+    build_nearest_index(agent, state_function)
+    for key, q in zip(queries, scanned):
+        # Random q-values, equal rows means the same state (and ties went to the same one)
+        assert np.array_equal(approximation(agent, key), q)
+        assert np.array_equal(approximation(agent, key), q) # cached miss
+
+def test_empty_table():
+    agent = QLearningAgent(4)
+    for state_function in STATE_FUNCTIONS:
+        build_nearest_index(agent, state_function)
+        assert agent.nearest_index.lookup(0) is None
+
+def test_sector_ties_go_to_the_earliest_row_in_any_ring():
+    codec = codec_for(state_functions.sector_distance_state)
+    state = {name: 0 for name in codec.names}
+    query = codec.encode(dict(state, px=10, py=10))
+    # Both 2 away: the earlier row 2 cells off, the later one in the query's own cell w/ 40 more dots
+    keys = np.array([codec.encode(dict(state, px=12, py=10)), codec.encode(dict(state, px=10, py=10, dots=40))])
+    agent = QLearningAgent(4)
+    agent.table = QTable.from_arrays(4, 0.0, keys, np.eye(2, 4, dtype=np.float32), np.zeros((2, 4), dtype=np.uint32))
+    assert state_functions.sector_distance_state_approximation(agent, query).tolist() == [1, 0, 0, 0]
+    build_nearest_index(agent, state_functions.sector_distance_state)
+    assert agent.nearest_index.nearest_row(query) == 0
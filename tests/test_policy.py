@@ -0,0 +1,54 @@
+import numpy as np
+
+from agent import policy, state_functions
+from agent.q_agent import QLearningAgent
+from agent.state_codec import codec_for
+
+STATE_FUNCTION = state_functions.sector_distance_state
+
+def _key(codec, **fields):
+    return codec.encode({name: fields.get(name, 0) for name in codec.names})
+
+def _agent():
+    codec = codec_for(STATE_FUNCTION)
+    agent = QLearningAgent(4, seed=0)
+    agent.state_function_name = STATE_FUNCTION.__name__
+    rng = np.random.default_rng(0)
+    for px in range(0, 40, 3):
+        for py in range(0, 40, 5):
+            for lives in range(3):
+                row = agent.table.row(_key(codec, px=px, py=py, lives=lives))
+                agent.table.q[row] = rng.normal(size=4)
+                agent.table.counts[row] = rng.integers(0, 10, 4)
+    return agent, codec
+
+def test_compiled_actions_match_greedy(tmp_path):
+    agent, _ = _agent()
+    path = str(tmp_path / "agent.qpol")
+    policy.compile_policy(agent).save(path)
+    assert policy.is_policy(path)
+    compiled = policy.CompiledPolicy.load(path)
+    keys, q, _ = agent.table.arrays()
+    assert len(compiled) == len(keys)
+    assert [compiled.action(int(key)) for key in keys] == np.argmax(q, axis=1).tolist()
+    assert compiled.fallbacks == 0
+
+def test_unseen_states_take_their_bucket_action(tmp_path):
+    agent, codec = _agent()
+    path = str(tmp_path / "agent.qpol")
+    policy.compile_policy(agent).save(path)
+    compiled = policy.CompiledPolicy.load(path)
+    # Known (px, py) cell, unseen other fields: the cell's vote
+    action = compiled.action(_key(codec, px=3, py=5, lives=7))
+    assert compiled.fallbacks == 1
+    assert action in [compiled.action(_key(codec, px=3, py=5, lives=lives)) for lives in range(3)]
+    # Cells w/o known states take the action of the closest known cell
+    assert compiled.action(_key(codec, px=63, py=63)) == compiled.action(_key(codec, px=39, py=35, lives=7))
+    assert compiled.header["known_buckets"] == 14 * 8
+
+def test_pack_round_trip():
+    actions = np.random.default_rng(1).integers(0, 4, 1001)
+    packed = policy._pack(actions)
+    assert len(packed) == 251
+    assert np.array_equal(policy._unpack_many(packed, 1001), actions)
+    assert [policy._unpack(packed, i) for i in range(1001)] == actions.tolist()
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from agent.q_agent import QLearningAgent
+from agent.q_table import QTable, SpillStore, states_for_budget
+
+def test_insert_find_and_growth():
+    rng = np.random.default_rng(0)
+    keys = np.unique(rng.integers(-2**62, 2**62, 5000))
+    table = QTable(4, init_q=1.5, capacity=16)
+    rows = [table.row(key) for key in keys]
+    # Values written before the table grows must survive every doubling
+    for row, key in zip(rows, keys):
+        table.q[row, key % 4] = float(key % 97)
+    assert len(table) == len(keys)
+    assert all(table.find(key) == row for key, row in zip(keys, rows))
+    assert np.array_equal(table.find_many(keys), rows)
+    assert all(table.q[table.find(key), key % 4] == key % 97 for key in keys)
+    # Untouched actions keep init_q
+    assert table.q[rows[0], (keys[0] + 1) % 4] == 1.5
+
+def test_unseen_keys():
+    table = QTable(4)
+    table.row(7)
+    assert table.find(8) == -1
+    assert 8 not in table and 7 in table
+    assert np.array_equal(table.find_many([7, 8, -7]), [0, -1, -1])
+
+def test_colliding_keys_probe():
+    # Multiples of 2^40 all hash to slot 0 while the index has < 256 slots, every insert/find probes
+    table = QTable(4, capacity=16)
+    keys = [i << 40 for i in range(200)]
+    rows = [table.row(key) for key in keys]
+    assert rows == list(range(200))
+    assert [table.find(key) for key in keys] == rows
+
+def test_from_arrays_round_trip():
+    table = QTable(4)
+    for key in range(100):
+        table.q[table.row(key * 3)] = key
+        table.counts[table.row(key * 3)] = key % 5
+    keys, q, counts = table.arrays()
+    copy = QTable.from_arrays(4, 0.0, keys, q, counts)
+    assert np.array_equal(copy.find_many(keys), np.arange(len(keys)))
+    assert np.array_equal(copy.q[:len(keys)], q)
+    assert np.array_equal(copy.counts[:len(keys)], counts)
+
+def _budget_table(max_states=100, min_visits=2):
+    spill = SpillStore(4, max_states, min_visits=min_visits)
+    return QTable(4, max_states=max_states, spill=spill)
+
+def test_evict_drops_least_visited_and_remaps():
+    table = _budget_table()
+    for key in range(100):
+        row = table.row(key)
+        table.counts[row, 0] = key # key = visits
+        table.q[row] = key
+    assert table.over_budget()
+    remap = table.evict(0.1)
+    assert len(table) == 90 and table.evictions == 10
+    # The 10 least visited are gone, the rest kept their values under their new rows
+    assert all(table.find(key) == -1 for key in range(10))
+    for key in range(10, 100):
+        assert table.q[table.find(key), 0] == key
+    assert np.array_equal(remap[:10], np.full(10, -1))
+    assert np.array_equal(remap[10:], np.arange(90))
+
+def test_evict_ties_go_least_recently_used_first():
+    table = _budget_table(max_states=10)
+    for key in range(10):
+        table.row(key)
+    # Same visits everywhere, key 0 is touched last so it's the most recently used
+    table.row(0)
+    table.evict(0.1)
+    assert 0 in table and 1 not in table
+
+def test_spilled_rows_come_back():
+    table = _budget_table()
+    for key in range(100):
+        row = table.row(key)
+        table.counts[row, 1] = 1 if key < 5 else 3
+        table.q[row, 1] = key + 0.5
+    table.evict(0.1)
+    spill = table.spill
+    # Visited once is below min_visits: dropped. The other evicted ones are kept at float16
+    assert len(spill) == 5 and spill.dropped == 5
+    row = table.row(7)
+    assert table.q[row, 1] == np.float16(7.5) and table.counts[row, 1] == 3
+    row = table.row(2)
+    assert table.q[row, 1] == 0.0 and table.counts[row, 1] == 0
+
+def test_evicted_dirty_rows_reach_take_dirty():
+    table = _budget_table()
+    for key in range(100):
+        row = table.row(key)
+        table.counts[row, 0] = key
+        table.dirty[row] = key < 3 or key == 50
+    table.evict(0.1)
+    keys, q, counts = table.take_dirty()
+    assert sorted(keys.tolist()) == [0, 1, 2, 50]
+    assert len(table.take_dirty()[0]) == 0
+
+def test_states_for_budget():
+    assert states_for_budget(4, 2**20) > 4000
+    assert states_for_budget(4, 1) == 1
+
+@pytest.mark.parametrize("max_table_mb", [0.05, 0.5])
+def test_budgeted_agent_stays_within_budget(max_table_mb):
+    agent = QLearningAgent(4, max_table_mb=max_table_mb, spill_min_visits=1, seed=0)
+    states = agent.table.max_states
+    rng = np.random.default_rng(0)
+    for i in range(20 * states):
+        agent.update(int(rng.integers(1 << 40)), i % 4, 1.0, int(rng.integers(1 << 40)), False)
+        if i % 50 == 0:
+            assert agent.table.nbytes() <= max_table_mb * 2**20
+    # Every evicted row spills, the store is full
+    assert len(agent.table.spill) == states
+    assert agent.table.nbytes() <= max_table_mb * 2**20
+
+def test_entries_are_written_back():
+    table = QTable(4, init_q=2.0)
+    table.row(1)
+    table.take_dirty()
+    q, counts, row = table.entry(1)
+    q[3] += 1.0
+    counts[3] += 1
+    new_q, _, new_row = table.entry(9)
+    assert new_q == [2.0] * 4
+    # The arrays see hot rows once read, the changed ones are dirty
+    assert table.q[row].tolist() == [2.0, 2.0, 2.0, 3.0] and table.counts[row, 3] == 1
+    assert table.q[new_row].tolist() == [2.0] * 4 and not table.hot
+    assert table.dirty[row] and table.dirty[new_row]
+    # Batch lookups see states only entry() inserted
+    assert np.array_equal(table.find_many([1, 9, 5]), [row, new_row, -1])
+
+def test_hot_rows_are_synced_at_the_limit():
+    table = QTable(4, max_states=64, spill=SpillStore(4, 64))
+    for key in range(20):
+        table.entry(key)[1][0] += 1
+    # 16 hot rows at most for 64 states, the 17th entry wrote them back
+    assert len(table.hot) == 4
+    assert table._counts[:16, 0].tolist() == [1] * 16
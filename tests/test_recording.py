@@ -0,0 +1,47 @@
+import numpy as np
+
+from agent import state_functions
+from agent.q_agent import QLearningAgent
+from agent.runner import run_episode_ale
+from emulator.recording import ReplayMsPacman, TrajectoryRecorder
+from statics.ram_annotations import MS_PACMAN_RAM_INFO
+
+def _ram(x):
+    ram = np.zeros(128, dtype=np.uint8)
+    ram[MS_PACMAN_RAM_INFO["player_x"]] = x
+    ram[MS_PACMAN_RAM_INFO["player_y"]] = 50
+    ram[MS_PACMAN_RAM_INFO["num_lives"]] = 2
+    return ram
+
+def _record(directory, episodes):
+    recorder = TrajectoryRecorder(directory, chunk_size=7)
+    for length in episodes:
+        recorder.reset(_ram(0))
+        for t in range(1, length + 1):
+            recorder.step(_ram(t), t % 4, 10.0, t == length)
+    recorder.close()
+
+def test_replayed_episodes_run_through_the_runner(tmp_path):
+    directory = str(tmp_path / "rec")
+    _record(directory, [5, 12])
+    env = ReplayMsPacman(directory)
+    agent = QLearningAgent(4, seed=0)
+    for length in (5, 12):
+        total_reward, steps = run_episode_ale(env, agent, state_functions.coarse_manhattan_distance)
+        assert (total_reward, steps) == (10.0 * length, length)
+        assert env.recorded_action == length % 4
+    # 1 update per recorded step, w/ a plain step's discount
+    assert agent.total_steps == 17
+
+def test_unfinished_episode_ends_at_the_next_reset(tmp_path):
+    directory = str(tmp_path / "rec")
+    recorder = TrajectoryRecorder(directory)
+    recorder.reset(_ram(0))
+    recorder.step(_ram(1), 0, 1.0, False)
+    recorder.close()
+    _record(directory, [3])
+    env = ReplayMsPacman(directory)
+    agent = QLearningAgent(4, seed=0)
+    # Cut by max_steps while recording: the replay reports done when the next episode starts
+    assert run_episode_ale(env, agent, state_functions.coarse_manhattan_distance) == (1.0, 2)
+    assert run_episode_ale(env, agent, state_functions.coarse_manhattan_distance) == (30.0, 3)
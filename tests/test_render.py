@@ -0,0 +1,47 @@
+import importlib.util
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from emulator.render import FrameViewer, VideoRecorder
+
+# Stands in for the ALE, each screen read is filled w/ the number of reads so far
+class _Screens:
+    def __init__(self):
+        self.reads = 0
+
+    def getScreenRGB(self, out):
+        self.reads += 1
+        out.fill(self.reads)
+
+def test_video_runs_in_emulated_time(tmp_path):
+    path = str(tmp_path / "episode.npz")
+    screens = _Screens()
+    video = VideoRecorder(path, every=2)
+    # Plain steps w/ frame_skip 4, then option steps of 6 and 1 frames
+    for frames in (4, 4, 6, 1, 1, 1):
+        video.submit(screens, frames)
+    video.close()
+    saved = np.load(path)
+    assert float(saved["fps"]) == 30
+    # 17 emulated frames keep 9 (0, 2, .., 16): each screen fills the kept frames its step covered,
+    # the 5th step (frame 15) covered none and wasn't read
+    assert saved["frames"][:, 0, 0, 0].tolist() == [1, 1, 2, 2, 3, 3, 3, 4, 5]
+    assert screens.reads == 5 and video.frames_written == 9
+
+@pytest.mark.skipif(importlib.util.find_spec("pygame") is not None, reason="needs the viewer to fail w/o pygame")
+def test_viewer_failure_is_raised_and_memory_released():
+    viewer = FrameViewer(fps=0, slots=2)
+    name = viewer._memory.name
+    screens = _Screens()
+    try:
+        # W/o pygame the viewer process fails, the loop finds out at the latest once the slots run out
+        with pytest.raises(RuntimeError):
+            for _ in range(100):
+                viewer.submit(screens, 4)
+        assert viewer.closed
+    finally:
+        viewer.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,53 @@
+import numpy as np
+
+from agent.q_agent import QLearningAgent
+from agent.replay import ReplayBuffer
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = ReplayBuffer(3)
+    for i in range(5):
+        buffer.add(i, i % 4, float(i), i + 1, False, steps=i + 1)
+    assert len(buffer) == 3
+    # Slots 0, 1 were overwritten by transitions 3, 4
+    assert buffer.state_keys.tolist() == [3, 4, 2]
+    assert buffer.steps.tolist() == [4, 5, 3]
+
+def test_terminal_result_state():
+    buffer = ReplayBuffer(2)
+    buffer.add(7, 1, 1.0, None, True)
+    assert buffer.result_state_keys[0] == 7 and buffer.terminals[0]
+
+def test_sample():
+    buffer = ReplayBuffer(100, seed=3)
+    for i in range(10):
+        buffer.add(i, i % 4, float(i), i + 1, i == 9)
+    state_keys, actions, rewards, result_state_keys, terminals, steps = buffer.sample(64)
+    assert len(state_keys) == 64
+    # Only filled slots are drawn, and columns stay aligned
+    assert state_keys.max() < 10
+    assert np.array_equal(actions, state_keys % 4)
+    assert np.array_equal(rewards, state_keys.astype(np.float32))
+    assert np.array_equal(result_state_keys, state_keys + 1)
+    assert np.array_equal(terminals, state_keys == 9)
+
+def test_replay_step_averages_duplicates():
+    agent = QLearningAgent(4, alpha=0.5, replay_buffer_size=16, replay_batch_size=8)
+    row = agent.table.row(7)
+    for _ in range(4):
+        agent.replay.add(7, 1, 10.0, None, True)
+    agent.replay_step()
+    # 8 draws of the same pair move it by alpha * delta once, not 8 times
+    assert agent.table.q[row].tolist() == [0.0, 5.0, 0.0, 0.0]
+
+def test_replay_step_discounts_option_steps():
+    agent = QLearningAgent(4, alpha=1.0, discount=0.5, replay_buffer_size=4, replay_batch_size=1)
+    agent.table.q[agent.table.row(2)] = 8.0
+    row = agent.table.row(1)
+    agent.replay.add(1, 0, 0.0, 2, False, steps=3)
+    agent.replay_step()
+    assert agent.table.q[row, 0] == 0.5 ** 3 * 8.0
+
+def test_replay_settings_saved():
+    agent = QLearningAgent(4, replay_buffer_size=100, replay_ratio=2.0, replay_batch_size=8)
+    loaded = QLearningAgent.from_header(agent.header("sector_distance_state"))
+    assert (loaded.replay.capacity, loaded.replay_ratio, loaded.replay_batch_size) == (100, 2.0, 8)
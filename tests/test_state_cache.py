@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from agent import state_functions
+from agent.state_cache import StateKeyCache
+from agent.state_codec import codec_for
+
+STATE_FUNCTIONS = (state_functions.coarse_manhattan_distance, state_functions.sector_distance_state)
+
+@pytest.mark.parametrize("state_function", STATE_FUNCTIONS, ids=lambda f: f.__name__)
+def test_undeclared_bytes_dont_change_the_key(state_function):
+    # A hit on a RAM that only differs in bytes the state function doesn't declare must be the key it'd compute
+    cache = StateKeyCache(state_function)
+    encode = codec_for(state_function).encode
+    rng = np.random.default_rng(0)
+    declared = np.zeros(128, dtype=bool)
+    declared[list(state_function.ram_bytes)] = True
+    prev_declared = np.zeros(128, dtype=bool)
+    prev_declared[list(state_function.prev_ram_bytes)] = True
+    for _ in range(200):
+        ram, prev_ram = rng.integers(0, 256, (2, 128), dtype=np.uint8)
+        cache(ram, prev_ram, 1)
+        ram[~declared] = rng.integers(0, 256, int((~declared).sum()))
+        prev_ram[~prev_declared] = rng.integers(0, 256, int((~prev_declared).sum()))
+        assert cache(ram, prev_ram, 1) == encode(state_function(ram, prev_ram, 1))
+    assert (cache.hits, cache.misses) == (200, 200)
+
+def test_lru_eviction_and_stats():
+    state_function = state_functions.sector_distance_state
+    cache = StateKeyCache(state_function, size=2)
+    rams = np.zeros((3, 128), dtype=np.uint8)
+    rams[:, state_function.ram_bytes[0]] = [1, 2, 3]
+    cache(rams[0], None, 0), cache(rams[1], None, 0), cache(rams[0], None, 0)
+    # rams[1] is the least recently used entry when rams[2] comes in
+    cache(rams[2], None, 0)
+    cache(rams[0], None, 0), cache(rams[1], None, 0)
+    # The previous action is part of the key
+    cache(rams[0], None, 1)
+    assert cache.stats() == dict(hits=2, misses=5, size=2, max_size=2)
+    assert cache.hit_rate() == pytest.approx(2 / 7)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from agent import state_functions
+from agent.state_codec import StateCodec, codec_for
+
+FIELDS = (("px", 6), ("vx", 2, 1), ("flag", 1), ("lives", 8))
+
+def _random_states(codec, n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        name: rng.integers(-offset, mask - offset + 1, n)
+        for name, (_, mask, offset) in ((name, codec.layout(name)) for name in codec.names)
+    }
+
+def test_round_trip():
+    codec = StateCodec(FIELDS)
+    states = _random_states(codec, 1000)
+    for i in range(1000):
+        state = {name: int(values[i]) for name, values in states.items()}
+        assert codec.decode(codec.encode(state)) == state
+
+def test_encode_many_matches_encode():
+    codec = StateCodec(FIELDS)
+    states = _random_states(codec, 500)
+    keys = codec.encode_many(states)
+    assert keys.tolist() == [codec.encode({name: int(values[i]) for name, values in states.items()}) for i in range(500)]
+    decoded = codec.decode_many(keys)
+    assert all(np.array_equal(decoded[name], states[name]) for name in codec.names)
+
+def test_offset_fields():
+    codec = StateCodec(FIELDS)
+    state = dict(px=63, vx=-1, flag=True, lives=255)
+    assert codec.decode(codec.encode(state)) == dict(px=63, vx=-1, flag=1, lives=255)
+    assert codec.layout("vx") == (6, 3, 1)
+    assert StateCodec((("vx", 2, 1),)).encode(dict(vx=-1)) == 0
+
+@pytest.mark.parametrize("field, value", [("px", 64), ("px", -1), ("vx", -2), ("vx", 3), ("flag", 2)])
+def test_out_of_range_raises(field, value):
+    codec = StateCodec(FIELDS)
+    state = dict(dict(px=0, vx=0, flag=0, lives=0), **{field: value})
+    with pytest.raises(ValueError, match=field):
+        codec.encode_checked(state)
+    with pytest.raises(ValueError, match=field):
+        StateCodec(FIELDS, check_ranges=True).encode(state)
+    with pytest.raises(ValueError, match=field):
+        codec.encode_many({name: np.array([0, v]) for name, v in state.items()})
+
+def test_encode_matches_encode_checked():
+    codec = StateCodec(FIELDS)
+    states = _random_states(codec, 200)
+    for i in range(200):
+        state = {name: values[i] for name, values in states.items()}
+        assert codec.encode({name: int(value) for name, value in state.items()}) == codec.encode_checked(state)
+
+# encode() takes the state functions' values as they come
+def test_state_function_values_encode_unchecked():
+    rams = np.random.default_rng(0).integers(0, 256, (50, 128), dtype=np.uint8)
+    for state_function in (state_functions.coarse_manhattan_distance, state_functions.sector_distance_state):
+        codec = codec_for(state_function)
+        for ram in rams:
+            state = state_function(ram, ram, np.int64(2))
+            assert codec.encode(state) == codec.encode_checked(state)
+
+def test_too_many_bits():
+    with pytest.raises(ValueError):
+        StateCodec((("a", 32), ("b", 32)))
+
+def test_encode_legacy():
+    codec = codec_for(state_functions.sector_distance_state)
+    state = {name: 1 for name in codec.names}
+    legacy_key = tuple(sorted(state.items()))
+    assert codec.encode_legacy(legacy_key) == codec.encode(state)
+
+def test_state_functions_fit_a_key():
+    for state_function in (
+        state_functions.coarse_manhattan_distance, state_functions.sector_distance_state, state_functions.maze_distance_state,
+    ):
+        assert codec_for(state_function).bits <= 63
@@ -0,0 +1,38 @@
+import random
+
+import numpy as np
+import pytest
+
+from agent import state_functions
+from emulator.game_env import MsPacmanALE
+
+STATE_FUNCTIONS = (state_functions.coarse_manhattan_distance, state_functions.sector_distance_state)
+
+def _random_rams(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    rams = rng.integers(0, 256, (n, 128), dtype=np.uint8)
+    prev_rams = rams.copy()
+    # Previous positions a few pixels off, or the same
+    prev_rams[:, :64] = np.clip(rams[:, :64].astype(np.int64) + rng.integers(-2, 3, (n, 64)), 0, 255)
+    return rams, prev_rams, rng.integers(0, 4, n)
+
+def _played_rams(steps=400, seed=0):
+    env = MsPacmanALE(seed=seed, frame_skip=2)
+    rng = random.Random(seed)
+    rams, prev_rams, prev_actions = [], [], []
+    ram, prev_action = env.reset(), 3
+    for _ in range(steps):
+        action = rng.randrange(4)
+        next_ram, _, done = env.step(action)
+        rams.append(next_ram.copy()), prev_rams.append(ram.copy()), prev_actions.append(prev_action)
+        ram, prev_action = (env.reset(), 3) if done else (next_ram, action)
+    return np.stack(rams), np.stack(prev_rams), np.array(prev_actions)
+
+@pytest.mark.parametrize("state_function", STATE_FUNCTIONS, ids=lambda f: f.__name__)
+@pytest.mark.parametrize("source", [_random_rams, _played_rams], ids=["random", "played"])
+def test_batch_matches_scalar(state_function, source):
+    rams, prev_rams, prev_actions = source()
+    batch = getattr(state_functions, state_function.__name__ + "_batch")(rams, prev_rams, prev_actions)
+    for i in range(len(rams)):
+        state = state_function(rams[i], prev_rams[i], int(prev_actions[i]))
+        assert {name: int(batch[name][i]) for name in batch.dtype.names} == {name: int(v) for name, v in state.items()}
@@ -0,0 +1,56 @@
+import pytest
+
+from agent.q_agent import QLearningAgent
+
+def _agent(**kwargs):
+    return QLearningAgent(4, **dict(dict(discount=1.0, alpha=0.5, trace_lambda=0.5, trace_cutoff=0.01), **kwargs))
+
+def _q(agent, key, action):
+    return float(agent.table.q[agent.table.find(key), action])
+
+def test_greedy_steps_pass_credit_back():
+    agent = _agent()
+    agent.update(1, 0, 0.0, 2, False)
+    agent.update(2, 0, 1.0, 3, False)
+    # td error 1 reaches (2, 0) w/ trace 1 and (1, 0) w/ trace lambda * discount
+    assert _q(agent, 2, 0) == pytest.approx(0.5)
+    assert _q(agent, 1, 0) == pytest.approx(0.25)
+
+def test_exploratory_action_cuts_traces():
+    agent = _agent()
+    agent.update(1, 0, 0.0, 2, False)
+    agent.update(2, 0, 1.0, 3, False)
+    agent.table.q[agent.table.row(3), 2] = 1.0
+    # Action 0 isn't greedy in state 3, older pairs stop being traced
+    agent.update(3, 0, 1.0, 4, False)
+    assert _q(agent, 1, 0) == pytest.approx(0.25)
+    assert _q(agent, 2, 0) == pytest.approx(0.5)
+    assert _q(agent, 3, 0) == pytest.approx(0.5)
+    assert agent._trace_rows.tolist() == [agent.table.find(3)]
+
+def test_terminal_clears_traces():
+    agent = _agent()
+    agent.update(1, 0, 0.0, 2, False)
+    agent.update(2, 1, 1.0, None, True)
+    assert len(agent._trace_rows) == 0
+    agent.update(5, 0, 1.0, 6, False)
+    assert _q(agent, 1, 0) == pytest.approx(0.25)
+
+def test_revisited_pair_restarts_trace():
+    agent = _agent()
+    agent.update(1, 0, 0.0, 1, False)
+    agent.update(1, 0, 0.0, 1, False)
+    assert agent._traces.tolist() == [pytest.approx(0.5)]
+
+def test_traces_below_cutoff_are_dropped():
+    agent = _agent(trace_cutoff=0.2)
+    agent.update(1, 0, 0.0, 2, False)
+    agent.update(2, 0, 0.0, 3, False)
+    agent.update(3, 0, 0.0, 4, False)
+    # (1, 0) is at 0.125 after 3 decays, below the cutoff
+    assert sorted(agent._trace_rows.tolist()) == [agent.table.find(2), agent.table.find(3)]
+
+def test_option_steps_decay_traces_by_their_length():
+    agent = QLearningAgent(4, discount=0.5, alpha=0.5, trace_lambda=1.0, trace_cutoff=0.01)
+    agent.update(1, 0, 0.0, 2, False, steps=2)
+    assert agent._traces.tolist() == [pytest.approx(0.25)]
@@ -0,0 +1,45 @@
+import random
+
+import numpy as np
+
+from agent import state_functions
+from agent.q_agent import QLearningAgent
+from agent.runner import run_episodes_vec
+from emulator.game_env import MsPacmanALE, VectorMsPacmanALE
+
+def test_sub_envs_match_single_envs_and_reset_themselves():
+    env = VectorMsPacmanALE(2, seed=3, frame_skip=4, end_when_life_lost=True)
+    singles = [MsPacmanALE(seed=3 + i, frame_skip=4, end_when_life_lost=True) for i in range(2)]
+    try:
+        rams = env.reset()
+        assert rams.shape == (2, 128) and rams.dtype == np.uint8
+        assert np.array_equal(rams, np.stack([single.reset() for single in singles]))
+        rng = random.Random(0)
+        dones = np.zeros(2, dtype=bool)
+        while not dones.all():
+            actions = [rng.randrange(4) for _ in range(2)]
+            rams, rewards, step_dones = env.step(actions)
+            for i, single in enumerate(singles):
+                ram, reward, done = single.step(actions[i])
+                assert (rewards[i], step_dones[i]) == (reward, done)
+                # A finished sub-env comes back w/ its next episode's first RAM
+                assert np.array_equal(rams[i], single.reset() if done else ram)
+            dones |= step_dones
+    finally:
+        env.close()
+
+def test_run_episodes_vec_counts_every_episode():
+    env = VectorMsPacmanALE(2, seed=0, frame_skip=4)
+    agent = QLearningAgent(4, seed=0)
+    ended = []
+    try:
+        rewards, steps = run_episodes_vec(
+            env, agent, state_functions.sector_distance_state, episodes=3, max_steps=50,
+            on_episode_end=lambda reward, length: ended.append((reward, length)),
+        )
+    finally:
+        env.close()
+    assert steps == [50, 50, 50] and len(rewards) == 3
+    assert ended == list(zip(rewards, steps))
+    # 1 update per sub-env step: both ran 2 episodes in lockstep, the 4th isn't returned
+    assert agent.total_steps == 200